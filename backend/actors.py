@@ -0,0 +1,135 @@
+from typing import Dict, Any, Callable, Awaitable, Hashable, List
+from collections import deque
+import time
+import asyncio
+
+
+class MailboxFull(Exception):
+    """The room already has as many queued messages as it is allowed."""
+
+
+class RateLimiter:
+    """Token bucket per client: `rate` messages per second on average, bursts up to `burst`."""
+
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self.buckets: Dict[str, List[float]] = {}  # client_id -> [tokens, last update]
+        self.rejected = 0
+
+    def allow(self, client_id: str, cost: float = 1.0) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        bucket = self.buckets.get(client_id)
+        if bucket is None:
+            bucket = self.buckets[client_id] = [self.burst, now]
+        tokens = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if tokens < cost:
+            bucket[0] = tokens
+            self.rejected += 1
+            return False
+        bucket[0] = tokens - cost
+        return True
+
+    def forget(self, client_id: str) -> None:
+        self.buckets.pop(client_id, None)
+
+
+class RoomActor:
+    """Runs one room's jobs one at a time, in the order they were submitted.
+
+    The task only exists while the mailbox has work, so idle rooms cost a
+    deque and nothing else. Jobs rarely suspend, so after time_slice seconds
+    of back-to-back jobs the actor yields: callers waiting on finished jobs,
+    socket writers and other rooms then run before the rest of the mailbox.
+    """
+
+    def __init__(self, key: Hashable, max_mailbox: int, on_idle: Callable[["RoomActor"], None],
+                 time_slice: float = 0.005):
+        self.key = key
+        self.max_mailbox = max_mailbox
+        self.time_slice = time_slice
+        self.on_idle = on_idle
+        self.mailbox = deque()
+        self.task = None
+        self.processed = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self.mailbox)
+
+    def submit(self, job: Callable[[], Awaitable[Any]], force: bool = False) -> asyncio.Future:
+        """Queue a job and return a future for its result.
+
+        force skips the mailbox bound; it is meant for housekeeping such as
+        disconnects, which must never be refused.
+        """
+        if not force and len(self.mailbox) >= self.max_mailbox:
+            raise MailboxFull(self.key)
+        future = asyncio.get_running_loop().create_future()
+        self.mailbox.append((job, future))
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return future
+
+    async def _run(self) -> None:
+        yield_at = time.monotonic() + self.time_slice
+        try:
+            while self.mailbox:
+                job, future = self.mailbox.popleft()
+                if future.cancelled():
+                    continue
+                try:
+                    result = await job()
+                except Exception as e:
+                    if not future.done():
+                        future.set_exception(e)
+                else:
+                    if not future.done():
+                        future.set_result(result)
+                self.processed += 1
+                if time.monotonic() >= yield_at:
+                    await asyncio.sleep(0)
+                    yield_at = time.monotonic() + self.time_slice
+        finally:
+            self.task = None
+            self.on_idle(self)
+
+
+class RoomScheduler:
+    """One RoomActor per room: a room's messages run in order, different rooms concurrently."""
+
+    def __init__(self, max_mailbox: int = 2048):
+        self.max_mailbox = max_mailbox
+        self.actors: Dict[Hashable, RoomActor] = {}
+        self.rejected = 0
+
+    def submit(self, key: Hashable, job: Callable[[], Awaitable[Any]], force: bool = False) -> asyncio.Future:
+        actor = self.actors.get(key)
+        if actor is None:
+            actor = self.actors[key] = RoomActor(key, self.max_mailbox, self._on_idle)
+        try:
+            return actor.submit(job, force)
+        except MailboxFull:
+            self.rejected += 1
+            raise
+
+    def _on_idle(self, actor: RoomActor) -> None:
+        # Work may have arrived between the last job and now; keep the actor then
+        if not actor.mailbox and self.actors.get(actor.key) is actor:
+            del self.actors[actor.key]
+
+    def depth(self, key: Hashable) -> int:
+        actor = self.actors.get(key)
+        return actor.depth if actor else 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "activeRooms": len(self.actors),
+            "queued": sum(actor.depth for actor in self.actors.values()),
+            "maxMailbox": self.max_mailbox,
+            "rejected": self.rejected,
+            "rooms": {str(key): actor.depth for key, actor in self.actors.items()}
+        }
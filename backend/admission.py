@@ -0,0 +1,111 @@
+from typing import Dict, Any, Callable, Awaitable, Tuple
+from collections import OrderedDict
+import os
+import time
+import asyncio
+from metrics import JOIN_QUEUE_WAIT_SECONDS
+
+
+class AdmissionQueue:
+    """Admits joinRoom requests at a steady rate and queues the rest in arrival order.
+
+    Joins pass straight through while tokens are left. Once the burst is used
+    up, later joins wait in line, and their clients are told their position
+    about once per update interval. A class that arrives in the same second
+    is then spread over a few seconds instead of all hitting the cold paths
+    together.
+    """
+
+    def __init__(self, on_admit: Callable[[str, Dict[str, Any]], Awaitable[Any]],
+                 on_position: Callable[[str, Dict[str, Any], Dict[str, Any]], Awaitable[None]] = None,
+                 rate: float = None, burst: float = None, update_interval: float = 1.0):
+        self.on_admit = on_admit
+        self.on_position = on_position
+        self.rate = rate if rate is not None else float(os.getenv("JOIN_RATE", "20"))
+        self.burst = burst or float(os.getenv("JOIN_BURST", "20"))
+        self.update_interval = update_interval
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.waiting: "OrderedDict[str, Tuple[Dict[str, Any], float]]" = OrderedDict()
+        self.task = None
+        self.admitted = 0
+        self.queued = 0
+        self.last_wait = 0.0
+
+    def admit(self, client_id: str, message: Dict[str, Any]) -> bool:
+        """True when the join may run now; otherwise it is queued and handed to on_admit later."""
+        if self.rate <= 0:
+            return True
+        if client_id in self.waiting:
+            # A repeated join keeps its place in line
+            self.waiting[client_id] = (message, self.waiting[client_id][1])
+            return False
+        self._refill()
+        if not self.waiting and self.tokens >= 1:
+            self.tokens -= 1
+            self.admitted += 1
+            return True
+        self.waiting[client_id] = (message, time.monotonic())
+        self.queued += 1
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return False
+
+    def forget(self, client_id: str) -> None:
+        self.waiting.pop(client_id, None)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def _run(self) -> None:
+        try:
+            next_update = 0.0
+            while self.waiting:
+                now = time.monotonic()
+                if now >= next_update:
+                    await self._announce()
+                    next_update = now + self.update_interval
+                self._refill()
+                if self.rate > 0 and self.tokens < 1:
+                    await asyncio.sleep(min((1 - self.tokens) / self.rate, max(0.0, next_update - now)))
+                    continue
+                self.tokens = max(0.0, self.tokens - 1)
+                client_id, (message, queued_at) = self.waiting.popitem(last=False)
+                self.admitted += 1
+                self.last_wait = now - queued_at
+                JOIN_QUEUE_WAIT_SECONDS.observe(self.last_wait)
+                try:
+                    await self.on_admit(client_id, message)
+                except Exception as e:
+                    print(f"Admitting {client_id} failed: {e}")
+        finally:
+            self.task = None
+
+    async def _announce(self) -> None:
+        if not self.on_position:
+            return
+        waiting = len(self.waiting)
+        for position, (client_id, (message, _)) in enumerate(list(self.waiting.items()), 1):
+            await self.on_position(client_id, message, {
+                "position": position,
+                "waiting": waiting,
+                "estimatedWait": round(position / self.rate, 1) if self.rate > 0 else 0
+            })
+
+    async def close(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.waiting.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "rate": self.rate,
+            "burst": self.burst,
+            "waiting": len(self.waiting),
+            "admitted": self.admitted,
+            "queued": self.queued,
+            "lastWaitSeconds": round(self.last_wait, 3)
+        }
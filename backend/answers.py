@@ -0,0 +1,202 @@
+from typing import Dict, Any, List, Optional, Tuple
+import os
+import time
+import asyncio
+from exam_store import ExamStore
+from metrics import ANSWERS_RECEIVED, ANSWERS_WRITTEN, ANSWER_FLUSH_SECONDS
+
+
+class AnswerAutosave:
+    """Coalesces answer autosaves in memory and writes them to the store in bulk.
+
+    Saves of the same question by the same student replace each other until
+    the next flush, which happens every flush_interval seconds, or at once
+    when max_pending answers are waiting or a student submits. Callers get a
+    future that resolves only after the flush holding their answers commits.
+    """
+
+    def __init__(self, store: ExamStore, flush_interval: float = None, max_pending: int = None):
+        self.store = store
+        self.flush_interval = flush_interval or float(os.getenv("ANSWER_FLUSH_INTERVAL", "1"))
+        self.max_pending = max_pending or int(os.getenv("ANSWER_FLUSH_SIZE", "500"))
+        self.pending: Dict[Tuple[str, str, str], Dict] = {}  # (exam_id, student_id, questionId) -> answer
+        self.pending_submissions: Dict[Tuple[str, str], Dict] = {}
+        self.waiters: List[asyncio.Future] = []
+        # (exam_id, student_id) known to be submitted, here or by another worker sharing the store
+        self.submitted = set()
+        self.task = None
+        self.urgent = None
+        self.received = 0
+        self.written = 0
+        self.flushes = 0
+        self.failed_flushes = 0
+        self.last_flush_seconds = 0.0
+        self.last_flush_rows = 0
+
+    def save(self, exam_id: str, student_id: str, answers: List[Dict[str, Any]]) -> asyncio.Future:
+        """Queue answers ({questionId, answer, seq}) and return a future for their durable write.
+
+        seq orders saves of one question; it defaults to the arrival time in ms.
+        """
+        if self.is_submitted(exam_id, student_id):
+            raise ValueError("Exam already submitted")
+        self._queue(exam_id, student_id, answers)
+        return self._wait(urgent=len(self.pending) >= self.max_pending)
+
+    def submit(self, exam_id: str, student_id: str, answers: Optional[List[Dict[str, Any]]] = None) -> asyncio.Future:
+        """Queue the final answers and the submission itself, and flush right away.
+
+        Saves are refused from the moment the submission is queued. If its
+        flush fails the submission is withdrawn, so the student can retry.
+        """
+        key = (exam_id, student_id)
+        submitted = self.is_submitted(exam_id, student_id)
+        if submitted and answers:
+            raise ValueError("Exam already submitted")
+        if answers:
+            self._queue(exam_id, student_id, answers)
+        if not submitted:
+            self.submitted.add(key)
+            self.pending_submissions[key] = {
+                "examId": exam_id,
+                "studentId": student_id,
+                "submittedAt": time.time()
+            }
+        return asyncio.ensure_future(self._settle_submission(key, self._wait(urgent=True)))
+
+    def is_submitted(self, exam_id: str, student_id: str) -> bool:
+        """Whether a submission is queued here or stored, possibly by another worker."""
+        key = (exam_id, student_id)
+        if key in self.submitted:
+            return True
+        if self.store.get_submission(exam_id, student_id):
+            self.submitted.add(key)
+            return True
+        return False
+
+    async def _settle_submission(self, key: Tuple[str, str], flushed: asyncio.Future) -> float:
+        try:
+            return await flushed
+        except Exception:
+            self.submitted.discard(key)
+            self.pending_submissions.pop(key, None)
+            raise
+
+    def _queue(self, exam_id: str, student_id: str, answers: List[Dict[str, Any]]) -> None:
+        now = time.time()
+        for item in answers:
+            question_id = str(item["questionId"])
+            seq = int(now * 1000 if item.get("seq") is None else item["seq"])
+            key = (exam_id, student_id, question_id)
+            self.received += 1
+            ANSWERS_RECEIVED.inc()
+            current = self.pending.get(key)
+            if current and current["seq"] > seq:
+                continue
+            self.pending[key] = {
+                "examId": exam_id,
+                "studentId": student_id,
+                "questionId": question_id,
+                "answer": item.get("answer"),
+                "seq": seq,
+                "savedAt": now
+            }
+
+    def flush(self) -> asyncio.Future:
+        """Write everything pending now."""
+        return self._wait(urgent=True)
+
+    def pending_answers(self, exam_id: str, student_id: str) -> Dict[str, Dict]:
+        return {
+            key[2]: answer for key, answer in self.pending.items()
+            if key[0] == exam_id and key[1] == student_id
+        }
+
+    def _wait(self, urgent: bool) -> asyncio.Future:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        if not self.pending and not self.pending_submissions:
+            future.set_result(time.time())
+            return future
+        self.waiters.append(future)
+        if self.urgent is None:
+            self.urgent = asyncio.Event()
+        if urgent:
+            self.urgent.set()
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+        return future
+
+    async def _run(self) -> None:
+        try:
+            while self.pending or self.pending_submissions:
+                if not self.urgent.is_set():
+                    try:
+                        await asyncio.wait_for(self.urgent.wait(), self.flush_interval)
+                    except asyncio.TimeoutError:
+                        pass
+                self.urgent.clear()
+                if not await self._flush():
+                    # Keep the data and retry on the next tick rather than spinning
+                    await asyncio.sleep(self.flush_interval)
+        finally:
+            self.task = None
+
+    async def _flush(self) -> bool:
+        answers, self.pending = self.pending, {}
+        submissions, self.pending_submissions = self.pending_submissions, {}
+        waiters, self.waiters = self.waiters, []
+
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            await loop.run_in_executor(
+                None, self.store.save_answers, list(answers.values()), list(submissions.values())
+            )
+        except Exception as e:
+            self.failed_flushes += 1
+            print(f"Answer flush failed: {e}")
+            # Newer saves that arrived meanwhile win over the ones being retried
+            for key, answer in answers.items():
+                self.pending.setdefault(key, answer)
+            for key, submission in submissions.items():
+                self.pending_submissions.setdefault(key, submission)
+            for waiter in waiters:
+                if not waiter.done():
+                    waiter.set_exception(RuntimeError("Answers could not be saved, please retry"))
+            return False
+
+        self.last_flush_seconds = time.perf_counter() - started
+        self.last_flush_rows = len(answers)
+        ANSWER_FLUSH_SECONDS.observe(self.last_flush_seconds)
+        ANSWERS_WRITTEN.inc(amount=len(answers))
+        self.written += len(answers)
+        self.flushes += 1
+        saved_at = time.time()
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(saved_at)
+        return True
+
+    async def close(self) -> None:
+        """Write whatever is still pending."""
+        if self.pending or self.pending_submissions:
+            await self.flush()
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "received": self.received,
+            "written": self.written,
+            "coalescingRatio": round(self.received / self.written, 2) if self.written else None,
+            "pending": len(self.pending),
+            "pendingSubmissions": len(self.pending_submissions),
+            "flushes": self.flushes,
+            "failedFlushes": self.failed_flushes,
+            "lastFlushSeconds": round(self.last_flush_seconds, 4),
+            "lastFlushRows": self.last_flush_rows,
+            "flushInterval": self.flush_interval,
+            "flushSize": self.max_pending
+        }
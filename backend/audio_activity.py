@@ -0,0 +1,177 @@
+from typing import Dict, Any, List, Optional, Callable, Awaitable
+import os
+import asyncio
+
+# Optional: without NumPy no audioActivity events are produced
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+# Full-scale amplitude of the signed 16-bit samples aiortc's Opus decoder produces
+FULL_SCALE = 32768.0
+SILENCE_DB = -100.0
+
+
+def window_levels(chunks: List[List["np.ndarray"]]) -> "np.ndarray":
+    """RMS level in dBFS of each stream's samples, computed for all streams at once.
+
+    chunks holds, per stream, the sample arrays received during the window.
+    Every stream is concatenated into one buffer and np.add.reduceat sums each
+    stream's energy in a single pass, whatever the number of streams.
+    """
+    arrays = [np.concatenate(stream).ravel() for stream in chunks]
+    lengths = np.array([len(a) for a in arrays], dtype=np.float64)
+    offsets = np.concatenate(([0], np.cumsum(lengths)[:-1])).astype(np.int64)
+    samples = np.concatenate(arrays).astype(np.float32) / FULL_SCALE
+    energy = np.add.reduceat(samples * samples, offsets, dtype=np.float64)
+    rms = np.sqrt(energy / lengths)
+    return 20.0 * np.log10(np.maximum(rms, 1e-5))
+
+
+class AudioLevelSink:
+    """Producer sink that keeps the raw samples of the current window."""
+
+    __slots__ = ("student_id", "chunks", "speaking", "quiet_windows")
+
+    def __init__(self, student_id: str):
+        self.student_id = student_id
+        self.chunks: List["np.ndarray"] = []
+        self.speaking = False
+        self.quiet_windows = 0
+
+    def push(self, frame: Any) -> None:
+        self.chunks.append(frame.to_ndarray())
+
+
+class RoomAudioActivity:
+    """Audio level tap for one room; attached to the room's router like the other taps."""
+
+    def __init__(self, monitor: "AudioActivityMonitor", room_id: str):
+        self.monitor = monitor
+        self.room_id = room_id
+        self.sinks: Dict[str, AudioLevelSink] = {}  # producer_id -> sink
+
+    def attach(self, producer, owner: Optional[str] = None) -> None:
+        if producer.kind != "audio" or not owner or producer.id in self.sinks:
+            return
+        sink = self.sinks[producer.id] = AudioLevelSink(owner)
+        producer.add_sink(sink)
+        self.monitor.wake()
+
+    def release(self, producer) -> None:
+        sink = self.sinks.pop(producer.id, None)
+        if sink:
+            producer.remove_sink(sink)
+
+    def evaluate(self) -> List[Dict[str, Any]]:
+        """Close the current window and return the audioActivity events it produced.
+
+        A student starts speaking when a window is louder than the on threshold
+        and stops after `hangover` windows below the off threshold, so short
+        pauses between words do not flap the indicator.
+        """
+        active = [sink for sink in self.sinks.values() if sink.chunks]
+        events = []
+        # Streams that sent nothing this window are silent
+        for sink in self.sinks.values():
+            if sink.speaking and not sink.chunks:
+                events.extend(self._update(sink, SILENCE_DB))
+        if active:
+            levels = window_levels([sink.chunks for sink in active])
+            for sink, level in zip(active, levels.tolist()):
+                sink.chunks = []
+                events.extend(self._update(sink, level))
+        return events
+
+    def _update(self, sink: AudioLevelSink, level: float) -> List[Dict[str, Any]]:
+        monitor = self.monitor
+        if level >= monitor.on_threshold:
+            sink.quiet_windows = 0
+            sink.speaking = True
+        elif sink.speaking and level < monitor.off_threshold:
+            sink.quiet_windows += 1
+            if sink.quiet_windows >= monitor.hangover:
+                sink.speaking = False
+                sink.quiet_windows = 0
+                return [{"studentId": sink.student_id, "level": round(level, 1), "speaking": False}]
+        if sink.speaking:
+            return [{"studentId": sink.student_id, "level": round(level, 1), "speaking": True}]
+        return []
+
+
+class AudioActivityMonitor:
+    """Evaluates every room's audio once per window from a single task.
+
+    The task only runs while some room has audio producers attached.
+    """
+
+    def __init__(self, on_activity: Callable[[str, List[Dict[str, Any]]], Awaitable[None]] = None,
+                 window: float = None, on_threshold: float = None, off_threshold: float = None,
+                 hangover: int = None):
+        self.on_activity = on_activity
+        self.window = window if window is not None else float(os.getenv("AUDIO_ACTIVITY_WINDOW", "0.5"))
+        self.on_threshold = on_threshold if on_threshold is not None else float(os.getenv("AUDIO_ACTIVITY_ON_DB", "-40"))
+        self.off_threshold = off_threshold if off_threshold is not None else float(os.getenv("AUDIO_ACTIVITY_OFF_DB", "-50"))
+        self.hangover = hangover or int(os.getenv("AUDIO_ACTIVITY_HANGOVER", "3"))
+        self.rooms: Dict[str, RoomAudioActivity] = {}
+        self.task = None
+        self.windows = 0
+        self.events = 0
+
+    @property
+    def enabled(self) -> bool:
+        return np is not None and self.window > 0
+
+    def for_room(self, room_id: str) -> Optional[RoomAudioActivity]:
+        if not self.enabled:
+            return None
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = RoomAudioActivity(self, room_id)
+        return room
+
+    def close_room(self, room_id: str) -> None:
+        self.rooms.pop(room_id, None)
+
+    def wake(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while any(room.sinks for room in self.rooms.values()):
+                await asyncio.sleep(self.window)
+                self.windows += 1
+                for room in list(self.rooms.values()):
+                    try:
+                        events = room.evaluate()
+                    except Exception as e:
+                        print(f"Audio activity failed for room {room.room_id}: {e}")
+                        for sink in room.sinks.values():
+                            sink.chunks = []
+                        continue
+                    if events and self.on_activity:
+                        self.events += len(events)
+                        await self.on_activity(room.room_id, events)
+        finally:
+            self.task = None
+
+    async def close(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+        self.rooms.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "window": self.window,
+            "streams": sum(len(room.sinks) for room in self.rooms.values()),
+            "speaking": [
+                {"roomId": room.room_id, "studentId": sink.student_id}
+                for room in self.rooms.values() for sink in room.sinks.values() if sink.speaking
+            ],
+            "windows": self.windows,
+            "events": self.events
+        }
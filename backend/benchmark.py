@@ -0,0 +1,459 @@
+"""Signaling load generator.
+
+Drives WebRTCSignaling.handle_message with simulated WebSockets and reports
+handler latency, fan-out completion time, event-loop lag and memory per
+participant. Media transports are simulated by default so the numbers measure
+signaling work only; pass --real-media to build real aiortc transports.
+
+    python benchmark.py                        # all scenarios at 50, 200, 1000
+    python benchmark.py -n 200 -s join_storm   # one scenario, one size
+    python benchmark.py --endpoint -n 50       # through the FastAPI /ws endpoint
+"""
+from typing import Dict, Any, List, Optional
+import os
+import gc
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tracemalloc
+from collections import defaultdict
+
+from signaling import WebRTCSignaling
+from webrtc import WebRTCManager, WebRTCTransport
+
+SIMULATED_SDP = "\r\n".join([
+    "v=0",
+    "a=ice-ufrag:bench",
+    "a=ice-pwd:benchmarkpassword000000",
+    "a=fingerprint:sha-256 00:11:22:33:44:55:66:77:88:99:AA:BB:CC:DD:EE:FF:00:11:22:33:44:55:66:77:88:99:AA:BB:CC:DD:EE:FF",
+    "a=candidate:1 1 UDP 2130706431 127.0.0.1 40000 typ host",
+    ""
+])
+
+
+class SimulatedDescription:
+    def __init__(self, sdp: str):
+        self.sdp = sdp
+        self.type = "offer"
+
+
+class SimulatedPeerConnection:
+    """Just enough of RTCPeerConnection for WebRTCTransport, without sockets or crypto."""
+
+    def __init__(self):
+        self.localDescription = SimulatedDescription(SIMULATED_SDP)
+        self.iceGatheringState = "complete"
+        self.connectionState = "new"
+        # Clients in the benchmark never answer over SDP, so no renegotiation happens
+        self.signalingState = "have-local-offer"
+        self.tracks = []
+
+    def on(self, event, handler=None):
+        return handler if handler else (lambda f: f)
+
+    def getTransceivers(self):
+        return []
+
+    def addTrack(self, track):
+        self.tracks.append(track)
+
+    async def close(self):
+        self.connectionState = "closed"
+
+
+class SimulatedWebRTCManager(WebRTCManager):
+    async def build_transport(self, router) -> WebRTCTransport:
+        return WebRTCTransport(router, SimulatedPeerConnection())
+
+
+class SimulatedSocket:
+    """Records what the server sends; optionally slow to mimic a stalled client."""
+
+    def __init__(self, delay: float = 0.0):
+        self.delay = delay
+        self.received: List[Dict[str, Any]] = []
+        self.counts: Dict[str, int] = defaultdict(int)
+        self.sending = False
+
+    async def send_text(self, text: str) -> None:
+        await self._deliver(json.loads(text))
+
+    async def send_json(self, message: Dict[str, Any]) -> None:
+        await self._deliver(message)
+
+    async def _deliver(self, message: Dict[str, Any]) -> None:
+        self.sending = True
+        try:
+            if self.delay:
+                await asyncio.sleep(self.delay)
+            self.received.append(message)
+            self.counts[message.get("type")] += 1
+        finally:
+            self.sending = False
+
+    async def close(self) -> None:
+        pass
+
+    def last(self, msg_type: str) -> Optional[Dict[str, Any]]:
+        for message in reversed(self.received):
+            if message.get("type") == msg_type:
+                return message
+        return None
+
+
+class LoopLagMonitor:
+    """Measures how late a periodic timer fires, i.e. how long the loop was blocked."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: List[float] = []
+        self.expected = 0.0
+        self.task = None
+
+    def start(self) -> None:
+        self.expected = asyncio.get_running_loop().time() + self.interval
+        self.task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        # A loop blocked until now never let the timer fire; count that stall too
+        self.samples.append(max(0.0, asyncio.get_running_loop().time() - self.expected))
+        self.task.cancel()
+        try:
+            await self.task
+        except asyncio.CancelledError:
+            pass
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self.expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, loop.time() - self.expected))
+
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+class Bench:
+    """One scenario run against a fresh WebRTCSignaling instance."""
+
+    def __init__(self, real_media: bool = False):
+        self.signaling = WebRTCSignaling()
+        if not real_media:
+            self.signaling.webrtc_manager = SimulatedWebRTCManager(pool_size=0)
+        # Scenarios fire far more messages per client than a browser would
+        self.signaling.rate_limiter.rate = 0
+        # Join storms measure the signaling paths themselves, not the admission pacing
+        self.signaling.admission.rate = 0
+        # Disconnect scenarios measure leaving the room, not holding sessions for a resume
+        self.signaling.session_grace = 0
+        self.sockets: Dict[str, SimulatedSocket] = {}
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.lag = LoopLagMonitor()
+
+    async def connect(self, client_id: str, delay: float = 0.0) -> SimulatedSocket:
+        socket = SimulatedSocket(delay)
+        self.sockets[client_id] = socket
+        await self.signaling.register_connection(client_id, socket)
+        return socket
+
+    async def send(self, client_id: str, msg_type: str, data: Dict[str, Any]) -> None:
+        start = time.perf_counter()
+        await self.signaling.handle_message(client_id, {"type": msg_type, "data": data})
+        self.latencies[msg_type].append(time.perf_counter() - start)
+
+    async def drain(self, client_ids: Optional[List[str]] = None, timeout: float = 60.0) -> float:
+        """Wait until every outbound queue is empty; returns how long that took."""
+        start = time.perf_counter()
+        writers = self.signaling.fanout.writers
+        ids = client_ids if client_ids is not None else list(writers)
+        while time.perf_counter() - start < timeout:
+            busy = any(
+                (cid in writers and writers[cid].depth) or self.sockets[cid].sending
+                for cid in ids if cid in self.sockets
+            )
+            if not busy:
+                break
+            await asyncio.sleep(0)
+        return time.perf_counter() - start
+
+    async def join_all(self, room: str, client_ids: List[str], role: str = "student") -> None:
+        await asyncio.gather(*(
+            self.send(cid, "joinRoom", {"room": room, "username": cid, "role": role})
+            for cid in client_ids
+        ))
+
+    async def produce_all(self, client_ids: List[str]) -> None:
+        async def produce(cid: str) -> None:
+            await self.send(cid, "createWebRtcTransport", {"sender": True})
+            await self.drain([cid])
+            transport = self.sockets[cid].last("transportCreated")
+            if not transport:
+                return
+            await self.send(cid, "produce", {
+                "transportId": transport["data"]["id"],
+                "kind": "video",
+                "rtpParameters": {"codecs": [{"mimeType": "video/VP8", "clockRate": 90000, "payloadType": 96}]}
+            })
+
+        await asyncio.gather(*(produce(cid) for cid in client_ids))
+
+    async def consume_transport(self, client_id: str) -> Optional[str]:
+        await self.send(client_id, "createWebRtcTransport", {"sender": False})
+        await self.drain([client_id])
+        transport = self.sockets[client_id].last("transportCreated")
+        return transport["data"]["id"] if transport else None
+
+    def rtp_capabilities(self) -> Dict[str, Any]:
+        room = next(iter(self.signaling.rooms.values()))
+        return room["router"].rtp_capabilities
+
+    def report(self, scenario: str, participants: int, extra: Dict[str, Any]) -> Dict[str, Any]:
+        handlers = {
+            msg_type: {
+                "count": len(values),
+                "p50_ms": round(percentile(values, 50) * 1000, 3),
+                "p99_ms": round(percentile(values, 99) * 1000, 3)
+            }
+            for msg_type, values in self.latencies.items()
+        }
+        result = {
+            "scenario": scenario,
+            "participants": participants,
+            "handlers": handlers,
+            "loop_lag_p99_ms": round(percentile(self.lag.samples, 99) * 1000, 3),
+            "loop_lag_max_ms": round(max(self.lag.samples or [0.0]) * 1000, 3)
+        }
+        result.update(extra)
+        return result
+
+
+async def join_storm(n: int, real_media: bool) -> Dict[str, Any]:
+    """n students join one room at once; every join is broadcast to the room."""
+    bench = Bench(real_media)
+    ids = [f"student-{i}" for i in range(n)]
+    for cid in ids:
+        await bench.connect(cid)
+
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    bench.lag.start()
+    start = time.perf_counter()
+    await bench.join_all("bench-room", ids)
+    fanout = await bench.drain()
+    total = time.perf_counter() - start
+    await bench.lag.stop()
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    grown = sum(stat.size_diff for stat in after.compare_to(before, "filename"))
+    delivered = sum(s.counts["userJoined"] for s in bench.sockets.values())
+    return bench.report("join_storm", n, {
+        "fanout_drain_ms": round(fanout * 1000, 3),
+        "total_ms": round(total * 1000, 3),
+        "userJoined_delivered": delivered,
+        "memory_per_participant_kb": round(grown / n / 1024, 2)
+    })
+
+
+async def produce_consume_storm(n: int, real_media: bool) -> Dict[str, Any]:
+    """Every student produces, then a teacher consumes each stream one message at a time."""
+    bench = Bench(real_media)
+    ids = [f"student-{i}" for i in range(n)]
+    for cid in ids + ["teacher"]:
+        await bench.connect(cid)
+    await bench.join_all("bench-room", ["teacher"], role="teacher")
+    await bench.join_all("bench-room", ids)
+    await bench.drain()
+
+    bench.lag.start()
+    start = time.perf_counter()
+    await bench.produce_all(ids)
+    produce_fanout = await bench.drain()
+    produce_total = time.perf_counter() - start
+
+    transport_id = await bench.consume_transport("teacher")
+    capabilities = bench.rtp_capabilities()
+    producers = [m["data"]["producerId"] for m in bench.sockets["teacher"].received if m["type"] == "newProducer"]
+    start = time.perf_counter()
+    for producer_id in producers:
+        await bench.send("teacher", "consume", {
+            "transportId": transport_id, "producerId": producer_id, "rtpCapabilities": capabilities
+        })
+        await bench.drain(["teacher"])
+        created = bench.sockets["teacher"].last("consumerCreated")
+        if created:
+            await bench.send("teacher", "resumeConsumer", {"consumerId": created["data"]["id"]})
+    await bench.drain()
+    consume_total = time.perf_counter() - start
+
+    start = time.perf_counter()
+    await bench.send("teacher", "consumeAll", {"transportId": transport_id, "rtpCapabilities": capabilities})
+    await bench.drain()
+    consume_all_total = time.perf_counter() - start
+    await bench.lag.stop()
+
+    return bench.report("produce_consume_storm", n, {
+        "produce_total_ms": round(produce_total * 1000, 3),
+        "produce_fanout_drain_ms": round(produce_fanout * 1000, 3),
+        "consume_sequential_ms": round(consume_total * 1000, 3),
+        "consume_all_ms": round(consume_all_total * 1000, 3),
+        "producers": len(producers)
+    })
+
+
+async def mass_disconnect(n: int, real_media: bool) -> Dict[str, Any]:
+    """Everyone but the teacher drops at once; each departure is broadcast."""
+    bench = Bench(real_media)
+    ids = [f"student-{i}" for i in range(n)]
+    for cid in ids + ["teacher"]:
+        await bench.connect(cid)
+    await bench.join_all("bench-room", ["teacher"] + ids)
+    await bench.drain()
+
+    bench.lag.start()
+    start = time.perf_counter()
+    latencies = bench.latencies["disconnect"]
+
+    async def disconnect(cid: str) -> None:
+        began = time.perf_counter()
+        await bench.signaling.handle_disconnect(cid)
+        latencies.append(time.perf_counter() - began)
+
+    await asyncio.gather(*(disconnect(cid) for cid in ids))
+    fanout = await bench.drain(["teacher"])
+    total = time.perf_counter() - start
+    await bench.lag.stop()
+
+    return bench.report("mass_disconnect", n, {
+        "fanout_drain_ms": round(fanout * 1000, 3),
+        "total_ms": round(total * 1000, 3),
+        "teacher_userLeft": bench.sockets["teacher"].counts["userLeft"],
+        "dropped_messages": sum(w.dropped for w in bench.signaling.fanout.writers.values())
+    })
+
+
+async def slow_consumers(n: int, real_media: bool, slow_fraction: float = 0.1,
+                         slow_delay: float = 0.05) -> Dict[str, Any]:
+    """A share of sockets stall on every send; fast sockets should not notice."""
+    bench = Bench(real_media)
+    ids = [f"student-{i}" for i in range(n)]
+    slow_every = max(1, int(round(1 / slow_fraction))) if slow_fraction else 0
+    slow = {cid for i, cid in enumerate(ids) if slow_every and i % slow_every == 0}
+    for cid in ids:
+        await bench.connect(cid, delay=slow_delay if cid in slow else 0.0)
+
+    bench.lag.start()
+    start = time.perf_counter()
+    await bench.join_all("bench-room", ids)
+    fast = [cid for cid in ids if cid not in slow]
+    fast_fanout = await bench.drain(fast)
+    fast_total = time.perf_counter() - start
+    await bench.lag.stop()
+
+    depths = bench.signaling.queue_depths()
+    dropped = sum(w.dropped for w in bench.signaling.fanout.writers.values())
+    return bench.report("slow_consumers", n, {
+        "slow_clients": len(slow),
+        "fast_clients_done_ms": round(fast_total * 1000, 3),
+        "fast_fanout_drain_ms": round(fast_fanout * 1000, 3),
+        "max_slow_queue_depth": max((depths.get(cid, 0) for cid in slow), default=0),
+        "dropped_messages": dropped,
+        "policy": bench.signaling.fanout.policy
+    })
+
+
+SCENARIOS = {
+    "join_storm": join_storm,
+    "produce_consume_storm": produce_consume_storm,
+    "mass_disconnect": mass_disconnect,
+    "slow_consumers": slow_consumers
+}
+
+
+def run_endpoint(n: int) -> Dict[str, Any]:
+    """Join n clients through the real /ws endpoint using Starlette's test client."""
+    from starlette.testclient import TestClient
+    from main import app, signaling_service
+
+    # As in Bench: measure the endpoint, not the admission pacing
+    signaling_service.admission.rate = 0
+
+    join_times = []
+    with TestClient(app) as client:
+        sockets = []
+        try:
+            for i in range(n):
+                ws = client.websocket_connect("/ws").__enter__()
+                sockets.append(ws)
+                start = time.perf_counter()
+                ws.send_json({"type": "joinRoom", "data": {"room": "bench-endpoint", "username": f"s{i}", "role": "student"}})
+                while ws.receive_json().get("type") != "roomJoined":
+                    pass
+                join_times.append(time.perf_counter() - start)
+        finally:
+            for ws in sockets:
+                ws.__exit__(None, None, None)
+
+    return {
+        "scenario": "endpoint_join",
+        "participants": n,
+        "join_p50_ms": round(percentile(join_times, 50) * 1000, 3),
+        "join_p99_ms": round(percentile(join_times, 99) * 1000, 3)
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description="Load-test WebRTCSignaling in-process")
+    parser.add_argument("-n", "--participants", type=int, nargs="+", default=[50, 200, 1000])
+    parser.add_argument("-s", "--scenario", choices=sorted(SCENARIOS) + ["all"], default="all")
+    parser.add_argument("--real-media", action="store_true", help="build real aiortc transports")
+    parser.add_argument("--endpoint", action="store_true", help="drive the FastAPI /ws endpoint instead")
+    parser.add_argument("--json", action="store_true", help="print one JSON object per result")
+    args = parser.parse_args(argv)
+
+    # Benchmarks only measure this process; keep signaling output quiet
+    devnull = open(os.devnull, "w")
+    results = []
+    for n in args.participants:
+        if args.endpoint:
+            sys.stdout, stdout = devnull, sys.stdout
+            try:
+                results.append(run_endpoint(n))
+            finally:
+                sys.stdout = stdout
+            continue
+        names = sorted(SCENARIOS) if args.scenario == "all" else [args.scenario]
+        for name in names:
+            sys.stdout, stdout = devnull, sys.stdout
+            try:
+                results.append(asyncio.run(SCENARIOS[name](n, args.real_media)))
+            finally:
+                sys.stdout = stdout
+
+    for result in results:
+        if args.json:
+            print(json.dumps(result))
+        else:
+            print(f"{result['scenario']} n={result['participants']}")
+            for key, value in result.items():
+                if key in ("scenario", "participants"):
+                    continue
+                if key == "handlers":
+                    for msg_type, stats in value.items():
+                        print(f"  {msg_type:<24} count={stats['count']:<6} p50={stats['p50_ms']}ms p99={stats['p99_ms']}ms")
+                else:
+                    print(f"  {key:<24} {value}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
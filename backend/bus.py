@@ -0,0 +1,278 @@
+from typing import Dict, Any, List, Callable, Awaitable, Collection, Optional, Tuple
+import abc
+import os
+import json
+import glob
+import time
+import fcntl
+import asyncio
+import hashlib
+import itertools
+
+Handler = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+class MessageBus(abc.ABC):
+    """Point-to-point channels between signaling workers.
+
+    Messages published to a channel are delivered in order to the handler
+    subscribed to it, which may live in another process.
+    """
+
+    async def start(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    @abc.abstractmethod
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def channels(self, prefix: str = "") -> List[str]:
+        """Channels that currently have a subscriber."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def worker_slot(self) -> str:
+        """A worker number no other live process on this bus holds.
+
+        The lowest free number is handed out, so a restarted worker takes the
+        number of the one it replaces.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def claim(self, key: str, owner: str, ttl: float, live: Collection[str]) -> str:
+        """Lease key to owner for ttl seconds unless someone else holds it; returns the holder.
+
+        A lease held by owner is renewed. A lease that expired, or whose holder
+        is not in live, is taken over.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def lease_holder(self, key: str) -> Optional[str]:
+        """Who holds an unexpired lease on key, if anyone."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    async def release(self, key: str, owner: str) -> None:
+        """Drop owner's lease on key; a lease held by someone else is left alone."""
+        raise NotImplementedError
+
+
+def takes_over(lease: Optional[Tuple[str, float]], owner: str, live: Collection[str], now: float) -> bool:
+    if lease is None:
+        return True
+    holder, expires = lease
+    return holder == owner or expires <= now or holder not in live
+
+
+class InProcessBus(MessageBus):
+    """Bus for workers sharing one event loop; handy for tests and single-process runs."""
+
+    def __init__(self):
+        self.handlers: Dict[str, Handler] = {}
+        self.queues: Dict[str, asyncio.Queue] = {}
+        self.tasks: Dict[str, asyncio.Task] = {}
+        self.leases: Dict[str, Tuple[str, float]] = {}
+        self.slots = itertools.count()
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        self.handlers[channel] = handler
+        self.queues[channel] = asyncio.Queue()
+        self.tasks[channel] = asyncio.create_task(self._dispatch(channel))
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        queue = self.queues.get(channel)
+        if queue is None:
+            raise ConnectionError(f"No subscriber for channel {channel}")
+        queue.put_nowait(message)
+
+    def channels(self, prefix: str = "") -> List[str]:
+        return sorted(c for c in self.handlers if c.startswith(prefix))
+
+    def worker_slot(self) -> str:
+        return str(next(self.slots))
+
+    async def claim(self, key: str, owner: str, ttl: float, live: Collection[str]) -> str:
+        now = time.monotonic()
+        if takes_over(self.leases.get(key), owner, live, now):
+            self.leases[key] = (owner, now + ttl)
+        return self.leases[key][0]
+
+    async def lease_holder(self, key: str) -> Optional[str]:
+        holder, expires = self.leases.get(key, (None, 0.0))
+        return holder if expires > time.monotonic() else None
+
+    async def release(self, key: str, owner: str) -> None:
+        if self.leases.get(key, (None,))[0] == owner:
+            del self.leases[key]
+
+    async def close(self) -> None:
+        for task in self.tasks.values():
+            task.cancel()
+        self.handlers.clear()
+        self.queues.clear()
+        self.tasks.clear()
+
+    async def _dispatch(self, channel: str) -> None:
+        queue = self.queues[channel]
+        handler = self.handlers[channel]
+        while True:
+            message = await queue.get()
+            try:
+                await handler(message)
+            except Exception as e:
+                print(f"Error handling bus message on {channel}: {e}")
+
+
+class LocalSocketBus(MessageBus):
+    """Bus between processes on one host over Unix domain sockets.
+
+    Every subscribed channel listens on <socket_dir>/<channel>.sock, so the set
+    of live channels is simply the set of socket files. Messages are written as
+    newline-delimited JSON. Leases are small JSON files under <socket_dir>/leases,
+    read and written under an flock so workers never see half a claim.
+    """
+
+    def __init__(self, socket_dir: str):
+        self.socket_dir = socket_dir
+        self.servers: Dict[str, asyncio.AbstractServer] = {}
+        self.writers: Dict[str, asyncio.StreamWriter] = {}
+        self.locks: Dict[str, asyncio.Lock] = {}
+        self.incoming = set()
+        self.slot_fd: Optional[int] = None
+
+    async def start(self) -> None:
+        os.makedirs(os.path.join(self.socket_dir, "leases"), exist_ok=True)
+
+    def _path(self, channel: str) -> str:
+        return os.path.join(self.socket_dir, f"{channel}.sock")
+
+    async def subscribe(self, channel: str, handler: Handler) -> None:
+        path = self._path(channel)
+        if os.path.exists(path):
+            os.unlink(path)
+
+        async def on_connection(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+            self.incoming.add(writer)
+            try:
+                while True:
+                    line = await reader.readline()
+                    if not line:
+                        break
+                    try:
+                        await handler(json.loads(line))
+                    except Exception as e:
+                        print(f"Error handling bus message on {channel}: {e}")
+            finally:
+                self.incoming.discard(writer)
+                writer.close()
+
+        self.servers[channel] = await asyncio.start_unix_server(on_connection, path=path)
+
+    async def publish(self, channel: str, message: Dict[str, Any]) -> None:
+        data = json.dumps(message, separators=(",", ":")).encode() + b"\n"
+        lock = self.locks.setdefault(channel, asyncio.Lock())
+        async with lock:
+            for attempt in range(2):
+                writer = self.writers.get(channel)
+                try:
+                    if writer is None:
+                        _, writer = await asyncio.open_unix_connection(self._path(channel))
+                        self.writers[channel] = writer
+                    writer.write(data)
+                    await writer.drain()
+                    return
+                except OSError as e:
+                    # Reconnect once; a refused connection means the worker is gone
+                    self.writers.pop(channel, None)
+                    if attempt:
+                        if isinstance(e, ConnectionRefusedError) and os.path.exists(self._path(channel)):
+                            os.unlink(self._path(channel))
+                        raise ConnectionError(f"No subscriber for channel {channel}")
+
+    def channels(self, prefix: str = "") -> List[str]:
+        paths = glob.glob(os.path.join(self.socket_dir, f"{prefix}*.sock"))
+        return sorted(os.path.basename(p)[:-len(".sock")] for p in paths)
+
+    def worker_slot(self) -> str:
+        # The flock is held for the life of the process, so the kernel frees the slot if it dies
+        for index in itertools.count():
+            fd = os.open(os.path.join(self.socket_dir, f"slot-{index}.lock"), os.O_CREAT | os.O_RDWR, 0o600)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            self.slot_fd = fd
+            return str(index)
+
+    def _lease_path(self, key: str) -> str:
+        # Room ids come from clients, so they never become file names directly
+        return os.path.join(self.socket_dir, "leases", hashlib.sha1(key.encode()).hexdigest())
+
+    def _read_lease(self, path: str) -> Optional[Tuple[str, float]]:
+        try:
+            with open(path) as f:
+                lease = json.load(f)
+            return lease["owner"], lease["expires"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    # The flock waits on other workers and the files sit on disk, so lease
+    # operations run on the default executor rather than the event loop
+
+    async def claim(self, key: str, owner: str, ttl: float, live: Collection[str]) -> str:
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, self._claim, key, owner, ttl, frozenset(live))
+
+    async def lease_holder(self, key: str) -> Optional[str]:
+        loop = asyncio.get_running_loop()
+        lease = await loop.run_in_executor(None, self._read_lease, self._lease_path(key))
+        return lease[0] if lease and lease[1] > time.time() else None
+
+    async def release(self, key: str, owner: str) -> None:
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(None, self._release, key, owner)
+
+    def _claim(self, key: str, owner: str, ttl: float, live: Collection[str]) -> str:
+        path = self._lease_path(key)
+        with open(os.path.join(self.socket_dir, "leases.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            lease = self._read_lease(path)
+            now = time.time()
+            if not takes_over(lease, owner, live, now):
+                return lease[0]
+            with open(f"{path}.tmp", "w") as f:
+                json.dump({"key": key, "owner": owner, "expires": now + ttl}, f)
+            os.replace(f"{path}.tmp", path)
+            return owner
+
+    def _release(self, key: str, owner: str) -> None:
+        path = self._lease_path(key)
+        with open(os.path.join(self.socket_dir, "leases.lock"), "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            lease = self._read_lease(path)
+            if lease and lease[0] == owner:
+                os.unlink(path)
+
+    async def close(self) -> None:
+        for writer in list(self.writers.values()) + list(self.incoming):
+            writer.close()
+        self.writers.clear()
+        for channel, server in self.servers.items():
+            server.close()
+            if os.path.exists(self._path(channel)):
+                os.unlink(self._path(channel))
+        self.servers.clear()
+        if self.slot_fd is not None:
+            os.close(self.slot_fd)
+            self.slot_fd = None
@@ -0,0 +1,116 @@
+from typing import Dict, Any, Optional, Tuple
+from collections import OrderedDict
+import gzip
+import json
+
+try:
+    import brotli
+except ImportError:  # brotli is optional; gzip is always available
+    brotli = None
+
+# Fields students must not see
+TEACHER_ONLY_FIELDS = ("participants",)
+TEACHER_ONLY_QUESTION_FIELDS = ("answer", "answers", "correctAnswer", "correctOption", "solution", "explanation")
+
+VIEWS = ("full", "student")
+
+
+def student_view(exam: Dict) -> Dict:
+    """Copy of an exam without answer keys or the participant list."""
+    view = {k: v for k, v in exam.items() if k not in TEACHER_ONLY_FIELDS}
+    view["questions"] = [
+        {k: v for k, v in question.items() if k not in TEACHER_ONLY_QUESTION_FIELDS}
+        if isinstance(question, dict) else question
+        for question in exam.get("questions") or []
+    ]
+    return view
+
+
+class CachedPayload:
+    """One exam view encoded once, in every content encoding we serve."""
+
+    __slots__ = ("version", "revision", "etags", "bodies")
+
+    def __init__(self, exam: Dict, view: str, revision: str):
+        payload = student_view(exam) if view == "student" else exam
+        # Same encoding as FastAPI's JSONResponse
+        body = json.dumps(payload, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+        self.version = exam.get("version", 1)
+        self.revision = revision
+        self.bodies = {"identity": body, "gzip": gzip.compress(body, compresslevel=6)}
+        if brotli is not None:
+            self.bodies["br"] = brotli.compress(body)
+        # Each encoding is a different byte sequence, so each gets its own strong ETag
+        tag = f'{exam["id"]}-{self.version}-{view}'
+        self.etags = {
+            encoding: f'"{tag}"' if encoding == "identity" else f'"{tag}-{encoding}"'
+            for encoding in self.bodies
+        }
+
+    def body_for(self, accept_encoding: str) -> Tuple[bytes, Optional[str], str]:
+        """Pick the smallest body the client accepts; returns it with its encoding and ETag."""
+        accepted = {part.split(";")[0].strip().lower() for part in (accept_encoding or "").split(",")}
+        for encoding in ("br", "gzip"):
+            if encoding in accepted and encoding in self.bodies:
+                return self.bodies[encoding], encoding, self.etags[encoding]
+        return self.bodies["identity"], None, self.etags["identity"]
+
+
+class ExamPayloadCache:
+    """Versioned LRU cache of pre-encoded exam bodies.
+
+    Entries remember the store revision they were validated against. While the
+    revision is unchanged an entry is served without touching the store; once
+    it moves, the exam's version decides whether the entry is still good.
+    """
+
+    def __init__(self, exam_service, max_entries: int = 256):
+        self.exam_service = exam_service
+        self.max_entries = max_entries
+        self.entries: "OrderedDict[Tuple[str, str], CachedPayload]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    def get(self, exam_id: str, view: str = "student") -> Optional[CachedPayload]:
+        key = (exam_id, view)
+        revision, _ = self.exam_service.store.revision()
+        entry = self.entries.get(key)
+
+        if entry and entry.revision == revision:
+            self.hits += 1
+            self.entries.move_to_end(key)
+            return entry
+
+        exam = self.exam_service.get_exam(exam_id)
+        if not exam:
+            self.entries.pop(key, None)
+            return None
+
+        if entry and entry.version == exam.get("version", 1):
+            self.revalidations += 1
+            entry.revision = revision
+            self.entries.move_to_end(key)
+            return entry
+
+        self.misses += 1
+        entry = CachedPayload(exam, view, revision)
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+        return entry
+
+    def invalidate(self, exam_id: str) -> None:
+        for view in VIEWS:
+            self.entries.pop((exam_id, view), None)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "revalidations": self.revalidations,
+            "encodings": ["identity", "gzip"] + (["br"] if brotli is not None else [])
+        }
@@ -1,21 +1,87 @@
+import os
+import json
+import asyncio
 import uuid
-from typing import Dict, List, Optional
+import base64
+from typing import Dict, List, Optional, Tuple
 from datetime import datetime
 import random
 import string
 from pydantic import BaseModel
+from exam_store import ExamStore, MemoryExamStore, SQLiteExamStore, DuplicateRoomCode
+from answers import AnswerAutosave
+
+# Fields returned by the summary view of the exam listing
+SUMMARY_FIELDS = ("id", "title", "duration", "scheduledFor", "createdAt", "status", "roomCode", "version")
+
+
+def encode_cursor(exam: Dict) -> str:
+    raw = json.dumps([exam["createdAt"], exam["id"]], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[str, str]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, exam_id = json.loads(raw)
+        return str(created_at), str(exam_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
+
+
+def summarize_exam(exam: Dict) -> Dict:
+    summary = {field: exam.get(field) for field in SUMMARY_FIELDS}
+    summary["questionCount"] = len(exam.get("questions") or [])
+    summary["participantCount"] = len(exam.get("participants") or [])
+    return summary
+
 
 class ExamService:
-    def __init__(self):
-        self.exams = {}  # In-memory store for exams
+    def __init__(self, store: Optional[ExamStore] = None):
+        if store is None:
+            db_path = os.getenv("EXAM_DB_PATH")
+            store = SQLiteExamStore(db_path) if db_path else MemoryExamStore()
+        self.store = store
+        self.autosave = AnswerAutosave(store)
+        self.known_exams = set()  # exam ids already checked, so autosaves skip the lookup
     
     def list_exams(self) -> List[Dict]:
         """Return list of all exams"""
-        return list(self.exams.values())
+        return self.store.list()
+    
+    def list_exams_page(self, status: Optional[str] = None, scheduled_after: Optional[str] = None,
+                        scheduled_before: Optional[str] = None, cursor: Optional[str] = None,
+                        limit: Optional[int] = None, summary: bool = False) -> Tuple[List[Dict], Optional[str]]:
+        """Return one page of exams and the cursor for the next page (None on the last page)"""
+        after = decode_cursor(cursor) if cursor else None
+        # Fetch one extra row to learn whether another page follows
+        exams = self.store.query(
+            status=status,
+            scheduled_after=scheduled_after,
+            scheduled_before=scheduled_before,
+            after=after,
+            limit=limit + 1 if limit else None
+        )
+        next_cursor = None
+        if limit and len(exams) > limit:
+            exams = exams[:limit]
+            next_cursor = encode_cursor(exams[-1])
+        if summary:
+            exams = [summarize_exam(exam) for exam in exams]
+        return exams, next_cursor
+    
+    def listing_version(self) -> Tuple[str, float]:
+        """ETag token and last-modified time covering every exam"""
+        token, modified_at = self.store.revision()
+        return f'W/"exams-{token}"', modified_at
     
     def get_exam(self, exam_id: str) -> Optional[Dict]:
         """Get exam by ID"""
-        return self.exams.get(exam_id)
+        return self.store.get(exam_id)
+    
+    def get_exam_by_room_code(self, room_code: str) -> Optional[Dict]:
+        """Get exam by its room code"""
+        return self.store.get_by_room_code(room_code)
     
     def create_exam(self, exam_data) -> Dict:
         """Create a new exam"""
@@ -30,11 +96,71 @@ class ExamService:
             "createdAt": datetime.now().isoformat(),
             "status": "pending",  # pending, active, completed
             "roomCode": self.generate_room_code(),
-            "participants": []  # will store participant IDs
+            "participants": [],  # will store participant IDs
+            "recording": bool(getattr(exam_data, "recording", False)),  # record student streams on the server
+            "version": 1
         }
         
-        self.exams[exam_id] = new_exam
-        return new_exam
+        # The unique room code index is the final arbiter if two creates race
+        while True:
+            try:
+                self.store.insert(new_exam)
+                return new_exam
+            except DuplicateRoomCode:
+                new_exam["roomCode"] = self.generate_room_code()
+    
+    def update_exam(self, exam_id: str, changes: Dict) -> Optional[Dict]:
+        """Apply changes to an exam and bump its version"""
+        exam = self.store.get(exam_id)
+        if not exam:
+            return None
+        
+        exam = dict(exam, **changes)
+        exam["id"] = exam_id
+        exam["version"] = exam.get("version", 1) + 1
+        exam["updatedAt"] = datetime.now().isoformat()
+        self.store.update(exam)
+        return exam
+    
+    def save_answers(self, exam_id: str, student_id: str, answers: List[Dict]) -> asyncio.Future:
+        """Queue a student's answers; the returned future resolves once they are stored."""
+        self._check_answers(exam_id, answers)
+        return self.autosave.save(exam_id, student_id, answers)
+    
+    def submit_answers(self, exam_id: str, student_id: str, answers: Optional[List[Dict]] = None) -> asyncio.Future:
+        """Queue final answers plus the submission and flush at once."""
+        if answers:
+            self._check_answers(exam_id, answers)
+        elif not self._exam_exists(exam_id):
+            raise ValueError("Exam not found")
+        return self.autosave.submit(exam_id, student_id, answers)
+    
+    def get_answers(self, exam_id: str, student_id: str) -> Dict:
+        """Stored answers overlaid with ones still waiting to be flushed"""
+        answers = self.store.get_answers(exam_id, student_id)
+        answers.update(self.autosave.pending_answers(exam_id, student_id))
+        return {
+            "examId": exam_id,
+            "studentId": student_id,
+            "answers": {question_id: answer["answer"] for question_id, answer in answers.items()},
+            "submission": self.store.get_submission(exam_id, student_id)
+        }
+    
+    def _check_answers(self, exam_id: str, answers: List[Dict]) -> None:
+        if not isinstance(answers, list) or not answers:
+            raise ValueError("Answers are required")
+        if any(not isinstance(item, dict) or not item.get("questionId") for item in answers):
+            raise ValueError("Each answer needs a questionId")
+        if not self._exam_exists(exam_id):
+            raise ValueError("Exam not found")
+    
+    def _exam_exists(self, exam_id: str) -> bool:
+        if exam_id in self.known_exams:
+            return True
+        if exam_id and self.store.get(exam_id):
+            self.known_exams.add(exam_id)
+            return True
+        return False
     
     def generate_room_code(self) -> str:
         """Generate a 6-character alphanumeric room code"""
@@ -42,5 +168,5 @@ class ExamService:
         while True:
             code = ''.join(random.choice(chars) for _ in range(6))
             # Make sure code is unique
-            if not any(exam.get('roomCode') == code for exam in self.exams.values()):
+            if not self.store.room_code_exists(code):
                 return code
\ No newline at end of file
@@ -0,0 +1,455 @@
+from typing import Dict, List, Optional, Tuple
+from datetime import datetime, timezone
+import abc
+import time
+import uuid
+import json
+import bisect
+import sqlite3
+import threading
+
+
+class DuplicateRoomCode(Exception):
+    """Raised when an exam is stored with a room code that is already taken."""
+
+
+def schedule_key(value: Optional[str]) -> Optional[str]:
+    """An ISO-8601 time as a fixed-width UTC string, so comparing strings compares instants.
+
+    Times without an offset are server local time, as create_exam writes
+    them. Returns None for a missing or unparseable time.
+    """
+    if not value:
+        return None
+    try:
+        moment = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    return moment.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def schedule_bound(value: Optional[str], name: str) -> Optional[str]:
+    if value is None:
+        return None
+    key = schedule_key(value)
+    if key is None:
+        raise ValueError(f"{name} must be an ISO-8601 time")
+    return key
+
+
+class ExamStore(abc.ABC):
+    """Storage interface behind ExamService."""
+
+    @abc.abstractmethod
+    def get(self, exam_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_by_room_code(self, room_code: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def room_code_exists(self, room_code: str) -> bool:
+        return self.get_by_room_code(room_code) is not None
+
+    @abc.abstractmethod
+    def list(self) -> List[Dict]:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def query(self, status: Optional[str] = None, scheduled_after: Optional[str] = None,
+              scheduled_before: Optional[str] = None, after: Optional[Tuple[str, str]] = None,
+              limit: Optional[int] = None) -> List[Dict]:
+        """Exams ordered by (createdAt, id), optionally filtered and starting after a cursor.
+
+        scheduled_after is inclusive and scheduled_before exclusive. Both are
+        ISO-8601 times compared as instants (see schedule_key); a malformed
+        one raises ValueError.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def revision(self) -> Tuple[str, float]:
+        """A token that changes whenever any exam changes, and when that last happened."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def insert(self, exam: Dict) -> None:
+        """Store a new exam; raises DuplicateRoomCode if its roomCode is taken."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update(self, exam: Dict) -> None:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def save_answers(self, answers: List[Dict], submissions: List[Dict]) -> None:
+        """Upsert answers and record submissions in one transaction.
+
+        An answer only replaces a stored one with the same or a lower seq, so
+        a late retry never overwrites a newer save. The first submission of a
+        student wins, and answers of a student whose submission was already
+        stored are ignored, whichever worker queued them.
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_answers(self, exam_id: str, student_id: str) -> Dict[str, Dict]:
+        """A student's stored answers keyed by questionId."""
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def get_submission(self, exam_id: str, student_id: str) -> Optional[Dict]:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class MemoryExamStore(ExamStore):
+    """Exams kept in process memory, lost on restart."""
+
+    def __init__(self):
+        self.exams: Dict[str, Dict] = {}
+        self.room_codes: Dict[str, str] = {}  # roomCode -> exam_id
+        self.nonce = uuid.uuid4().hex[:8]
+        self.changes = 0
+        self.modified_at = time.time()
+        self.answers: Dict[Tuple[str, str], Dict[str, Dict]] = {}  # (exam_id, student_id) -> questionId -> answer
+        self.submissions: Dict[Tuple[str, str], Dict] = {}
+        # Sorted indexes, so queries never sort every exam
+        self.by_created: List[Tuple[str, str]] = []  # (createdAt, id)
+        self.by_schedule: List[Tuple[str, str, str]] = []  # (schedule_key, createdAt, id), scheduled exams only
+        self.index_entries: Dict[str, tuple] = {}  # exam_id -> its entries in the two indexes
+
+    def get(self, exam_id: str) -> Optional[Dict]:
+        return self.exams.get(exam_id)
+
+    def get_by_room_code(self, room_code: str) -> Optional[Dict]:
+        exam_id = self.room_codes.get(room_code)
+        return self.exams.get(exam_id) if exam_id else None
+
+    def room_code_exists(self, room_code: str) -> bool:
+        return room_code in self.room_codes
+
+    def list(self) -> List[Dict]:
+        return list(self.exams.values())
+
+    def query(self, status: Optional[str] = None, scheduled_after: Optional[str] = None,
+              scheduled_before: Optional[str] = None, after: Optional[Tuple[str, str]] = None,
+              limit: Optional[int] = None) -> List[Dict]:
+        low = schedule_bound(scheduled_after, "scheduledAfter")
+        high = schedule_bound(scheduled_before, "scheduledBefore")
+        if low is None and high is None:
+            start = bisect.bisect_right(self.by_created, after) if after else 0
+            candidates = self.by_created[start:]
+        else:
+            # A time window is narrow: take it from the schedule index, then order what is left
+            first = bisect.bisect_left(self.by_schedule, (low,)) if low else 0
+            last = bisect.bisect_left(self.by_schedule, (high,)) if high else len(self.by_schedule)
+            candidates = sorted(
+                (created_at, exam_id) for _, created_at, exam_id in self.by_schedule[first:last]
+                if not after or (created_at, exam_id) > after
+            )
+        results = []
+        for _, exam_id in candidates:
+            exam = self.exams[exam_id]
+            if status and exam["status"] != status:
+                continue
+            results.append(exam)
+            if limit and len(results) >= limit:
+                break
+        return results
+
+    def revision(self) -> Tuple[str, float]:
+        # The boot nonce keeps tokens from one process lifetime from matching the next
+        return f"{self.nonce}-{self.changes}", self.modified_at
+
+    def _touch(self) -> None:
+        self.changes += 1
+        self.modified_at = time.time()
+
+    def _index(self, exam: Dict) -> None:
+        created = (exam["createdAt"], exam["id"])
+        bisect.insort(self.by_created, created)
+        key = schedule_key(exam.get("scheduledFor"))
+        scheduled = (key, exam["createdAt"], exam["id"]) if key else None
+        if scheduled:
+            bisect.insort(self.by_schedule, scheduled)
+        self.index_entries[exam["id"]] = (created, scheduled)
+
+    def _unindex(self, exam_id: str) -> None:
+        created, scheduled = self.index_entries.pop(exam_id, (None, None))
+        for index, entry in ((self.by_created, created), (self.by_schedule, scheduled)):
+            if entry is not None:
+                del index[bisect.bisect_left(index, entry)]
+
+    def insert(self, exam: Dict) -> None:
+        if exam["roomCode"] in self.room_codes:
+            raise DuplicateRoomCode(exam["roomCode"])
+        self.exams[exam["id"]] = exam
+        self.room_codes[exam["roomCode"]] = exam["id"]
+        self._index(exam)
+        self._touch()
+
+    def update(self, exam: Dict) -> None:
+        previous = self.exams.get(exam["id"])
+        if previous and previous["roomCode"] != exam["roomCode"]:
+            if exam["roomCode"] in self.room_codes:
+                raise DuplicateRoomCode(exam["roomCode"])
+            del self.room_codes[previous["roomCode"]]
+            self.room_codes[exam["roomCode"]] = exam["id"]
+        self._unindex(exam["id"])
+        self.exams[exam["id"]] = exam
+        self._index(exam)
+        self._touch()
+
+    def save_answers(self, answers: List[Dict], submissions: List[Dict]) -> None:
+        for answer in answers:
+            if (answer["examId"], answer["studentId"]) in self.submissions:
+                continue
+            stored = self.answers.setdefault((answer["examId"], answer["studentId"]), {})
+            current = stored.get(answer["questionId"])
+            if current is None or current["seq"] <= answer["seq"]:
+                stored[answer["questionId"]] = answer
+        for submission in submissions:
+            self.submissions.setdefault((submission["examId"], submission["studentId"]), submission)
+
+    def get_answers(self, exam_id: str, student_id: str) -> Dict[str, Dict]:
+        return dict(self.answers.get((exam_id, student_id), {}))
+
+    def get_submission(self, exam_id: str, student_id: str) -> Optional[Dict]:
+        return self.submissions.get((exam_id, student_id))
+
+
+class SQLiteExamStore(ExamStore):
+    """Exams persisted in an embedded SQLite database.
+
+    The full exam is stored as JSON, with the fields we look up by copied into
+    indexed columns; scheduled_for holds schedule_key(scheduledFor). WAL mode lets readers proceed while a write is in flight.
+    Answer flushes run on a connection of their own, so the event loop's
+    reads never wait on their fsync.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS exams (
+            id TEXT PRIMARY KEY,
+            room_code TEXT NOT NULL,
+            status TEXT NOT NULL,
+            scheduled_for TEXT,
+            created_at TEXT NOT NULL,
+            data TEXT NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS exams_room_code ON exams (room_code);
+        CREATE INDEX IF NOT EXISTS exams_status ON exams (status);
+        CREATE INDEX IF NOT EXISTS exams_scheduled_for ON exams (scheduled_for);
+        CREATE INDEX IF NOT EXISTS exams_created ON exams (created_at, id);
+        CREATE TABLE IF NOT EXISTS store_meta (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            revision INTEGER NOT NULL,
+            modified_at REAL NOT NULL
+        );
+        INSERT OR IGNORE INTO store_meta (id, revision, modified_at) VALUES (0, 0, 0);
+        CREATE TABLE IF NOT EXISTS answers (
+            exam_id TEXT NOT NULL,
+            student_id TEXT NOT NULL,
+            question_id TEXT NOT NULL,
+            answer TEXT,
+            seq INTEGER NOT NULL,
+            saved_at REAL NOT NULL,
+            PRIMARY KEY (exam_id, student_id, question_id)
+        ) WITHOUT ROWID;
+        CREATE TABLE IF NOT EXISTS submissions (
+            exam_id TEXT NOT NULL,
+            student_id TEXT NOT NULL,
+            submitted_at REAL NOT NULL,
+            PRIMARY KEY (exam_id, student_id)
+        ) WITHOUT ROWID;
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lock = threading.Lock()
+        self.db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.execute("PRAGMA synchronous=NORMAL")
+        self.db.executescript(self.SCHEMA)
+        self._migrate()
+        self.answers_lock = threading.Lock()
+        self.answers_db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        # Acknowledged answers must survive power loss, not only a crash; one
+        # fsync per bulk flush keeps that affordable
+        self.answers_db.execute("PRAGMA synchronous=FULL")
+
+    def _migrate(self) -> None:
+        # Version 1: scheduled_for went from the raw scheduledFor string to schedule_key
+        if self.db.execute("PRAGMA user_version").fetchone()[0] >= 1:
+            return
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            rows = self.db.execute("SELECT id, data FROM exams").fetchall()
+            self.db.executemany(
+                "UPDATE exams SET scheduled_for = ? WHERE id = ?",
+                [(schedule_key(json.loads(data).get("scheduledFor")), exam_id) for exam_id, data in rows]
+            )
+            self.db.execute("PRAGMA user_version = 1")
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+    def _row_values(self, exam: Dict) -> tuple:
+        return (
+            exam["roomCode"],
+            exam["status"],
+            schedule_key(exam.get("scheduledFor")),
+            exam["createdAt"],
+            json.dumps(exam)
+        )
+
+    def _fetch_one(self, query: str, *args) -> Optional[Dict]:
+        with self.lock:
+            row = self.db.execute(query, args).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def get(self, exam_id: str) -> Optional[Dict]:
+        return self._fetch_one("SELECT data FROM exams WHERE id = ?", exam_id)
+
+    def get_by_room_code(self, room_code: str) -> Optional[Dict]:
+        return self._fetch_one("SELECT data FROM exams WHERE room_code = ?", room_code)
+
+    def room_code_exists(self, room_code: str) -> bool:
+        with self.lock:
+            row = self.db.execute("SELECT 1 FROM exams WHERE room_code = ?", (room_code,)).fetchone()
+        return row is not None
+
+    def list(self) -> List[Dict]:
+        with self.lock:
+            rows = self.db.execute("SELECT data FROM exams ORDER BY created_at, id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def query(self, status: Optional[str] = None, scheduled_after: Optional[str] = None,
+              scheduled_before: Optional[str] = None, after: Optional[Tuple[str, str]] = None,
+              limit: Optional[int] = None) -> List[Dict]:
+        clauses, args = [], []
+        scheduled_after = schedule_bound(scheduled_after, "scheduledAfter")
+        scheduled_before = schedule_bound(scheduled_before, "scheduledBefore")
+        if status:
+            clauses.append("status = ?")
+            args.append(status)
+        if scheduled_after:
+            clauses.append("scheduled_for >= ?")
+            args.append(scheduled_after)
+        if scheduled_before:
+            clauses.append("scheduled_for < ?")
+            args.append(scheduled_before)
+        if after:
+            clauses.append("(created_at, id) > (?, ?)")
+            args.extend(after)
+        sql = "SELECT data FROM exams"
+        if clauses:
+            sql += " WHERE " + " AND ".join(clauses)
+        sql += " ORDER BY created_at, id"
+        if limit:
+            sql += " LIMIT ?"
+            args.append(limit)
+        with self.lock:
+            rows = self.db.execute(sql, args).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    def revision(self) -> Tuple[str, float]:
+        # Kept in the database so every worker sharing the file agrees on it
+        with self.lock:
+            revision, modified_at = self.db.execute(
+                "SELECT revision, modified_at FROM store_meta WHERE id = 0"
+            ).fetchone()
+        return str(revision), modified_at
+
+    def _write(self, sql: str, exam: Dict) -> None:
+        try:
+            with self.lock:
+                self.db.execute("BEGIN IMMEDIATE")
+                try:
+                    self.db.execute(sql, self._row_values(exam) + (exam["id"],))
+                    self.db.execute(
+                        "UPDATE store_meta SET revision = revision + 1, modified_at = ? WHERE id = 0",
+                        (time.time(),)
+                    )
+                    self.db.execute("COMMIT")
+                except Exception:
+                    self.db.execute("ROLLBACK")
+                    raise
+        except sqlite3.IntegrityError:
+            raise DuplicateRoomCode(exam["roomCode"])
+
+    def insert(self, exam: Dict) -> None:
+        self._write(
+            "INSERT INTO exams (room_code, status, scheduled_for, created_at, data, id) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            exam
+        )
+
+    def update(self, exam: Dict) -> None:
+        self._write(
+            "UPDATE exams SET room_code = ?, status = ?, scheduled_for = ?, created_at = ?, data = ? "
+            "WHERE id = ?",
+            exam
+        )
+
+    def save_answers(self, answers: List[Dict], submissions: List[Dict]) -> None:
+        with self.answers_lock:
+            db = self.answers_db
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                db.executemany(
+                    "INSERT INTO answers (exam_id, student_id, question_id, answer, seq, saved_at) "
+                    "SELECT ?, ?, ?, ?, ?, ? WHERE NOT EXISTS "
+                    "(SELECT 1 FROM submissions WHERE exam_id = ? AND student_id = ?) "
+                    "ON CONFLICT (exam_id, student_id, question_id) DO UPDATE SET "
+                    "answer = excluded.answer, seq = excluded.seq, saved_at = excluded.saved_at "
+                    "WHERE excluded.seq >= answers.seq",
+                    [
+                        (a["examId"], a["studentId"], a["questionId"], json.dumps(a["answer"]), a["seq"], a["savedAt"],
+                         a["examId"], a["studentId"])
+                        for a in answers
+                    ]
+                )
+                db.executemany(
+                    "INSERT OR IGNORE INTO submissions (exam_id, student_id, submitted_at) VALUES (?, ?, ?)",
+                    [(s["examId"], s["studentId"], s["submittedAt"]) for s in submissions]
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+
+    def get_answers(self, exam_id: str, student_id: str) -> Dict[str, Dict]:
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT question_id, answer, seq, saved_at FROM answers WHERE exam_id = ? AND student_id = ?",
+                (exam_id, student_id)
+            ).fetchall()
+        return {
+            question_id: {
+                "examId": exam_id,
+                "studentId": student_id,
+                "questionId": question_id,
+                "answer": json.loads(answer) if answer is not None else None,
+                "seq": seq,
+                "savedAt": saved_at
+            }
+            for question_id, answer, seq, saved_at in rows
+        }
+
+    def get_submission(self, exam_id: str, student_id: str) -> Optional[Dict]:
+        with self.lock:
+            row = self.db.execute(
+                "SELECT submitted_at FROM submissions WHERE exam_id = ? AND student_id = ?",
+                (exam_id, student_id)
+            ).fetchone()
+        return {"examId": exam_id, "studentId": student_id, "submittedAt": row[0]} if row else None
+
+    def close(self) -> None:
+        with self.answers_lock:
+            self.answers_db.close()
+        with self.lock:
+            self.db.close()
@@ -0,0 +1,217 @@
+from typing import Dict, Any, Optional, Callable, Awaitable, Hashable, Union
+from collections import deque
+import asyncio
+import wire
+from metrics import SEND_FAILURES
+
+# Policies applied when a connection's outbound queue is full
+DROP_OLDEST = "drop_oldest"
+COALESCE = "coalesce"
+DISCONNECT = "disconnect"
+POLICIES = (DROP_OLDEST, COALESCE, DISCONNECT)
+
+
+class EncodedFrame:
+    """A message serialized once and shared by every recipient of a broadcast.
+    
+    The JSON text is built up front; the MessagePack form is built the first
+    time a binary connection needs it and then reused.
+    """
+
+    __slots__ = ("message", "text", "_binary")
+
+    def __init__(self, message: Union[Dict[str, Any], str]):
+        if isinstance(message, str):
+            self.message = None
+            self.text = message
+        else:
+            self.message = message
+            self.text = wire.dumps_text(message)
+        self._binary = None
+
+    @property
+    def binary(self) -> bytes:
+        if self._binary is None:
+            message = self.message if self.message is not None else wire.loads_text(self.text)
+            self._binary = wire.pack(message)
+        return self._binary
+
+
+class ConnectionWriter:
+    """Bounded outbound queue drained by a dedicated writer task for one WebSocket."""
+
+    def __init__(self, client_id: str, websocket: Any, max_queue: int, policy: str,
+                 on_failure: Callable[[str], Awaitable[None]], wire_format: str = wire.JSON):
+        self.client_id = client_id
+        self.websocket = websocket
+        self.binary = wire_format == wire.MSGPACK
+        self.max_queue = max_queue
+        self.policy = policy
+        self.on_failure = on_failure
+
+        # Entries are [coalesce_key, message] so a coalesced message can be found and replaced
+        self.queue = deque()
+        self.keyed: Dict[Hashable, list] = {}
+        self.ready = asyncio.Event()
+        self.closed = False
+
+        self.sent = 0
+        self.dropped = 0
+        self.coalesced = 0
+        self.task = asyncio.create_task(self._run())
+
+    @property
+    def depth(self) -> int:
+        return len(self.queue)
+
+    def enqueue(self, message: Any, coalesce_key: Optional[Hashable] = None, policy: Optional[str] = None) -> bool:
+        """Queue a message without waiting. Returns False if the message was rejected.
+
+        policy overrides the connection's policy for this message, e.g. COALESCE
+        for state updates where only the latest one matters.
+        """
+        if self.closed:
+            return False
+
+        policy = policy or self.policy
+        if policy == COALESCE and coalesce_key is not None:
+            entry = self.keyed.get(coalesce_key)
+            if entry is not None:
+                # The update moves to the tail, so it is not delivered ahead of
+                # messages queued after the one it replaces (newProducer before userLeft)
+                self.queue.remove(entry)
+                entry[1] = message
+                self.queue.append(entry)
+                self.coalesced += 1
+                return True
+
+        if len(self.queue) >= self.max_queue:
+            if policy == DISCONNECT:
+                SEND_FAILURES.inc("queue_full")
+                self._fail(f"outbound queue full ({self.max_queue})")
+                return False
+            self._drop_oldest()
+
+        entry = [coalesce_key, message]
+        self.queue.append(entry)
+        if coalesce_key is not None:
+            self.keyed[coalesce_key] = entry
+        self.ready.set()
+        return True
+
+    def close(self) -> None:
+        """Stop the writer task and discard anything still queued."""
+        self.closed = True
+        self.queue.clear()
+        self.keyed.clear()
+        if self.task is not asyncio.current_task():
+            self.task.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "depth": self.depth,
+            "sent": self.sent,
+            "dropped": self.dropped,
+            "coalesced": self.coalesced
+        }
+
+    def _drop_oldest(self) -> None:
+        key, _ = self.queue.popleft()
+        self._forget(key)
+        self.dropped += 1
+        SEND_FAILURES.inc("dropped")
+
+    def _forget(self, key: Optional[Hashable]) -> None:
+        if key is not None:
+            self.keyed.pop(key, None)
+
+    def _fail(self, reason: str) -> None:
+        print(f"Dropping slow client {self.client_id}: {reason}")
+        self.close()
+        asyncio.create_task(self._close_socket())
+        asyncio.create_task(self.on_failure(self.client_id))
+
+    async def _close_socket(self) -> None:
+        try:
+            await self.websocket.close()
+        except Exception:
+            pass
+
+    async def _run(self) -> None:
+        while not self.closed:
+            if not self.queue:
+                self.ready.clear()
+                await self.ready.wait()
+                continue
+
+            key, message = self.queue.popleft()
+            self._forget(key)
+            try:
+                if not isinstance(message, EncodedFrame):
+                    message = EncodedFrame(message)
+                if self.binary:
+                    await self.websocket.send_bytes(message.binary)
+                else:
+                    await self.websocket.send_text(message.text)
+                self.sent += 1
+            except Exception as e:
+                print(f"Error sending to client {self.client_id}: {e}")
+                SEND_FAILURES.inc("error")
+                self.closed = True
+                asyncio.create_task(self.on_failure(self.client_id))
+                return
+
+
+class FanoutEngine:
+    """Per-connection writers so one stalled socket never delays delivery to the others."""
+
+    def __init__(self, max_queue: int = 256, policy: str = DROP_OLDEST):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown fan-out policy: {policy}")
+        if max_queue < 1:
+            raise ValueError("max_queue must be at least 1")
+        self.max_queue = max_queue
+        self.policy = policy
+        self.writers: Dict[str, ConnectionWriter] = {}
+
+    def add(self, client_id: str, websocket: Any, on_failure: Callable[[str], Awaitable[None]],
+            wire_format: str = wire.JSON) -> None:
+        """Start a writer for a newly registered connection."""
+        self.remove(client_id)
+        self.writers[client_id] = ConnectionWriter(
+            client_id, websocket, self.max_queue, self.policy, on_failure, wire_format
+        )
+
+    def remove(self, client_id: str) -> None:
+        """Stop and forget the writer for a connection."""
+        writer = self.writers.pop(client_id, None)
+        if writer:
+            writer.close()
+
+    def send(self, client_id: str, message: Any, coalesce_key: Optional[Hashable] = None,
+             policy: Optional[str] = None) -> bool:
+        """Queue a message for one connection."""
+        writer = self.writers.get(client_id)
+        if not writer:
+            return False
+        return writer.enqueue(message, coalesce_key, policy)
+
+    def broadcast(self, client_ids, message: Any, coalesce_key: Optional[Hashable] = None,
+                  policy: Optional[str] = None) -> int:
+        """Queue a message for many connections. Returns how many accepted it."""
+        accepted = 0
+        for client_id in client_ids:
+            if self.send(client_id, message, coalesce_key, policy):
+                accepted += 1
+        return accepted
+
+    def queue_depths(self) -> Dict[str, int]:
+        """Current outbound queue depth per connection."""
+        return {client_id: writer.depth for client_id, writer in self.writers.items()}
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "policy": self.policy,
+            "maxQueue": self.max_queue,
+            "connections": {client_id: writer.stats() for client_id, writer in self.writers.items()}
+        }
@@ -0,0 +1,134 @@
+from typing import Any, Callable, Dict, Optional
+from collections import deque
+import asyncio
+import fractions
+import av
+from aiortc import MediaStreamTrack
+from aiortc.codecs.vpx import VpxPayloadDescriptor
+from aiortc.mediastreams import MediaStreamError
+
+# aiortc internals used for forwarding; both exist from 1.4.0 through 1.9.0
+JITTER_BUFFER = "_RTCRtpReceiver__jitter_buffer"
+FORCE_KEYFRAME = "_RTCRtpSender__force_keyframe"
+
+CLOCK_RATES = {"audio": 48000, "video": 90000}
+
+
+def is_keyframe(codec: Optional[str], data: bytes) -> bool:
+    """Whether a reassembled frame can be decoded without the frames before it."""
+    if codec == "VP8":
+        # Bit 0 of the frame tag is clear on key frames
+        return bool(data) and not data[0] & 0x01
+    if codec == "H264":
+        # An IDR slice or sequence parameter set in the Annex B stream
+        return any(nal and nal[0] & 0x1F in (5, 7) for nal in data.split(b"\x00\x00\x01"))
+    return True
+
+
+def temporal_layer(codec: Optional[str], payload: bytes) -> int:
+    """Temporal layer an RTP packet belongs to, from its VP8 payload descriptor."""
+    if codec != "VP8":
+        return 0
+    try:
+        descriptor, _ = VpxPayloadDescriptor.parse(payload)
+    except ValueError:
+        return 0
+    return descriptor.tid[0] if descriptor.tid else 0
+
+
+class EncodedTap:
+    """Takes the place of an RTCRtpReceiver's jitter buffer to forward frames before they are decoded.
+
+    aiortc has no public hook between reassembling a frame and decoding it.
+    The tap hands every complete frame to on_frame as an av.Packet, which
+    RTCRtpSender packetizes as it is, so forwarding to any number of
+    consumers costs no decode or encode. Frames only go on to the receiver's
+    decoder while decode() is true, i.e. while a recorder or another sink
+    needs pictures, or for the single keyframe a snapshot is waiting on.
+    """
+
+    def __init__(self, buffer: Any, kind: str, codecs: Dict[int, str], layered: bool,
+                 on_frame: Callable[[Any, int, bool], None], decode: Callable[[], bool]):
+        self.buffer = buffer
+        self.time_base = fractions.Fraction(1, CLOCK_RATES.get(kind, 90000))
+        self.codecs = codecs
+        self.layered = layered
+        self.on_frame = on_frame
+        self.decode = decode
+        self.codec: Optional[str] = None
+        # RTP timestamp -> temporal layer, for frames still being reassembled
+        self.layers: Dict[int, int] = {}
+
+    @classmethod
+    def install(cls, receiver: Any, **kwargs) -> Optional["EncodedTap"]:
+        """Put a tap in front of receiver's jitter buffer, or return None if this aiortc has none."""
+        buffer = getattr(receiver, JITTER_BUFFER, None)
+        if buffer is None or not callable(getattr(buffer, "add", None)):
+            return None
+        tap = cls(buffer, **kwargs)
+        setattr(receiver, JITTER_BUFFER, tap)
+        return tap
+
+    def add(self, packet: Any):
+        self.codec = self.codecs.get(packet.payload_type, self.codec)
+        if self.layered and packet.timestamp not in self.layers:
+            self.layers[packet.timestamp] = temporal_layer(self.codec, packet.payload)
+            if len(self.layers) > 64:
+                # Frames the jitter buffer gave up on are never emitted
+                del self.layers[next(iter(self.layers))]
+        pli_flag, frame = self.buffer.add(packet)
+        if frame is not None:
+            encoded = av.Packet(frame.data)
+            encoded.pts = frame.timestamp
+            encoded.time_base = self.time_base
+            self.on_frame(encoded, self.layers.pop(frame.timestamp, 0), is_keyframe(self.codec, frame.data))
+            if not self.decode():
+                frame = None
+        return pli_flag, frame
+
+
+class ForwardingTrack(MediaStreamTrack):
+    """Outgoing track fed by a producer's forwarder instead of a decoder or encoder of its own.
+
+    Holds a few frames so a slow consumer drops media rather than holding
+    up the producer or the other consumers; push() reports when the buffer
+    is full so the forwarder can restart the consumer at a keyframe.
+    """
+
+    def __init__(self, kind: str, buffer_size: int = 8):
+        super().__init__()
+        self.kind = kind
+        self.buffer = deque(maxlen=buffer_size)
+        self.ready = asyncio.Event()
+        # The RTCRtpSender sending this track, and who to tell when its peer asks for a keyframe
+        self.sender = None
+        self.on_keyframe_request: Optional[Callable[[], None]] = None
+
+    def push(self, packet: Any) -> bool:
+        if len(self.buffer) == self.buffer.maxlen:
+            return False
+        self.buffer.append(packet)
+        self.ready.set()
+        return True
+
+    def clear(self) -> None:
+        self.buffer.clear()
+        self.ready.clear()
+
+    async def recv(self) -> Any:
+        while not self.buffer:
+            if self.readyState != "live":
+                raise MediaStreamError
+            self.ready.clear()
+            await self.ready.wait()
+        if self.sender is not None and getattr(self.sender, FORCE_KEYFRAME, False):
+            # The sender would only re-encode on a PLI; pass it on to the producer instead
+            setattr(self.sender, FORCE_KEYFRAME, False)
+            if self.on_keyframe_request:
+                self.on_keyframe_request()
+        return self.buffer.popleft()
+
+    def stop(self) -> None:
+        super().stop()
+        # Wake a pending recv so it can observe the ended state
+        self.ready.set()
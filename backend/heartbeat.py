@@ -0,0 +1,160 @@
+from typing import Dict, Any, List, Set, Tuple, Callable, Awaitable, Hashable
+import os
+import math
+import time
+import asyncio
+from metrics import HEARTBEAT_TIMEOUTS
+
+
+class TimerWheel:
+    """Timers for any number of keys, driven by a single task.
+
+    A hashed wheel: each timer sits in the slot of the tick it is due on, so
+    scheduling and cancelling are dict operations and a tick only looks at
+    one slot. Timers are accurate to one tick, which is plenty for timeouts
+    measured in seconds.
+    """
+
+    def __init__(self, tick: float = 1.0, slots: int = 64):
+        self.tick = tick
+        self.slots: List[Dict[Hashable, Tuple[int, Callable[[Hashable], None]]]] = [{} for _ in range(slots)]
+        self.slot_of: Dict[Hashable, int] = {}
+        self.current = 0
+        self.task = None
+        self.fired = 0
+
+    def schedule(self, key: Hashable, delay: float, callback: Callable[[Hashable], None]) -> None:
+        """Call callback(key) after about delay seconds, replacing key's previous timer."""
+        self.cancel(key)
+        due = self.current + max(1, math.ceil(delay / self.tick))
+        slot = due % len(self.slots)
+        self.slots[slot][key] = (due, callback)
+        self.slot_of[key] = slot
+
+    def cancel(self, key: Hashable) -> None:
+        slot = self.slot_of.pop(key, None)
+        if slot is not None:
+            self.slots[slot].pop(key, None)
+
+    def __len__(self) -> int:
+        return len(self.slot_of)
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        next_tick = loop.time()
+        while True:
+            # Ticks are paced from the start time, so a late wakeup does not shift later ones
+            next_tick += self.tick
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+            self.advance()
+
+    def advance(self) -> None:
+        self.current += 1
+        bucket = self.slots[self.current % len(self.slots)]
+        # Timers further out than one turn of the wheel stay for a later lap
+        due = [key for key, (at, _) in bucket.items() if at <= self.current]
+        for key in due:
+            _, callback = bucket.pop(key)
+            del self.slot_of[key]
+            self.fired += 1
+            try:
+                callback(key)
+            except Exception as e:
+                print(f"Timer {key} failed: {e}")
+
+    async def close(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+
+class HeartbeatMonitor:
+    """Application-level liveness for signaling sockets.
+
+    Anything received from a client marks it alive, which costs one dict
+    write. Each connection has a single timer on the shared wheel. When it
+    fires, a client quiet for an interval is pinged, and one quiet for the
+    whole timeout is handed to on_dead like any other disconnect.
+
+    Only clients that have answered a ping with pong are ever timed out;
+    older clients that ignore pings are left to the socket closing.
+    """
+
+    def __init__(self, send_ping: Callable[[str], Any], on_dead: Callable[[str], Awaitable[None]],
+                 interval: float = None, timeout: float = None, wheel: TimerWheel = None):
+        self.send_ping = send_ping
+        self.on_dead = on_dead
+        self.interval = interval if interval is not None else float(os.getenv("HEARTBEAT_INTERVAL", "15"))
+        self.timeout = timeout or float(os.getenv("HEARTBEAT_TIMEOUT", "45"))
+        self.wheel = wheel if wheel is not None else TimerWheel()
+        self.last_seen: Dict[str, float] = {}
+        self.responsive: Set[str] = set()
+        self.pings = 0
+        self.timeouts = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.interval > 0
+
+    def start(self) -> None:
+        if self.enabled:
+            self.wheel.start()
+
+    def add(self, client_id: str) -> None:
+        if not self.enabled:
+            return
+        self.last_seen[client_id] = time.monotonic()
+        self.wheel.schedule(client_id, self.interval, self._check)
+
+    def seen(self, client_id: str) -> None:
+        if client_id in self.last_seen:
+            self.last_seen[client_id] = time.monotonic()
+
+    def pong(self, client_id: str) -> None:
+        if client_id in self.last_seen:
+            self.responsive.add(client_id)
+            self.last_seen[client_id] = time.monotonic()
+
+    def remove(self, client_id: str) -> None:
+        self.responsive.discard(client_id)
+        if self.last_seen.pop(client_id, None) is not None:
+            self.wheel.cancel(client_id)
+
+    def _check(self, client_id: str) -> None:
+        last_seen = self.last_seen.get(client_id)
+        if last_seen is None:
+            return
+        idle = time.monotonic() - last_seen
+        if idle >= self.timeout and client_id in self.responsive:
+            self.remove(client_id)
+            self.timeouts += 1
+            HEARTBEAT_TIMEOUTS.inc()
+            asyncio.create_task(self.on_dead(client_id))
+            return
+        if idle >= self.interval:
+            self.pings += 1
+            self.send_ping(client_id)
+            delay = min(self.interval, self.timeout - idle) if client_id in self.responsive else self.interval
+        else:
+            # Heard from recently; look again one interval after that
+            delay = self.interval - idle
+        self.wheel.schedule(client_id, delay, self._check)
+
+    async def close(self) -> None:
+        await self.wheel.close()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "interval": self.interval,
+            "timeout": self.timeout,
+            "connections": len(self.last_seen),
+            "responsive": len(self.responsive),
+            "timers": len(self.wheel),
+            "pings": self.pings,
+            "timeouts": self.timeouts
+        }
@@ -1,15 +1,33 @@
+import time
+BOOT_STARTED = time.perf_counter()
+
 import os
 import uuid
+import base64
+import asyncio
+import secrets
 from typing import Optional, Dict, List
-from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi import FastAPI, WebSocket, WebSocketDisconnect, HTTPException, Depends, Request, Query
+from fastapi.responses import JSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.requests import HTTPConnection
 from pydantic import BaseModel
 from dotenv import load_dotenv
 
 # Import modules
 from signaling import WebRTCSignaling
 from exam_service import ExamService
+from exam_cache import ExamPayloadCache, student_view
+from bus import InProcessBus, LocalSocketBus
+from sharding import ShardedSignaling
+from prewarm import ExamPrewarmer
+from heartbeat import HeartbeatMonitor
+from fanout import EncodedFrame, COALESCE
+from metrics import REGISTRY, LoopLagMonitor
+from negotiation import NEGOTIATOR
+import media
+import wire
 
 # Load environment variables
 load_dotenv()
@@ -29,6 +47,47 @@ app.add_middleware(
 # Initialize services
 signaling_service = WebRTCSignaling()
 exam_service = ExamService()
+exam_cache = ExamPayloadCache(exam_service, max_entries=int(os.getenv("EXAM_CACHE_SIZE", "256")))
+
+# Rooms are sharded across workers; "socket" lets several uvicorn workers on one host cooperate
+if os.getenv("SIGNALING_BUS", "memory") == "socket":
+    signaling_bus = LocalSocketBus(os.getenv("SIGNALING_BUS_DIR", "/tmp/exam-signaling"))
+else:
+    signaling_bus = InProcessBus()
+# Without WORKER_ID each worker takes a slot number on the bus, so ids survive restarts
+signaling_gateway = ShardedSignaling(
+    signaling_service,
+    signaling_bus,
+    worker_id=os.getenv("WORKER_ID") or None,
+    lease_ttl=float(os.getenv("ROOM_LEASE_TTL", "30"))
+)
+
+# Rooms of exams about to start are created and warmed ahead of scheduledFor
+exam_prewarmer = ExamPrewarmer(exam_service, signaling_gateway)
+
+# Half-open sockets are found by heartbeats rather than by a send that happens to fail
+PING = EncodedFrame({"type": "ping"})
+
+
+async def expire_connection(client_id: str) -> None:
+    websocket = signaling_gateway.local_sockets.get(client_id)
+    print(f"Client {client_id} timed out")
+    if websocket:
+        asyncio.create_task(close_quietly(websocket))
+    await signaling_gateway.handle_disconnect(client_id, websocket)
+
+
+async def close_quietly(websocket: WebSocket) -> None:
+    try:
+        await websocket.close(code=4000)
+    except Exception:
+        pass
+
+
+heartbeats = HeartbeatMonitor(
+    send_ping=lambda client_id: signaling_service.fanout.send(client_id, PING, ("heartbeat",), COALESCE),
+    on_dead=expire_connection
+)
 
 # Models
 class ExamCreate(BaseModel):
@@ -36,6 +95,86 @@ class ExamCreate(BaseModel):
     duration: int
     questions: List[Dict]
     scheduledFor: Optional[str] = None
+    recording: bool = False
+
+
+class AnswerSave(BaseModel):
+    studentId: str
+    answers: List[Dict]
+
+
+class ExamSubmit(BaseModel):
+    studentId: str
+    answers: Optional[List[Dict]] = None
+
+
+# Rooms whose exam opted in get their producers recorded to RECORDING_DIR
+signaling_service.recording_policy = lambda room_id: bool(
+    (exam_service.get_exam_by_room_code(room_id) or {}).get("recording")
+)
+# saveAnswers/submitExam over the signaling socket go through the same autosave pipeline
+signaling_service.answers = exam_service
+
+
+# Gauges are read from live state when scraped, so they cost nothing between scrapes
+REGISTRY.gauge("signaling_rooms", "Rooms hosted by this worker",
+               callback=lambda: len(signaling_service.rooms))
+REGISTRY.gauge("signaling_participants", "Participants in rooms hosted by this worker",
+               callback=lambda: len(signaling_service.client_rooms))
+REGISTRY.gauge("signaling_connections", "Registered signaling connections",
+               callback=lambda: len(signaling_service.connections))
+REGISTRY.gauge("signaling_producers", "Active producers",
+               callback=lambda: len(signaling_service.producer_index))
+REGISTRY.gauge("signaling_consumers", "Active consumers",
+               callback=lambda: len(signaling_service.consumer_owners))
+REGISTRY.gauge("signaling_outbound_queued", "Messages waiting in outbound WebSocket queues",
+               callback=lambda: sum(signaling_service.queue_depths().values()))
+REGISTRY.gauge("signaling_room_mailbox_queued", "Messages waiting on room actors",
+               callback=lambda: signaling_service.scheduler.stats()["queued"])
+REGISTRY.gauge("signaling_join_queue_waiting", "joinRoom requests waiting for admission",
+               callback=lambda: len(signaling_service.admission.waiting))
+REGISTRY.gauge("webrtc_transports", "Transports handed out to clients and still open",
+               callback=lambda: signaling_service.resource_counts()["transports"])
+REGISTRY.gauge("webrtc_transport_pool_ready", "Warm transports ready across all routers",
+               callback=lambda: sum(pool["ready"] for pool in signaling_service.webrtc_manager.pool_stats().values()))
+REGISTRY.gauge("recording_frames_dropped", "Frames dropped because recording fell behind, across open recordings",
+               callback=lambda: sum(stream["dropped"] for room in signaling_service.recordings.stats().values()
+                                    for stream in room.values()))
+REGISTRY.gauge("rtp_negotiation_cache_entries", "Memoized producer/capability negotiations",
+               callback=lambda: NEGOTIATOR.stats()["entries"])
+REGISTRY.gauge("rtp_negotiation_cache_lookups", "Negotiation cache lookups by result", ("result",),
+               callback=lambda: {("hit",): NEGOTIATOR.hits, ("miss",): NEGOTIATOR.misses})
+REGISTRY.gauge("app_boot_seconds", "Time from importing the app to the end of startup",
+               callback=lambda: boot_seconds)
+REGISTRY.gauge("media_stack_load_seconds", "Time taken to import the media stack, once the first transport needed it",
+               callback=lambda: media.load_seconds or 0)
+REGISTRY.gauge("dtls_certificates", "DTLS certificates handed to peer connections, by whether they were generated or reused",
+               ("source",), callback=lambda: {("generated",): media.CERTIFICATES.generated,
+                                              ("reused",): media.CERTIFICATES.reused})
+loop_lag_monitor = LoopLagMonitor()
+boot_seconds = 0.0
+
+
+@app.on_event("startup")
+async def startup():
+    loop_lag_monitor.start()
+    await signaling_gateway.start()
+    if isinstance(signaling_bus, LocalSocketBus) and not os.getenv("EXAM_DB_PATH"):
+        print("Warning: every worker keeps its own in-memory exams; set EXAM_DB_PATH to share them")
+    await exam_prewarmer.start()
+    heartbeats.start()
+    global boot_seconds
+    boot_seconds = time.perf_counter() - BOOT_STARTED
+    print(f"Started in {boot_seconds:.2f}s")
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    loop_lag_monitor.stop()
+    await exam_prewarmer.close()
+    await heartbeats.close()
+    await signaling_gateway.close()
+    await exam_service.autosave.close()
 
 
 @app.get("/")
@@ -48,18 +187,234 @@ async def health():
     return {"status": "ok"}
 
 
+@app.get("/api/metrics")
+async def metrics():
+    return Response(content=REGISTRY.render(), media_type="text/plain; version=0.0.4; charset=utf-8")
+
+
+@app.get("/api/signaling/queues")
+async def signaling_queues():
+    return signaling_service.fanout.stats()
+
+
+@app.get("/api/signaling/rooms")
+async def signaling_rooms():
+    return signaling_service.scheduler.stats()
+
+
+@app.get("/api/signaling/resources")
+async def signaling_resources():
+    return signaling_service.resource_counts()
+
+
+@app.get("/api/media")
+async def media_stats():
+    return dict(media.stats(), bootSeconds=round(boot_seconds, 4))
+
+
+@app.get("/api/signaling/heartbeats")
+async def signaling_heartbeats():
+    return heartbeats.stats()
+
+
+@app.get("/api/signaling/admission")
+async def signaling_admission():
+    return signaling_service.admission.stats()
+
+
+@app.get("/api/prewarm")
+async def prewarm():
+    return exam_prewarmer.stats()
+
+
+@app.get("/api/recordings")
+async def recordings():
+    return signaling_service.recordings.stats()
+
+
+@app.get("/api/audio-activity")
+async def audio_activity_stats():
+    return signaling_service.audio_activity.stats()
+
+
+# Bearer token for teacher-only views such as answer keys and thumbnails; unset, nobody gets them
+TEACHER_API_KEY = os.getenv("TEACHER_API_KEY")
+
+
+def is_teacher(connection: HTTPConnection) -> bool:
+    authorization = connection.headers.get("authorization")
+    if authorization is None and isinstance(connection, WebSocket):
+        # Browsers cannot set headers on a websocket, so the token may come as ?token=
+        authorization = f"Bearer {connection.query_params.get('token', '')}"
+    return bool(TEACHER_API_KEY) and secrets.compare_digest(
+        (authorization or "").encode(), f"Bearer {TEACHER_API_KEY}".encode()
+    )
+
+
+def require_teacher(request: Request) -> None:
+    if not is_teacher(request):
+        raise HTTPException(status_code=403, detail="Teacher authorization required")
+
+
+@app.get("/api/thumbnails")
+async def thumbnail_stats():
+    return signaling_service.thumbnails.stats()
+
+
+def thumbnail_index(room_id: str) -> Dict:
+    room = signaling_service.thumbnails.rooms.get(room_id)
+    return {
+        "roomId": room_id,
+        "interval": signaling_service.thumbnails.interval,
+        "thumbnails": [
+            dict(entry, url=f"/api/rooms/{room_id}/thumbnails/{entry['studentId']}?v={entry['seq']}")
+            for entry in (room.index() if room else [])
+        ]
+    }
+
+
+# Thumbnails live on the worker hosting the room; these answer for it over the bus
+async def query_thumbnails(room_id: str, args: Dict) -> Optional[Dict]:
+    room = signaling_service.thumbnails.rooms.get(room_id)
+    if not room:
+        return None
+    return {"version": room.version, "updatedAt": room.updated_at, "index": thumbnail_index(room_id)}
+
+
+async def query_thumbnail(room_id: str, args: Dict) -> Optional[Dict]:
+    room = signaling_service.thumbnails.rooms.get(room_id)
+    thumbnail = room.latest.get(args.get("studentId")) if room else None
+    if not thumbnail:
+        return None
+    return {"etag": thumbnail.etag, "jpeg": base64.b64encode(thumbnail.jpeg).decode("ascii")}
+
+
+signaling_gateway.queries.update({"thumbnails": query_thumbnails, "thumbnail": query_thumbnail})
+
+
+@app.get("/api/rooms/{room_id}/thumbnails")
+async def room_thumbnails(request: Request, room_id: str):
+    require_teacher(request)
+    snapshot = await signaling_gateway.query_room(room_id, "thumbnails")
+    version, modified_at = (snapshot["version"], snapshot["updatedAt"]) if snapshot else (0, 0.0)
+    etag = f'W/"thumbnails-{version}"'
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if snapshot and is_not_modified(request, etag, modified_at):
+        return Response(status_code=304, headers=headers)
+    return JSONResponse(snapshot["index"] if snapshot else thumbnail_index(room_id), headers=headers)
+
+
+@app.get("/api/rooms/{room_id}/thumbnails/{student_id}")
+async def room_thumbnail(request: Request, room_id: str, student_id: str):
+    require_teacher(request)
+    # The JPEG bytes are shared by every teacher; URLs carry ?v=seq so browsers may cache them
+    thumbnail = await signaling_gateway.query_room(room_id, "thumbnail", {"studentId": student_id})
+    if not thumbnail:
+        raise HTTPException(status_code=404, detail="No thumbnail for this student")
+    headers = {"ETag": thumbnail["etag"], "Cache-Control": "private, max-age=60"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and thumbnail["etag"] in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(content=base64.b64decode(thumbnail["jpeg"]), media_type="image/jpeg", headers=headers)
+
+
+@app.get("/api/signaling/shards")
+async def signaling_shards():
+    return signaling_gateway.stats()
+
+
 # Exam management endpoints
+def is_not_modified(request: Request, etag: str, modified_at: float) -> bool:
+    """Evaluate If-None-Match, falling back to If-Modified-Since."""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return etag in tags or "*" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(modified_at) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
 @app.get("/api/exams")
-async def list_exams():
-    return exam_service.list_exams()
+async def list_exams(
+    request: Request,
+    status: Optional[str] = None,
+    scheduledAfter: Optional[str] = None,
+    scheduledBefore: Optional[str] = None,
+    cursor: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=500),
+    view: str = Query("full", regex="^(full|summary)$")
+):
+    # Without teacher authorization the full view is the student view of each exam
+    student = view == "full" and not is_teacher(request)
+    # Answer unchanged polls before touching or serializing any exam
+    etag, modified_at = exam_service.listing_version()
+    if student:
+        etag = etag[:-1] + '-student"'
+    headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(modified_at, usegmt=True),
+        "Cache-Control": "no-cache",
+        "Vary": "Authorization"
+    }
+    if is_not_modified(request, etag, modified_at):
+        return Response(status_code=304, headers=headers)
+    
+    try:
+        exams, next_cursor = exam_service.list_exams_page(
+            status=status,
+            scheduled_after=scheduledAfter,
+            scheduled_before=scheduledBefore,
+            cursor=cursor,
+            limit=limit,
+            summary=view == "summary"
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if student:
+        exams = [student_view(exam) for exam in exams]
+    
+    if next_cursor:
+        headers["X-Next-Cursor"] = next_cursor
+        headers["Link"] = f'<{request.url.include_query_params(cursor=next_cursor)}>; rel="next"'
+    return JSONResponse(exams, headers=headers)
 
 
 @app.get("/api/exams/{exam_id}")
-async def get_exam(exam_id: str):
-    exam = exam_service.get_exam(exam_id)
+async def get_exam(request: Request, exam_id: str, view: str = Query("student", regex="^(full|student)$")):
+    if view == "full" and not is_teacher(request):
+        raise HTTPException(status_code=403, detail="The full view needs teacher authorization")
+    # Served from pre-encoded, pre-compressed bytes so an exam-start rush costs no serialization
+    payload = exam_cache.get(exam_id, view)
+    if not payload:
+        raise HTTPException(status_code=404, detail="Exam not found")
+    
+    body, encoding, etag = payload.body_for(request.headers.get("accept-encoding"))
+    headers = {"ETag": etag, "Vary": "Accept-Encoding", "Cache-Control": "no-cache"}
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match and etag in [tag.strip() for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    if encoding:
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+@app.get("/api/cache/exams")
+async def exam_cache_stats():
+    return exam_cache.stats()
+
+
+@app.get("/api/exams/by-code/{room_code}")
+async def get_exam_by_room_code(request: Request, room_code: str):
+    exam = exam_service.get_exam_by_room_code(room_code)
     if not exam:
         raise HTTPException(status_code=404, detail="Exam not found")
-    return exam
+    return exam if is_teacher(request) else student_view(exam)
 
 
 @app.post("/api/exams")
@@ -67,25 +422,115 @@ async def create_exam(exam: ExamCreate):
     return exam_service.create_exam(exam)
 
 
+@app.post("/api/exams/{exam_id}/answers")
+async def save_answers(exam_id: str, body: AnswerSave):
+    # Responds once the coalesced flush holding these answers has committed
+    try:
+        saved_at = await exam_service.save_answers(exam_id, body.studentId, body.answers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"saved": len(body.answers), "savedAt": saved_at}
+
+
+@app.post("/api/exams/{exam_id}/submit")
+async def submit_exam(exam_id: str, body: ExamSubmit):
+    try:
+        submitted = await exam_service.submit_answers(exam_id, body.studentId, body.answers)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {"examId": exam_id, "studentId": body.studentId, "savedAt": submitted}
+
+
+@app.get("/api/exams/{exam_id}/answers/{student_id}")
+async def get_answers(request: Request, exam_id: str, student_id: str):
+    require_teacher(request)
+    return exam_service.get_answers(exam_id, student_id)
+
+
+@app.get("/api/answers/stats")
+async def answer_stats():
+    return exam_service.autosave.stats()
+
+
 # WebSocket for WebRTC signaling
 @app.websocket("/ws")
 async def websocket_endpoint(websocket: WebSocket):
-    await websocket.accept()
+    # Clients opt into MessagePack via Sec-WebSocket-Protocol; others stay on JSON
+    subprotocol = wire.choose_subprotocol(websocket.scope.get("subprotocols") or [])
+    await websocket.accept(subprotocol=subprotocol)
     client_id = str(uuid.uuid4())
+    wire_format = wire.format_for(subprotocol)
     
     try:
         # Register the WebSocket connection
-        await signaling_service.register_connection(client_id, websocket)
+        await signaling_gateway.register_connection(client_id, websocket, wire_format)
+        heartbeats.add(client_id)
         
         while True:
-            data = await websocket.receive_json()
-            await signaling_service.handle_message(client_id, data)
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                raise WebSocketDisconnect(message.get("code", 1000))
+            heartbeats.seen(client_id)
+            message = wire.decode(message)
+            if message.get("type") == "pong":
+                heartbeats.pong(client_id)
+                continue
+            if message.get("type") == "resume":
+                # A reconnecting client continues as its earlier participant
+                resumed = await signaling_gateway.resume(client_id, websocket, wire_format, message.get("data") or {})
+                if resumed != client_id:
+                    heartbeats.remove(client_id)
+                    client_id = resumed
+                    heartbeats.add(client_id)
+                continue
+            await signaling_gateway.handle_message(client_id, message)
     except WebSocketDisconnect:
         # Handle WebSocket disconnect
-        await signaling_service.handle_disconnect(client_id)
+        await signaling_gateway.handle_disconnect(client_id, websocket)
     except Exception as e:
         print(f"Error in WebSocket: {e}")
-        await signaling_service.handle_disconnect(client_id)
+        await signaling_gateway.handle_disconnect(client_id, websocket)
+    finally:
+        if signaling_gateway.local_sockets.get(client_id) in (None, websocket):
+            heartbeats.remove(client_id)
+
+
+
+@app.websocket("/ws/thumbnails/{room_id}")
+async def thumbnail_feed(websocket: WebSocket, room_id: str):
+    """Push the room's thumbnail index whenever a batch of snapshots lands."""
+    if not is_teacher(websocket):
+        # Closing before accept turns the handshake into a 403
+        await websocket.close(code=1008)
+        return
+    await websocket.accept()
+    receiver = asyncio.create_task(websocket.receive())
+    try:
+        while True:
+            snapshot = await signaling_gateway.query_room(room_id, "thumbnails")
+            await websocket.send_json({
+                "type": "thumbnails", "data": snapshot["index"] if snapshot else thumbnail_index(room_id)
+            })
+            room = signaling_service.thumbnails.rooms.get(room_id)
+            # Re-check at the sampling interval so rooms that open later, or live on another worker, are picked up
+            waiters = {receiver}
+            if room:
+                waiters.add(asyncio.ensure_future(room.changed.wait()))
+            done, _ = await asyncio.wait(
+                waiters, timeout=max(1.0, signaling_service.thumbnails.interval), return_when=asyncio.FIRST_COMPLETED
+            )
+            for waiter in waiters - {receiver}:
+                waiter.cancel()
+            if receiver in done:
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
 
 
 if __name__ == "__main__":
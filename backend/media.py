@@ -0,0 +1,166 @@
+from typing import Dict, Any, Optional
+import os
+import re
+import time
+import asyncio
+import importlib
+import threading
+
+# aiortc, and PyAV and the crypto libraries under it, are imported on first
+# use: workers boot and reload without paying for them, and a worker that
+# never builds a transport never loads them
+_stack = None
+_load_lock = threading.Lock()
+_preload: Optional[asyncio.Future] = None
+load_seconds: Optional[float] = None
+
+# aiortc's certificates are valid for 30 days; leave room for long-lived transports
+MAX_CERT_LIFETIME = 25 * 86400
+
+# Sharing certificates replaces a private module-level name in aiortc's
+# rtcpeerconnection; these are the releases it has been checked against
+CERT_PATCH_VERSIONS = ((1, 4), (1, 9))
+
+
+def stack():
+    """The aiortc package, imported on first call."""
+    global _stack, load_seconds
+    if _stack is None:
+        with _load_lock:
+            if _stack is None:
+                started = time.perf_counter()
+                import aiortc
+                from aiortc import rtcpeerconnection
+                CERTIFICATES.installed = _patch_certificates(aiortc.__version__, rtcpeerconnection)
+                # Consumers build forwarding tracks on the loop; have their imports done too
+                importlib.import_module("forwarding")
+                load_seconds = time.perf_counter() - started
+                _stack = aiortc
+    return _stack
+
+
+def _patch_certificates(version: str, rtcpeerconnection) -> bool:
+    release = tuple(int(part) for part in re.findall(r"\d+", version)[:2])
+    low, high = CERT_PATCH_VERSIONS
+    if not (low <= release <= high and hasattr(rtcpeerconnection, "RTCCertificate")):
+        print(f"aiortc {version} is untested with shared DTLS certificates; generating one per connection")
+        return False
+    # RTCPeerConnection only calls generateCertificate() on this name
+    rtcpeerconnection.RTCCertificate = PooledCertificate
+    return True
+
+
+async def load():
+    """Import the media stack on a worker thread so the event loop keeps serving meanwhile."""
+    if _stack is None:
+        await asyncio.get_running_loop().run_in_executor(None, stack)
+    return _stack
+
+
+def preload() -> None:
+    """Start loading the media stack in the background, once; failures are only logged."""
+    global _preload
+    if _stack is None and _preload is None:
+        _preload = asyncio.ensure_future(load())
+        _preload.add_done_callback(_report_preload)
+
+
+def _report_preload(future: asyncio.Future) -> None:
+    if not future.cancelled() and future.exception():
+        print(f"Loading the media stack failed: {future.exception()}")
+
+
+def forwarding_track(kind: str):
+    from forwarding import ForwardingTrack
+    return ForwardingTrack(kind)
+
+
+def encoded_tap(receiver, **kwargs):
+    from forwarding import EncodedTap
+    return EncodedTap.install(receiver, **kwargs)
+
+
+class CertificatePool:
+    """DTLS certificate shared by every peer connection for a limited lifetime.
+
+    aiortc generates a key pair and self-signed certificate for each
+    RTCPeerConnection. The remote side only checks the certificate against
+    the fingerprint in our SDP, so one certificate can serve every transport.
+    It is replaced once it is `lifetime` seconds old, and the replacement is
+    generated on a worker thread.
+    """
+
+    def __init__(self, lifetime: float = None):
+        lifetime = lifetime if lifetime is not None else float(os.getenv("DTLS_CERT_LIFETIME", "86400"))
+        self.lifetime = min(lifetime, MAX_CERT_LIFETIME)
+        self.current = None
+        self.created_at = 0.0
+        self.rotating = None
+        self.generated = 0
+        self.reused = 0
+        # Whether RTCPeerConnection asks this pool for its certificates at all
+        self.installed = False
+
+    @property
+    def enabled(self) -> bool:
+        return self.installed and self.lifetime > 0
+
+    def _expired(self) -> bool:
+        return self.current is None or time.monotonic() - self.created_at >= self.lifetime
+
+    async def refresh(self) -> None:
+        """Have a valid certificate ready before a peer connection is built."""
+        if not self.enabled or not self._expired():
+            return
+        if self.rotating is None:
+            self.rotating = asyncio.ensure_future(self._rotate())
+        # Concurrent builds share one rotation
+        await asyncio.shield(self.rotating)
+
+    async def _rotate(self) -> None:
+        try:
+            certificate = await asyncio.get_running_loop().run_in_executor(None, self._generate)
+            self.current = certificate
+            self.created_at = time.monotonic()
+        finally:
+            self.rotating = None
+
+    def _generate(self):
+        self.generated += 1
+        return stack().RTCCertificate.generateCertificate()
+
+    def certificate(self):
+        """Called from RTCPeerConnection's constructor."""
+        if not self.enabled or self._expired():
+            return self._generate()
+        self.reused += 1
+        return self.current
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "installed": self.installed,
+            "lifetime": self.lifetime,
+            "generated": self.generated,
+            "reused": self.reused,
+            "ageSeconds": round(time.monotonic() - self.created_at, 1) if self.current else None
+        }
+
+
+class PooledCertificate:
+    """Stands in for RTCCertificate inside aiortc.rtcpeerconnection."""
+
+    @staticmethod
+    def generateCertificate():
+        return CERTIFICATES.certificate()
+
+
+CERTIFICATES = CertificatePool()
+
+
+def stats() -> Dict[str, Any]:
+    return {
+        "loaded": _stack is not None,
+        "loadSeconds": round(load_seconds, 4) if load_seconds is not None else None,
+        "certificates": CERTIFICATES.stats()
+    }
@@ -0,0 +1,223 @@
+from typing import Dict, Any, List, Tuple, Callable, Optional, Union
+from bisect import bisect_left
+import time
+import asyncio
+
+# Latency buckets in seconds, from sub-millisecond handlers up to slow transport setup
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Tuple[str, ...], values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(f'{extra[0]}="{extra[1]}"')
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """Monotonic counter, optionally split by labels."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> List[str]:
+        return [
+            f"{self.name}{_format_labels(self.labels, values)} {_format_value(value)}"
+            for values, value in self.values.items()
+        ]
+
+
+class Gauge:
+    """Point-in-time value, either set directly or read from a callback at scrape time."""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (),
+                 callback: Optional[Callable[[], Union[float, Dict[LabelValues, float]]]] = None):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.callback = callback
+        self.values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, *label_values: str) -> None:
+        self.values[label_values] = value
+
+    def samples(self) -> List[str]:
+        values = self.values
+        if self.callback:
+            result = self.callback()
+            values = result if isinstance(result, dict) else {(): result}
+        return [
+            f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}"
+            for key, value in values.items()
+        ]
+
+
+class Histogram:
+    """Bucketed distribution; observe() is a bisect and two additions."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last is +Inf), sum]
+        self.series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *label_values: str) -> None:
+        series = self.series.get(label_values)
+        if series is None:
+            series = self.series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def time(self, *label_values: str) -> "_Timer":
+        return _Timer(self, label_values)
+
+    def samples(self) -> List[str]:
+        lines = []
+        for values, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                lines.append(
+                    f"{self.name}_bucket{_format_labels(self.labels, values, ('le', _format_value(bound)))} {cumulative}"
+                )
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, values)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, values)} {cumulative}")
+        return lines
+
+
+class _Timer:
+    __slots__ = ("histogram", "label_values", "start")
+
+    def __init__(self, histogram: Histogram, label_values: LabelValues):
+        self.histogram = histogram
+        self.label_values = label_values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, *self.label_values)
+        return False
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: Dict[str, Any] = {}
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Tuple[str, ...] = ()) -> Counter:
+        return self.register(Counter(name, help, labels))
+
+    def gauge(self, name: str, help: str, labels: Tuple[str, ...] = (), callback=None) -> Gauge:
+        return self.register(Gauge(name, help, labels, callback))
+
+    def histogram(self, name: str, help: str, labels: Tuple[str, ...] = (), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, labels, buckets))
+
+    def render(self) -> str:
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            try:
+                lines.extend(metric.samples())
+            except Exception as e:
+                print(f"Error collecting metric {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+SIGNALING_MESSAGE_SECONDS = REGISTRY.histogram(
+    "signaling_message_seconds", "Time spent in handle_message by message type", ("type",)
+)
+TRANSPORT_CREATE_SECONDS = REGISTRY.histogram(
+    "webrtc_transport_create_seconds", "Time to serve a createWebRtcTransport request", ("source",)
+)
+TRANSPORT_SETUP_SECONDS = REGISTRY.histogram(
+    "webrtc_transport_setup_seconds", "Time spent in each step of building a transport", ("step",)
+)
+SEND_FAILURES = REGISTRY.counter(
+    "signaling_send_failures_total", "Outbound WebSocket sends that failed or were refused", ("reason",)
+)
+SIGNALING_REJECTED = REGISTRY.counter(
+    "signaling_rejected_total", "Signaling messages refused by rate limits or full room mailboxes", ("reason",)
+)
+TRANSPORTS_REAPED = REGISTRY.counter(
+    "webrtc_transports_reaped_total", "Transports closed because the client never connected them"
+)
+ANSWERS_RECEIVED = REGISTRY.counter(
+    "answers_received_total", "Answer saves received before coalescing"
+)
+ANSWERS_WRITTEN = REGISTRY.counter(
+    "answers_written_total", "Answers written to the store after coalescing"
+)
+ANSWER_FLUSH_SECONDS = REGISTRY.histogram(
+    "answer_flush_seconds", "Time to write one bulk answer flush"
+)
+HEARTBEAT_TIMEOUTS = REGISTRY.counter(
+    "signaling_heartbeat_timeouts_total", "Signaling sockets closed after sending nothing for the heartbeat timeout"
+)
+JOIN_QUEUE_WAIT_SECONDS = REGISTRY.histogram(
+    "signaling_join_queue_wait_seconds", "Time a joinRoom waited in the admission queue",
+    buckets=(0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+)
+EVENT_LOOP_LAG_SECONDS = REGISTRY.histogram(
+    "event_loop_lag_seconds", "How late a periodic event-loop timer fired",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+
+
+class LoopLagMonitor:
+    """Samples event-loop lag with one timer; negligible cost at a 0.5s interval."""
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.task = None
+
+    def start(self) -> None:
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            EVENT_LOOP_LAG_SECONDS.observe(max(0.0, loop.time() - expected))
@@ -0,0 +1,156 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import OrderedDict
+import copy
+import json
+import hashlib
+
+RTX_MIME_TYPE = "video/rtx"
+
+
+def fingerprint(value: Any) -> str:
+    """Stable hash of a JSON-compatible structure."""
+    return hashlib.sha1(json.dumps(value, sort_keys=True, separators=(",", ":")).encode()).hexdigest()
+
+
+def _param(parameters: Dict[str, Any], name: str) -> Any:
+    """Read a codec parameter written either as "packetization-mode" or "packetizationMode"."""
+    if name in parameters:
+        return parameters[name]
+    head, *rest = name.split("-")
+    return parameters.get(head + "".join(part.capitalize() for part in rest))
+
+
+def _kind(codec: Dict[str, Any]) -> str:
+    return codec.get("kind") or codec.get("mimeType", "").split("/")[0].lower()
+
+
+def codecs_match(producer_codec: Dict[str, Any], capability: Dict[str, Any]) -> bool:
+    mime_type = producer_codec.get("mimeType", "").lower()
+    if mime_type != capability.get("mimeType", "").lower():
+        return False
+    if producer_codec.get("clockRate") != capability.get("clockRate"):
+        return False
+    if mime_type.startswith("audio/") and (producer_codec.get("channels") or 1) != (capability.get("channels") or 1):
+        return False
+
+    producer_params = producer_codec.get("parameters") or {}
+    capability_params = capability.get("parameters") or {}
+    if mime_type == "video/h264":
+        if int(_param(producer_params, "packetization-mode") or 0) != int(_param(capability_params, "packetization-mode") or 0):
+            return False
+        # profile_idc (first byte of profile-level-id) must agree; the level may differ
+        producer_profile = str(_param(producer_params, "profile-level-id") or "42e01f")[:2].lower()
+        capability_profile = str(_param(capability_params, "profile-level-id") or "42e01f")[:2].lower()
+        if producer_profile != capability_profile:
+            return False
+    elif mime_type == "video/vp9":
+        if int(_param(producer_params, "profile-id") or 0) != int(_param(capability_params, "profile-id") or 0):
+            return False
+    return True
+
+
+def _feedback_key(feedback: Dict[str, Any]) -> Tuple[str, str]:
+    return feedback.get("type", ""), feedback.get("parameter", "")
+
+
+class CodecNegotiator:
+    """Matches producer RTP parameters against consumer RTP capabilities.
+
+    The outcome only depends on the producer's codecs/header extensions and the
+    consumer's capability set, and whole classes send identical ones (same
+    browser build), so results are memoized by the pair of fingerprints.
+    """
+
+    def __init__(self, max_entries: int = 1024):
+        self.max_entries = max_entries
+        self.cache: "OrderedDict[Tuple[str, str], Optional[Dict[str, Any]]]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # Callers often pass the same capabilities object many times in a row
+        self._last_capabilities = (None, None)
+
+    def capabilities_key(self, rtp_capabilities: Dict[str, Any]) -> str:
+        last, key = self._last_capabilities
+        if last is rtp_capabilities:
+            return key
+        key = fingerprint({
+            "codecs": rtp_capabilities.get("codecs") or [],
+            "headerExtensions": rtp_capabilities.get("headerExtensions") or []
+        })
+        self._last_capabilities = (rtp_capabilities, key)
+        return key
+
+    @staticmethod
+    def producer_key(rtp_parameters: Dict[str, Any]) -> str:
+        return fingerprint({
+            "codecs": rtp_parameters.get("codecs") or [],
+            "headerExtensions": rtp_parameters.get("headerExtensions") or []
+        })
+
+    def negotiate(self, producer_key: str, rtp_parameters: Dict[str, Any],
+                  rtp_capabilities: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """Codecs and header extensions the consumer can receive, or None if incompatible.
+
+        The returned dict is shared between callers and must not be mutated.
+        """
+        key = (producer_key, self.capabilities_key(rtp_capabilities))
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.misses += 1
+        result = self._match(rtp_parameters, rtp_capabilities)
+        self.cache[key] = result
+        while len(self.cache) > self.max_entries:
+            self.cache.popitem(last=False)
+        return result
+
+    def _match(self, rtp_parameters: Dict[str, Any], rtp_capabilities: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        capability_codecs = rtp_capabilities.get("codecs") or []
+        producer_codecs = rtp_parameters.get("codecs") or []
+        accepts_rtx = any(c.get("mimeType", "").lower() == RTX_MIME_TYPE for c in capability_codecs)
+
+        codecs: List[Dict[str, Any]] = []
+        matched_payload_types = set()
+        for codec in producer_codecs:
+            if codec.get("mimeType", "").lower() == RTX_MIME_TYPE:
+                continue
+            capability = next((c for c in capability_codecs if codecs_match(codec, c)), None)
+            if not capability:
+                continue
+            negotiated = copy.deepcopy(codec)
+            accepted = {_feedback_key(f) for f in capability.get("rtcpFeedback") or []}
+            negotiated["rtcpFeedback"] = [
+                f for f in codec.get("rtcpFeedback") or [] if _feedback_key(f) in accepted
+            ]
+            codecs.append(negotiated)
+            matched_payload_types.add(codec.get("payloadType"))
+
+        if not codecs:
+            return None
+
+        # Keep retransmission streams only for codecs that survived
+        if accepts_rtx:
+            for codec in producer_codecs:
+                if (codec.get("mimeType", "").lower() == RTX_MIME_TYPE
+                        and (codec.get("parameters") or {}).get("apt") in matched_payload_types):
+                    codecs.append(copy.deepcopy(codec))
+
+        kind = _kind(codecs[0])
+        supported_uris = {
+            ext.get("uri") for ext in rtp_capabilities.get("headerExtensions") or []
+            if ext.get("kind") in (None, "", kind)
+        }
+        header_extensions = [
+            copy.deepcopy(ext) for ext in rtp_parameters.get("headerExtensions") or []
+            if ext.get("uri") in supported_uris
+        ]
+        return {"codecs": codecs, "headerExtensions": header_extensions}
+
+    def stats(self) -> Dict[str, Any]:
+        return {"entries": len(self.cache), "hits": self.hits, "misses": self.misses}
+
+
+# Shared by every router: capability sets repeat across rooms too
+NEGOTIATOR = CodecNegotiator()
@@ -0,0 +1,94 @@
+from typing import Dict, Any, Optional
+from datetime import datetime, timedelta
+import os
+import asyncio
+
+
+def parse_scheduled(value: Optional[str]) -> Optional[datetime]:
+    """scheduledFor as a naive local datetime, like the ones create_exam writes."""
+    if not value:
+        return None
+    try:
+        scheduled = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        return None
+    if scheduled.tzinfo is not None:
+        scheduled = scheduled.astimezone().replace(tzinfo=None)
+    return scheduled
+
+
+class ExamPrewarmer:
+    """Prepares the rooms of upcoming exams a little before they start.
+
+    Every poll it looks for pending exams scheduled within the lead time and
+    asks the signaling layer to create their room and router and fill a
+    larger transport pool than usual, so the first joins find everything
+    warm. Each worker only prepares the rooms it owns. The hold time after
+    scheduledFor is when the pool drops back to its normal size, and when
+    the room is closed if nobody has joined.
+    """
+
+    def __init__(self, exams, signaling, lead_time: float = None, hold: float = None,
+                 transports: int = None, poll_interval: float = None):
+        self.exams = exams
+        self.signaling = signaling
+        self.lead_time = lead_time if lead_time is not None else float(os.getenv("PREWARM_LEAD_SECONDS", "120"))
+        self.hold = hold if hold is not None else float(os.getenv("PREWARM_HOLD_SECONDS", "300"))
+        self.transports = transports or int(os.getenv("PREWARM_TRANSPORTS", "32"))
+        self.poll_interval = poll_interval or float(os.getenv("PREWARM_POLL_INTERVAL", "15"))
+        self.warmed: Dict[str, datetime] = {}  # room_id -> when to release it
+        self.task = None
+        self.prepared = 0
+        self.released = 0
+
+    async def start(self) -> None:
+        if self.lead_time > 0 and self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.tick()
+            except Exception as e:
+                print(f"Exam pre-warming failed: {e}")
+            await asyncio.sleep(self.poll_interval)
+
+    async def tick(self, now: datetime = None) -> None:
+        now = now or datetime.now()
+        exams, _ = self.exams.list_exams_page(
+            status="pending",
+            scheduled_after=(now - timedelta(seconds=self.hold)).isoformat(),
+            scheduled_before=(now + timedelta(seconds=self.lead_time)).isoformat()
+        )
+        for exam in exams:
+            room_id = exam.get("roomCode")
+            scheduled = parse_scheduled(exam.get("scheduledFor"))
+            if not room_id or scheduled is None or room_id in self.warmed:
+                continue
+            if not await self.signaling.owns_room(room_id):
+                continue
+            self.warmed[room_id] = scheduled + timedelta(seconds=self.hold)
+            await self.signaling.prepare_room(room_id, self.transports)
+            self.prepared += 1
+
+        for room_id, release_at in list(self.warmed.items()):
+            if now >= release_at:
+                del self.warmed[room_id]
+                await self.signaling.release_room(room_id)
+                self.released += 1
+
+    async def close(self) -> None:
+        if self.task:
+            self.task.cancel()
+            self.task = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.lead_time > 0,
+            "leadSeconds": self.lead_time,
+            "holdSeconds": self.hold,
+            "transports": self.transports,
+            "warm": {room_id: release_at.isoformat() for room_id, release_at in self.warmed.items()},
+            "prepared": self.prepared,
+            "released": self.released
+        }
@@ -0,0 +1,278 @@
+from typing import Dict, Any, List, Optional, Tuple
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import os
+import re
+import time
+import asyncio
+import fractions
+
+# Codecs per container; WebM keeps the server free of patent-encumbered encoders
+CONTAINER_CODECS = {
+    "webm": {"audio": "libopus", "video": "libvpx"},
+    "mp4": {"audio": "aac", "video": "libx264"}
+}
+
+SAFE_NAME = re.compile(r"[^A-Za-z0-9_.-]")
+
+# Video is timestamped on the RTP clock; 30 fps is only the encoder's nominal rate
+VIDEO_TIME_BASE = fractions.Fraction(1, 90000)
+# Seconds between consecutive frames' timestamps beyond which arrival time is used instead
+MAX_TIMESTAMP_STEP = 5
+
+
+def _safe(name: Any) -> str:
+    return SAFE_NAME.sub("_", str(name)) or "unknown"
+
+
+def frame_size(frame: Any) -> int:
+    """Bytes of pixel or sample data a decoded frame holds."""
+    return sum(plane.buffer_size for plane in frame.planes)
+
+
+class SegmentWriter:
+    """Encodes and muxes one producer's frames into rolling segment files.
+
+    Only ever called from a worker thread, one batch at a time, so it holds
+    no locks. Each segment is a complete file that plays on its own: its
+    timestamps start at zero and are rescaled from the frames' clock to the
+    stream's time base.
+    """
+
+    def __init__(self, directory: str, prefix: str, kind: str, container: str, segment_seconds: float):
+        self.directory = directory
+        self.prefix = prefix
+        self.kind = kind
+        self.container_format = container
+        self.codec = CONTAINER_CODECS[container][kind]
+        self.segment_seconds = segment_seconds
+        self.container = None
+        self.stream = None
+        self.segment_started = 0.0
+        self.segment_index = 0
+        self.segments: List[str] = []
+        self.time_base = VIDEO_TIME_BASE
+        # Source timestamp and segment time of the last frame, and the pts it was given
+        self.source_pts: Optional[int] = None
+        self.seconds = 0.0
+        self.last_pts: Optional[int] = None
+
+    def write(self, frames: List[Tuple[float, Any]]) -> None:
+        for received_at, frame in frames:
+            if self.container is None or received_at - self.segment_started >= self.segment_seconds:
+                self._roll(received_at, frame)
+            self._retime(frame, received_at)
+            for packet in self.stream.encode(frame):
+                self.container.mux(packet)
+
+    def _retime(self, frame: Any, received_at: float) -> None:
+        """Put frame.pts on the stream's time base, counting from the segment's first frame."""
+        seconds = received_at - self.segment_started
+        if frame.pts is not None and frame.time_base and self.source_pts is not None:
+            # RTP timestamps are 32-bit and wrap; a bigger jump means the sender's clock was reset
+            step = (frame.pts - self.source_pts) % 2 ** 32 * frame.time_base
+            if step <= MAX_TIMESTAMP_STEP:
+                seconds = self.seconds + step
+        self.source_pts = frame.pts
+        self.seconds = seconds
+        pts = int(seconds / self.time_base)
+        # Encoders refuse repeated timestamps
+        if self.last_pts is not None and pts <= self.last_pts:
+            pts = self.last_pts + 1
+        frame.pts = pts
+        frame.time_base = self.time_base
+        self.last_pts = pts
+
+    def _roll(self, received_at: float, frame: Any) -> None:
+        # Imported here so the module loads, and recording stays off, without PyAV
+        import av
+
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        path = os.path.join(
+            self.directory, f"{self.prefix}-{self.segment_index:05d}.{self.container_format}"
+        )
+        self.container = av.open(path, mode="w", format=self.container_format)
+        if self.kind == "video":
+            self.stream = self.container.add_stream(self.codec, rate=30)
+            self.stream.width = frame.width
+            self.stream.height = frame.height
+            self.stream.pix_fmt = "yuv420p"
+            self.time_base = VIDEO_TIME_BASE
+        else:
+            self.stream = self.container.add_stream(self.codec, rate=frame.sample_rate)
+            self.time_base = fractions.Fraction(1, frame.sample_rate)
+        self.stream.codec_context.time_base = self.time_base
+        self.source_pts = None
+        self.last_pts = None
+        self.segment_started = received_at
+        self.segment_index += 1
+        self.segments.append(path)
+
+    def close(self) -> None:
+        """Flush the encoder and finish the current segment."""
+        if self.container is None:
+            return
+        try:
+            for packet in self.stream.encode(None):
+                self.container.mux(packet)
+        finally:
+            self.container.close()
+            self.container = None
+            self.stream = None
+
+
+class ProducerRecorder:
+    """Sink attached to a Producer; hands frames to a SegmentWriter on the worker pool.
+
+    push() runs on the forwarding path and only appends to a buffer bounded
+    in bytes, since decoded frames are large and vary with resolution. When
+    the disk falls behind, the oldest buffered frames are dropped rather than
+    slowing forwarding down.
+    """
+
+    def __init__(self, writer: SegmentWriter, executor: ThreadPoolExecutor, buffer_bytes: int):
+        self.writer = writer
+        self.executor = executor
+        self.buffer = deque()  # (received_at, frame, size)
+        self.buffer_bytes = buffer_bytes
+        self.buffered_bytes = 0
+        self.task = None
+        self.closed = False
+        self.failed = None
+        self.frames = 0
+        self.dropped = 0
+
+    def push(self, frame: Any) -> None:
+        if self.closed or self.failed:
+            return
+        size = frame_size(frame)
+        # The newest frame is always kept, even one larger than the whole budget
+        while self.buffer and self.buffered_bytes + size > self.buffer_bytes:
+            self.buffered_bytes -= self.buffer.popleft()[2]
+            self.dropped += 1
+        self.buffer.append((time.monotonic(), frame, size))
+        self.buffered_bytes += size
+        if self.task is None:
+            self.task = asyncio.create_task(self._drain())
+
+    async def _drain(self) -> None:
+        loop = asyncio.get_running_loop()
+        try:
+            # One batch in flight per producer keeps its writer single-threaded
+            while self.buffer:
+                batch = [(received_at, frame) for received_at, frame, _ in self.buffer]
+                self.buffer.clear()
+                self.buffered_bytes = 0
+                await loop.run_in_executor(self.executor, self.writer.write, batch)
+                self.frames += len(batch)
+        except Exception as e:
+            self.failed = str(e)
+            self.buffer.clear()
+            self.buffered_bytes = 0
+            print(f"Recording {self.writer.prefix} failed: {e}")
+        finally:
+            self.task = None
+
+    async def close(self) -> None:
+        """Write what is buffered, then finish the open segment."""
+        self.closed = True
+        loop = asyncio.get_running_loop()
+        if self.task:
+            await self.task
+        if self.buffer and not self.failed:
+            await self._drain()
+        await loop.run_in_executor(self.executor, self.writer.close)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "kind": self.writer.kind,
+            "segments": len(self.writer.segments),
+            "frames": self.frames,
+            "dropped": self.dropped,
+            "buffered": len(self.buffer),
+            "bufferedBytes": self.buffered_bytes,
+            "failed": self.failed
+        }
+
+
+class RoomRecording:
+    """Recorders for every producer of one exam room."""
+
+    def __init__(self, manager: "RecordingManager", room_id: str):
+        self.manager = manager
+        self.room_id = room_id
+        self.directory = os.path.join(manager.directory, _safe(room_id))
+        self.recorders: Dict[str, ProducerRecorder] = {}
+        self.closing = set()
+
+    def attach(self, producer, owner: Optional[str] = None) -> None:
+        """Start recording a producer's highest layer."""
+        if producer.id in self.recorders:
+            return
+        writer = SegmentWriter(
+            self.directory,
+            prefix=f"{_safe(owner or 'unknown')}-{producer.kind}-{producer.id[:8]}",
+            kind=producer.kind,
+            container=self.manager.container,
+            segment_seconds=self.manager.segment_seconds
+        )
+        recorder = ProducerRecorder(writer, self.manager.executor, self.manager.buffer_bytes)
+        self.recorders[producer.id] = recorder
+        producer.add_sink(recorder)
+
+    def release(self, producer) -> None:
+        """Stop recording a producer; its last segment is finished in the background."""
+        recorder = self.recorders.pop(producer.id, None)
+        if recorder:
+            producer.remove_sink(recorder)
+            task = asyncio.create_task(recorder.close())
+            self.closing.add(task)
+            task.add_done_callback(self.closing.discard)
+
+    async def close(self) -> None:
+        recorders = list(self.recorders.values())
+        self.recorders.clear()
+        await asyncio.gather(
+            *(recorder.close() for recorder in recorders), *self.closing, return_exceptions=True
+        )
+
+    def stats(self) -> Dict[str, Any]:
+        return {producer_id: recorder.stats() for producer_id, recorder in self.recorders.items()}
+
+
+class RecordingManager:
+    """Shared worker pool and settings for all recorded rooms on this worker."""
+
+    def __init__(self, directory: str = None, segment_seconds: float = None, workers: int = None,
+                 buffer_bytes: int = None, container: str = None):
+        self.directory = directory or os.getenv("RECORDING_DIR", "recordings")
+        self.segment_seconds = segment_seconds or float(os.getenv("RECORDING_SEGMENT_SECONDS", "10"))
+        self.buffer_bytes = buffer_bytes or int(os.getenv("RECORDING_BUFFER_BYTES", str(8 * 1024 * 1024)))
+        self.container = container or os.getenv("RECORDING_CONTAINER", "webm")
+        if self.container not in CONTAINER_CODECS:
+            raise ValueError(f"Unsupported recording container: {self.container}")
+        self.executor = ThreadPoolExecutor(
+            max_workers=workers or int(os.getenv("RECORDING_WORKERS", "2")),
+            thread_name_prefix="recording"
+        )
+        self.rooms: Dict[str, RoomRecording] = {}
+
+    def for_room(self, room_id: str) -> RoomRecording:
+        recording = self.rooms.get(room_id)
+        if recording is None:
+            recording = self.rooms[room_id] = RoomRecording(self, room_id)
+        return recording
+
+    async def close_room(self, room_id: str) -> None:
+        recording = self.rooms.pop(room_id, None)
+        if recording:
+            await recording.close()
+
+    async def close(self) -> None:
+        for room_id in list(self.rooms):
+            await self.close_room(room_id)
+        self.executor.shutdown(wait=False)
+
+    def stats(self) -> Dict[str, Any]:
+        return {room_id: recording.stats() for room_id, recording in self.rooms.items()}
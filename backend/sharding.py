@@ -0,0 +1,339 @@
+from typing import Dict, Any, Optional, List, Set, Callable, Awaitable
+import time
+import uuid
+import hashlib
+import asyncio
+import wire
+from bus import MessageBus
+from fanout import EncodedFrame
+
+WORKER_PREFIX = "worker-"
+
+
+def room_owner(room_id: str, workers: List[str]) -> Optional[str]:
+    """Rendezvous hashing: the worker a new room should go to.
+
+    Adding a worker changes the answer for a share of all rooms, so this only
+    places rooms nobody holds a lease on; see ShardedSignaling.owner_for_room.
+    """
+    if not workers:
+        return None
+    return max(workers, key=lambda w: hashlib.sha1(f"{w}:{room_id}".encode()).digest())
+
+
+class RemoteSocket:
+    """Stands in for a WebSocket held by another worker; sends travel over the bus."""
+
+    def __init__(self, bus: MessageBus, origin: str, client_id: str):
+        self.bus = bus
+        self.origin = origin
+        self.client_id = client_id
+
+    async def send_text(self, text: str) -> None:
+        await self.bus.publish(self.origin, {"op": "deliver", "client": self.client_id, "text": text})
+
+    async def send_json(self, message: Dict[str, Any]) -> None:
+        await self.send_text(EncodedFrame(message).text)
+
+    async def send_bytes(self, data: bytes) -> None:
+        # Room owners always register remote clients as JSON; see register_connection
+        await self.send_text(EncodedFrame(wire.unpack(data)).text)
+
+    async def close(self) -> None:
+        await self.bus.publish(self.origin, {"op": "close", "client": self.client_id})
+
+
+class ShardedSignaling:
+    """Routes each client to the worker that owns its room.
+
+    Every worker runs its own WebRTCSignaling. A client connects to whichever
+    worker accepted its WebSocket; once it joins a room, its messages are
+    forwarded to the room's owner, which answers through a RemoteSocket. Room
+    broadcasts therefore reach clients on other workers via the bus.
+
+    Ownership is a lease on the bus that the owner renews while it hosts the
+    room, so rooms stay put when workers join, and move only once their
+    owner has gone. Without a configured worker_id each worker takes the
+    lowest free slot number on the bus, which a restarted worker inherits.
+    """
+
+    def __init__(self, signaling, bus: MessageBus, worker_id: Optional[str] = None,
+                 membership_ttl: float = 1.0, lease_ttl: float = 30.0):
+        self.signaling = signaling
+        self.bus = bus
+        self.channel = f"{WORKER_PREFIX}{worker_id}" if worker_id else None
+        self.membership_ttl = membership_ttl
+        self.lease_ttl = lease_ttl
+        self.leased: Set[str] = set()
+        self.lease_task: Optional[asyncio.Task] = None
+        # Room-scoped lookups other workers may ask this one to answer, by name
+        self.queries: Dict[str, Callable[[str, Dict[str, Any]], Awaitable[Any]]] = {}
+        self.pending_queries: Dict[str, asyncio.Future] = {}
+        self.client_owners: Dict[str, str] = {}  # local client_id -> owning worker channel
+        self.local_sockets: Dict[str, Any] = {}
+        self.pending_resumes: Dict[str, Any] = {}  # new client_id -> (future, websocket, wire_format)
+        self.resume_timeout = 5.0
+        self._workers: List[str] = []
+        self._workers_at = 0.0
+
+    async def start(self) -> None:
+        await self.bus.start()
+        if self.channel is None:
+            self.channel = f"{WORKER_PREFIX}{self.bus.worker_slot()}"
+        await self.bus.subscribe(self.channel, self._on_bus_message)
+        await self.signaling.start()
+        self.lease_task = asyncio.create_task(self._renew_leases())
+
+    async def close(self) -> None:
+        if self.lease_task:
+            self.lease_task.cancel()
+            self.lease_task = None
+        for room_id in self.leased:
+            await self.bus.release(room_id, self.channel)
+        self.leased.clear()
+        await self.signaling.close()
+        await self.bus.close()
+
+    def workers(self) -> List[str]:
+        now = time.monotonic()
+        if now - self._workers_at > self.membership_ttl:
+            self._workers = self.bus.channels(WORKER_PREFIX) or [self.channel]
+            self._workers_at = now
+        return self._workers
+
+    async def owner_for_room(self, room_id: str) -> str:
+        """The worker hosting room_id; an unheld room is leased to its rendezvous choice.
+
+        The lease is taken on the chosen worker's behalf before it hears of
+        the room, so two workers routing the first joins concurrently agree.
+        It lapses after lease_ttl if the room never gets created.
+        """
+        workers = self.workers()
+        holder = await self.bus.lease_holder(room_id)
+        if holder and holder not in workers:
+            # Maybe a worker started since membership was last read
+            self._workers_at = 0.0
+            workers = self.workers()
+        if holder in workers:
+            return holder
+        preferred = room_owner(room_id, workers) or self.channel
+        return await self.bus.claim(room_id, preferred, self.lease_ttl, workers)
+
+    async def owns_room(self, room_id: str) -> bool:
+        return await self.owner_for_room(room_id) == self.channel
+
+    async def _renew_leases(self) -> None:
+        while True:
+            await asyncio.sleep(self.lease_ttl / 3)
+            try:
+                await self.renew_leases()
+            except Exception as e:
+                print(f"Room lease renewal failed: {e}")
+
+    async def renew_leases(self) -> None:
+        """Keep the leases of the rooms hosted here, and give up those of closed rooms."""
+        rooms = set(self.signaling.rooms)
+        workers = self.workers()
+        for room_id in rooms:
+            holder = await self.bus.claim(room_id, self.channel, self.lease_ttl, workers)
+            if holder != self.channel:
+                # Only after this worker stalled past its lease; new joins now go to the holder
+                print(f"Room {room_id} is leased to {holder}, not to {self.channel}")
+        for room_id in self.leased - rooms:
+            await self.bus.release(room_id, self.channel)
+        self.leased = rooms
+
+    async def query_room(self, room_id: str, name: str, args: Optional[Dict[str, Any]] = None) -> Any:
+        """Answer a lookup registered in queries on the worker hosting room_id.
+
+        HTTP requests land on any worker, but only the owner has the room's
+        state. Returns None when nobody hosts the room or the owner is gone.
+        """
+        args = args or {}
+        holder = await self.bus.lease_holder(room_id)
+        if holder is None or holder == self.channel:
+            return await self.queries[name](room_id, args)
+        query_id = uuid.uuid4().hex
+        future = self.pending_queries[query_id] = asyncio.get_running_loop().create_future()
+        try:
+            await self.bus.publish(holder, {
+                "op": "query", "id": query_id, "origin": self.channel,
+                "room": room_id, "name": name, "args": args
+            })
+            return await asyncio.wait_for(future, self.resume_timeout)
+        except (ConnectionError, asyncio.TimeoutError):
+            return None
+        finally:
+            self.pending_queries.pop(query_id, None)
+
+    async def prepare_room(self, room_id: str, transports: int) -> None:
+        await self.signaling.prepare_room(room_id, transports)
+
+    async def release_room(self, room_id: str) -> None:
+        await self.signaling.release_room(room_id)
+
+    async def register_connection(self, client_id: str, websocket, wire_format: str = wire.JSON) -> None:
+        self.local_sockets[client_id] = websocket
+        # Only this worker talks to the real socket, so only it needs the client's wire format
+        await self.signaling.register_connection(client_id, websocket, wire_format)
+
+    async def handle_message(self, client_id: str, message: Dict[str, Any]) -> None:
+        if message.get("type") == "joinRoom":
+            room_id = (message.get("data") or {}).get("room")
+            if room_id:
+                await self._bind_owner(client_id, await self.owner_for_room(room_id))
+
+        owner = self.client_owners.get(client_id, self.channel)
+        if owner == self.channel:
+            await self.signaling.handle_message(client_id, message)
+            return
+
+        try:
+            await self.bus.publish(owner, {
+                "op": "message",
+                "client": client_id,
+                "origin": self.channel,
+                "message": message
+            })
+        except ConnectionError:
+            # The owner went away; forget it so the next join re-shards the room
+            self._workers_at = 0.0
+            self.client_owners.pop(client_id, None)
+            await self.signaling.send_error(client_id, "Room worker unavailable, please rejoin")
+
+    async def handle_disconnect(self, client_id: str, websocket=None) -> None:
+        if websocket is not None and self.local_sockets.get(client_id) not in (None, websocket):
+            # This socket was superseded by a resumed connection; the session lives on there
+            return
+        self.local_sockets.pop(client_id, None)
+        await self._bind_owner(client_id, None)
+        await self.signaling.handle_disconnect(client_id)
+
+    async def resume(self, client_id: str, websocket, wire_format: str, data: Dict[str, Any]) -> str:
+        """Take back a held session; returns the client id the connection continues under.
+
+        The token is checked by the worker that owns the room, which then
+        answers through whichever worker this new socket landed on.
+        """
+        token = data.get("token")
+        room_id = data.get("room")
+        owner = await self.owner_for_room(room_id) if room_id else self.channel
+        resumed = None
+        if owner == self.channel:
+            resumed = self.signaling.session_for(token)
+            if resumed:
+                await self._adopt(client_id, resumed, websocket, wire_format, owner)
+                await self.signaling.resume(resumed, client_id, websocket, wire_format)
+        else:
+            future = asyncio.get_running_loop().create_future()
+            self.pending_resumes[client_id] = (future, websocket, wire_format)
+            try:
+                await self.bus.publish(owner, {
+                    "op": "resume", "client": client_id, "origin": self.channel, "token": token
+                })
+                resumed = await asyncio.wait_for(future, self.resume_timeout)
+            except (ConnectionError, asyncio.TimeoutError):
+                resumed = None
+            finally:
+                self.pending_resumes.pop(client_id, None)
+
+        if not resumed:
+            await self.signaling.send_to_client(client_id, {"type": "resumeFailed", "data": {"reason": "expired"}})
+            return client_id
+        return resumed
+
+    async def _adopt(self, client_id: str, resumed: str, websocket, wire_format: str, owner: str) -> None:
+        """Move this worker's bookkeeping of a connection from its fresh id to the resumed one."""
+        self.local_sockets.pop(client_id, None)
+        self.local_sockets[resumed] = websocket
+        if owner == self.channel:
+            self.client_owners.pop(resumed, None)
+            return
+        self.client_owners[resumed] = owner
+        await self.signaling.handle_disconnect(client_id)
+        await self.signaling.register_connection(resumed, websocket, wire_format)
+
+    async def _bind_owner(self, client_id: str, owner: Optional[str]) -> None:
+        """Point a client at a new owner, releasing it on the previous remote one."""
+        previous = self.client_owners.get(client_id, self.channel)
+        if previous != self.channel and previous != owner:
+            try:
+                await self.bus.publish(previous, {"op": "disconnect", "client": client_id, "origin": self.channel})
+            except ConnectionError:
+                pass
+        if owner is None or owner == self.channel:
+            self.client_owners.pop(client_id, None)
+        else:
+            self.client_owners[client_id] = owner
+
+    async def _on_bus_message(self, envelope: Dict[str, Any]) -> None:
+        op = envelope.get("op")
+        client_id = envelope.get("client")
+
+        if op == "message":
+            # This worker owns the room; the client's socket lives on the origin
+            if client_id not in self.signaling.connections:
+                await self.signaling.register_connection(
+                    client_id, RemoteSocket(self.bus, envelope["origin"], client_id)
+                )
+            # Queue only: waiting here would hold up every other room's bus traffic
+            await self.signaling.enqueue_message(client_id, envelope["message"])
+        elif op == "disconnect":
+            current = self.signaling.connections.get(client_id)
+            if not (isinstance(current, RemoteSocket) and current.origin == envelope.get("origin")):
+                # Stale: the client already resumed on a socket held elsewhere
+                return
+            await self.signaling.handle_disconnect(client_id)
+        elif op == "resume":
+            # This worker owns the room; check the token and answer the worker holding the socket
+            origin = envelope["origin"]
+            resumed = self.signaling.session_for(envelope.get("token"))
+            await self.bus.publish(origin, {
+                "op": "resumed", "client": client_id, "origin": self.channel, "resumed": resumed
+            })
+            if resumed:
+                current = self.signaling.connections.get(resumed)
+                # A reconnect through the same worker keeps its RemoteSocket; closing it would close the new socket
+                if not (isinstance(current, RemoteSocket) and current.origin == origin):
+                    current = RemoteSocket(self.bus, origin, resumed)
+                await self.signaling.resume(resumed, resumed, current)
+        elif op == "resumed":
+            pending = self.pending_resumes.get(client_id)
+            if pending:
+                future, websocket, wire_format = pending
+                resumed = envelope.get("resumed")
+                if resumed:
+                    # Before any delivery for the resumed id can arrive on the bus
+                    await self._adopt(client_id, resumed, websocket, wire_format, envelope.get("origin") or "")
+                if not future.done():
+                    future.set_result(resumed)
+        elif op == "deliver":
+            # Reply from a room owner for a client connected here
+            await self.signaling.send_to_client(client_id, EncodedFrame(envelope["text"]))
+        elif op == "query":
+            try:
+                result = await self.queries[envelope["name"]](envelope["room"], envelope.get("args") or {})
+            except Exception as e:
+                print(f"Room query {envelope.get('name')} failed: {e}")
+                result = None
+            await self.bus.publish(envelope["origin"], {"op": "answer", "id": envelope["id"], "result": result})
+        elif op == "answer":
+            future = self.pending_queries.get(envelope.get("id"))
+            if future and not future.done():
+                future.set_result(envelope.get("result"))
+        elif op == "close":
+            websocket = self.local_sockets.get(client_id)
+            if websocket:
+                asyncio.create_task(websocket.close())
+            await self.handle_disconnect(client_id)
+        else:
+            print(f"Unknown bus operation: {op}")
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "worker": self.channel,
+            "workers": self.workers(),
+            "leasedRooms": len(self.leased),
+            "localClients": len(self.local_sockets),
+            "forwardedClients": len(self.client_owners)
+        }
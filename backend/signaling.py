@@ -1,47 +1,388 @@
-from typing import Dict, Any, List, Optional
+from typing import Dict, Any, List, Optional, Tuple, Union, Callable
+import os
 import json
+import time
 import asyncio
+import secrets
+import contextvars
 from fastapi import WebSocket
 import uuid
+import wire
 from webrtc import WebRTCManager
+from fanout import FanoutEngine, EncodedFrame, COALESCE
+from actors import RoomScheduler, RateLimiter, MailboxFull
+from admission import AdmissionQueue
+from recording import RecordingManager
+from thumbnails import ThumbnailService
+from audio_activity import AudioActivityMonitor
+from metrics import SIGNALING_MESSAGE_SECONDS, SIGNALING_REJECTED, TRANSPORTS_REAPED
+
+# Upper bound on operations carried by one batch or consumeAll request
+MAX_BATCH_SIZE = 500
+
+# (client_id, replies) while a batch or consumeAll item runs. Being a context
+# variable, it only sees what that item's own dispatch sends, not errors or
+# acks other coroutines send to the same client meanwhile.
+CAPTURE: contextvars.ContextVar[Optional[Tuple[str, List[Dict[str, Any]]]]] = contextvars.ContextVar(
+    "signaling_capture", default=None
+)
+
+# Message types with their own latency series; anything else is timed as "unknown"
+MESSAGE_TYPES = frozenset([
+    "joinRoom", "createWebRtcTransport", "connectTransport", "produce", "consume",
+    "resumeConsumer", "setPreferredLayers", "consumeAll", "batch", "saveAnswers", "submitExam"
+])
 
 class WebRTCSignaling:
     def __init__(self):
         self.connections: Dict[str, WebSocket] = {}
         self.rooms: Dict[str, Dict[str, Any]] = {}
         self.webrtc_manager = WebRTCManager()
+        self.fanout = FanoutEngine(
+            max_queue=int(os.getenv("SIGNALING_QUEUE_SIZE", "256")),
+            policy=os.getenv("SIGNALING_QUEUE_POLICY", "drop_oldest")
+        )
+        
+        # Lookup indexes kept in sync with self.rooms so handlers never scan rooms
+        self.client_rooms: Dict[str, str] = {}  # client_id -> room_id
+        self.producer_index: Dict[str, Tuple[str, str]] = {}  # producer_id -> (owner_id, room_id)
+        self.transport_owners: Dict[str, str] = {}  # transport_id -> client_id
+        self.consumer_owners: Dict[str, str] = {}  # consumer_id -> client_id
+        
+        # Each room's messages run one at a time on its own actor; rooms run concurrently
+        self.scheduler = RoomScheduler(max_mailbox=int(os.getenv("ROOM_MAILBOX_SIZE", "2048")))
+        self.rate_limiter = RateLimiter(
+            rate=float(os.getenv("SIGNALING_RATE_LIMIT", "50")),
+            burst=float(os.getenv("SIGNALING_RATE_BURST", "200"))
+        )
+        # joinRoom requests beyond JOIN_RATE per second wait in line and are told their position
+        self.admission = AdmissionQueue(
+            on_admit=lambda client_id, message: self.enqueue_message(client_id, message, admitted=True),
+            on_position=self.send_queue_position
+        )
+        # Room each client's next message is queued on; set when joinRoom is queued,
+        # ahead of client_rooms, which changes only once the join has run
+        self.client_routes: Dict[str, str] = {}
+        
+        # Decides per room whether producers are recorded; set by the app (off when unset)
+        self.recording_policy: Optional[Callable[[str], bool]] = None
+        self.recordings = RecordingManager()
+        self.thumbnails = ThumbnailService()
+        self.audio_activity = AudioActivityMonitor(on_activity=self.notify_audio_activity)
+        # ExamService-like answer sink (save_answers/submit_answers); set by the app
+        self.answers = None
+        
+        # A dropped client keeps its participant and transports this many seconds,
+        # and can take them back with its resume token (0 disables)
+        self.session_grace = float(os.getenv("SESSION_RESUME_GRACE", "15"))
+        self.sessions: Dict[str, str] = {}  # resume token -> client_id
+        self.session_tokens: Dict[str, str] = {}  # client_id -> resume token
+        self.suspended: Dict[str, asyncio.TimerHandle] = {}  # client_id -> grace expiry
+        self.resumed_sessions = 0
+        
+        # Transports a client never connects are closed after this many seconds (0 disables)
+        self.transport_connect_timeout = float(os.getenv("TRANSPORT_CONNECT_TIMEOUT", "30"))
+        self.reaper_task = None
+        self.reaped_transports = 0
+    
+    async def start(self) -> None:
+        """Start reaping transports that are never connected."""
+        if self.transport_connect_timeout > 0 and self.reaper_task is None:
+            self.reaper_task = asyncio.create_task(self._reap_loop())
     
-    async def register_connection(self, client_id: str, websocket: WebSocket) -> None:
+    async def close(self) -> None:
+        """Stop the reaper and release every room's peer connections."""
+        if self.reaper_task:
+            self.reaper_task.cancel()
+            self.reaper_task = None
+        for client_id in list(self.connections):
+            await self.handle_disconnect(client_id)
+        for handle in self.suspended.values():
+            handle.cancel()
+        self.suspended.clear()
+        for room in list(self.rooms.values()):
+            await self.webrtc_manager.close_router(room["router"])
+        self.rooms.clear()
+        await self.recordings.close()
+        await self.thumbnails.close()
+        await self.audio_activity.close()
+        await self.admission.close()
+    
+    async def register_connection(self, client_id: str, websocket: WebSocket, wire_format: str = wire.JSON) -> None:
         """Register a new WebSocket connection with a unique client ID."""
         self.connections[client_id] = websocket
+        self.fanout.add(client_id, websocket, on_failure=self.handle_disconnect, wire_format=wire_format)
         print(f"Client {client_id} connected")
         
     async def handle_disconnect(self, client_id: str) -> None:
         """Handle client disconnection."""
         if client_id in self.connections:
             del self.connections[client_id]
-            print(f"Client {client_id} disconnected")
+            self.fanout.remove(client_id)
+            self.rate_limiter.forget(client_id)
+            self.admission.forget(client_id)
             
-            # Clean up client from rooms
-            for room_id, room in self.rooms.items():
-                participants = room.get("participants", {})
-                if client_id in participants:
-                    await self.notify_room(room_id, {
-                        "type": "userLeft",
-                        "data": {"userId": client_id}
-                    }, exclude=[client_id])
-                    
-                    del participants[client_id]
-                    
-                    # If room is empty, clean up
-                    if not participants:
-                        del self.rooms[room_id]
+            if self.session_grace > 0 and client_id in self.session_tokens and client_id in self.client_rooms:
+                # Hold the participant, its transports and everyone's consumers of its media
+                # until it resumes, instead of a userLeft/userJoined round trip
+                self.suspended[client_id] = asyncio.get_running_loop().call_later(
+                    self.session_grace, self._expire_session, client_id
+                )
+                print(f"Client {client_id} disconnected, resumable for {self.session_grace:g}s")
+                room_id = self.client_routes.get(client_id) or self.client_rooms[client_id]
+                await self.scheduler.submit(room_id, lambda: self._notify_presence(client_id, "userSuspended", {
+                    "resumeWithin": self.session_grace
+                }), force=True)
+                return
+            print(f"Client {client_id} disconnected")
+            await self._end_session(client_id)
+    
+    def _expire_session(self, client_id: str) -> None:
+        if self.suspended.pop(client_id, None):
+            print(f"Client {client_id} did not resume")
+            asyncio.create_task(self._end_session(client_id))
+    
+    async def _end_session(self, client_id: str) -> None:
+        token = self.session_tokens.pop(client_id, None)
+        self.sessions.pop(token, None)
+        
+        # Clean up client from its room, in order with the room's queued messages
+        room_id = self.client_routes.pop(client_id, None)
+        if room_id is None:
+            await self._leave_room(client_id)
+        else:
+            await self.scheduler.submit(room_id, lambda: self._leave_room(client_id), force=True)
+    
+    def session_for(self, token: Optional[str]) -> Optional[str]:
+        """The client a resume token belongs to, while its session is still held."""
+        client_id = self.sessions.get(token) if token else None
+        if client_id and (client_id in self.suspended or client_id in self.connections):
+            return client_id
+        return None
+    
+    async def resume(self, client_id: str, new_client_id: str, websocket: WebSocket,
+                     wire_format: str = wire.JSON) -> None:
+        """Rebind a held session to a new socket; the new connection takes over client_id.
+        
+        Also covers a client that reconnects before its old socket was noticed
+        to be dead: the old socket is simply replaced.
+        """
+        handle = self.suspended.pop(client_id, None)
+        if handle:
+            handle.cancel()
+        was_suspended = handle is not None
+        if new_client_id != client_id:
+            # The new connection never joined anything under its own id
+            self.connections.pop(new_client_id, None)
+            self.fanout.remove(new_client_id)
+            self.rate_limiter.forget(new_client_id)
+        previous = self.connections.get(client_id)
+        if previous is not None and previous is not websocket:
+            asyncio.create_task(self._close_socket(previous))
+        self.connections[client_id] = websocket
+        self.fanout.add(client_id, websocket, on_failure=self.handle_disconnect, wire_format=wire_format)
+        self.resumed_sessions += 1
+        print(f"Client {client_id} resumed")
+        
+        room_id = self.client_routes.get(client_id) or self.client_rooms.get(client_id)
+        if room_id:
+            # After whatever the old connection still had queued on the room; not awaited,
+            # since a resume arriving over the bus must not hold up other rooms' traffic
+            future = self.scheduler.submit(room_id, lambda: self._send_resumed(client_id, was_suspended), force=True)
+            future.add_done_callback(self._report_failure)
+        else:
+            await self._send_resumed(client_id, was_suspended)
+    
+    @staticmethod
+    async def _close_socket(websocket: WebSocket) -> None:
+        try:
+            await websocket.close()
+        except Exception:
+            pass
+    
+    def _issue_token(self, client_id: str) -> str:
+        """A fresh resume token for client_id; the previous one stops working."""
+        self.sessions.pop(self.session_tokens.get(client_id), None)
+        token = secrets.token_urlsafe(24)
+        self.sessions[token] = client_id
+        self.session_tokens[client_id] = token
+        return token
+    
+    async def _send_resumed(self, client_id: str, was_suspended: bool = False) -> None:
+        room_id, room = self._get_room_for_client(client_id)
+        if not room:
+            await self.send_to_client(client_id, {"type": "resumeFailed", "data": {"reason": "left"}})
+            return
+        participant = room["participants"][client_id]
+        # Everything the client may have missed while it was away, to reconcile against
+        await self.send_to_client(client_id, {
+            "type": "roomResumed",
+            "data": {
+                "roomId": room_id,
+                "userId": client_id,
+                "resumeToken": self._issue_token(client_id),
+                "participants": self._participant_list(room, client_id),
+                "rtpCapabilities": room["router"].rtp_capabilities,
+                "transports": list(participant["transports"]),
+                "producers": list(participant["producers"]),
+                "consumers": list(participant["consumers"]),
+                "roomProducers": [
+                    {"producerId": producer_id, "producerUserId": pid, "kind": producer.kind}
+                    for pid, other in room["participants"].items() if pid != client_id
+                    for producer_id, producer in other["producers"].items()
+                ]
+            }
+        })
+        if was_suspended:
+            await self._notify_presence(client_id, "userResumed")
+    
+    async def _notify_presence(self, client_id: str, msg_type: str, extra: Optional[Dict[str, Any]] = None) -> None:
+        """Tell the rest of the room that a participant was suspended or is back."""
+        room_id = self.client_rooms.get(client_id)
+        if room_id not in self.rooms:
+            return
+        await self.notify_room(room_id, {
+            "type": msg_type,
+            "data": dict(extra or {}, userId=client_id)
+        }, exclude=[client_id], coalesce_key=("presence", client_id))
+    
+    async def _leave_room(self, client_id: str) -> None:
+        """Remove a client from the room it is in and notify the others."""
+        room_id = self.client_rooms.pop(client_id, None)
+        room = self.rooms.get(room_id)
+        if not room:
+            return
+        
+        participants = room["participants"]
+        participant = participants.pop(client_id, None)
+        if participant:
+            for transport_id in list(participant["transports"]):
+                await self._close_transport(room, participant, transport_id)
+            self._unindex_participant(participant)
+            await self.notify_room(room_id, {
+                "type": "userLeft",
+                "data": {"userId": client_id}
+            }, exclude=[client_id], coalesce_key=("presence", client_id))
+        
+        # If room is empty, clean up; prepared rooms wait for release_room
+        if not participants and not room.get("prepared"):
+            await self._close_room(room_id)
+    
+    async def _create_room(self, room_id: str) -> Dict[str, Any]:
+        router = await self.webrtc_manager.create_router()
+        if self.recording_policy and self.recording_policy(room_id):
+            router.taps.append(self.recordings.for_room(room_id))
+        for tap in (self.thumbnails.for_room(room_id), self.audio_activity.for_room(room_id)):
+            if tap:
+                router.taps.append(tap)
+        room = self.rooms[room_id] = {
+            "id": room_id,
+            "participants": {},
+            "router": router
+        }
+        return room
+    
+    async def _close_room(self, room_id: str) -> None:
+        room = self.rooms.pop(room_id, None)
+        if room:
+            await self.webrtc_manager.close_router(room["router"])
+            await self.recordings.close_room(room_id)
+            self.thumbnails.close_room(room_id)
+            self.audio_activity.close_room(room_id)
+    
+    async def prepare_room(self, room_id: str, transports: int) -> None:
+        """Create a room before its first join and warm `transports` transports for it."""
+        await self.scheduler.submit(room_id, lambda: self._prepare_room(room_id, transports), force=True)
+    
+    async def _prepare_room(self, room_id: str, transports: int) -> None:
+        room = self.rooms.get(room_id) or await self._create_room(room_id)
+        room["prepared"] = True
+        self.webrtc_manager.resize_pool(room["router"], transports)
+    
+    async def release_room(self, room_id: str) -> None:
+        """End a prepared room's warm-up: shrink its pool back, or close it if nobody came."""
+        await self.scheduler.submit(room_id, lambda: self._release_room(room_id), force=True)
+    
+    async def _release_room(self, room_id: str) -> None:
+        room = self.rooms.get(room_id)
+        if not room or not room.pop("prepared", False):
+            return
+        if room["participants"]:
+            self.webrtc_manager.resize_pool(room["router"])
+        else:
+            await self._close_room(room_id)
     
     async def handle_message(self, client_id: str, message: Dict[str, Any]) -> None:
-        """Handle incoming WebSocket messages for signaling."""
-        msg_type = message.get("type")
-        data = message.get("data", {})
+        """Handle incoming WebSocket messages for signaling, waiting until the room has run it."""
+        future = await self.enqueue_message(client_id, message)
+        if future is not None:
+            await future
+    
+    async def enqueue_message(self, client_id: str, message: Dict[str, Any],
+                              admitted: bool = False) -> Optional[asyncio.Future]:
+        """Queue a message on its room's actor without waiting for it to run.
         
+        Returns the job's future, or None when the message was refused, queued
+        for admission, or handled inline because the client is not in a room.
+        admitted marks a join coming back out of the admission queue.
+        """
+        if not admitted and not self.rate_limiter.allow(client_id):
+            SIGNALING_REJECTED.inc("rate_limited")
+            await self.send_error(client_id, "Too many messages, slow down")
+            return None
+        if message.get("type") == "joinRoom" and not admitted and not self._admit_join(client_id, message):
+            return None
+        
+        route = self.client_routes.get(client_id)
+        job = lambda: self._process(client_id, message)
+        if message.get("type") == "joinRoom":
+            room_id = (message.get("data") or {}).get("room")
+            if room_id and room_id != route:
+                if route is not None:
+                    # Leave on the old room's actor first; the join waits for it
+                    left = self.scheduler.submit(route, lambda: self._leave_room(client_id), force=True)
+                    job = lambda: self._join_after(left, client_id, message)
+                route = self.client_routes[client_id] = room_id
+        
+        if route is None:
+            await self._process(client_id, message)
+            return None
+        try:
+            future = self.scheduler.submit(route, job)
+        except MailboxFull:
+            SIGNALING_REJECTED.inc("mailbox_full")
+            await self.send_error(client_id, "Room is busy, please retry")
+            return None
+        future.add_done_callback(self._report_failure)
+        return future
+    
+    def _admit_join(self, client_id: str, message: Dict[str, Any]) -> bool:
+        data = message.get("data") or {}
+        # Teachers are few and should not wait behind their class; rejoining the same room is free
+        if data.get("role") == "teacher" or data.get("room") == self.client_routes.get(client_id):
+            return True
+        return self.admission.admit(client_id, message)
+    
+    async def send_queue_position(self, client_id: str, message: Dict[str, Any], position: Dict[str, Any]) -> None:
+        """Tell a queued client where it stands; only the latest position stays queued."""
+        data = dict(position, roomId=(message.get("data") or {}).get("room"))
+        self.fanout.send(client_id, EncodedFrame({"type": "joinQueued", "data": data}), ("admission",), COALESCE)
+    
+    async def _join_after(self, left: asyncio.Future, client_id: str, message: Dict[str, Any]) -> None:
+        await left
+        await self._process(client_id, message)
+    
+    @staticmethod
+    def _report_failure(future: asyncio.Future) -> None:
+        if not future.cancelled() and future.exception():
+            print(f"Error handling signaling message: {future.exception()}")
+    
+    async def _process(self, client_id: str, message: Dict[str, Any]) -> None:
+        msg_type = message.get("type")
+        with SIGNALING_MESSAGE_SECONDS.time(msg_type if msg_type in MESSAGE_TYPES else "unknown"):
+            await self._dispatch(client_id, msg_type, message.get("data", {}))
+    
+    async def _dispatch(self, client_id: str, msg_type: Optional[str], data: Dict[str, Any]) -> None:
         if msg_type == "joinRoom":
             await self.handle_join_room(client_id, data)
         elif msg_type == "createWebRtcTransport":
@@ -54,6 +395,16 @@ class WebRTCSignaling:
             await self.handle_consume(client_id, data)
         elif msg_type == "resumeConsumer":
             await self.handle_resume_consumer(client_id, data)
+        elif msg_type == "setPreferredLayers":
+            await self.handle_set_preferred_layers(client_id, data)
+        elif msg_type == "consumeAll":
+            await self.handle_consume_all(client_id, data)
+        elif msg_type == "batch":
+            await self.handle_batch(client_id, data)
+        elif msg_type == "saveAnswers":
+            await self.handle_save_answers(client_id, data)
+        elif msg_type == "submitExam":
+            await self.handle_submit_exam(client_id, data)
         else:
             print(f"Unknown message type: {msg_type}")
     
@@ -67,15 +418,13 @@ class WebRTCSignaling:
             await self.send_error(client_id, "Room ID is required")
             return
             
+        # A client is in at most one room at a time
+        if self.client_rooms.get(client_id) not in (None, room_id):
+            await self._leave_room(client_id)
+        
         # Create room if it doesn't exist
-        if room_id not in self.rooms:
-            self.rooms[room_id] = {
-                "id": room_id,
-                "participants": {},
-                "router": await self.webrtc_manager.create_router()
-            }
-            
-        room = self.rooms[room_id]
+        room = self.rooms.get(room_id) or await self._create_room(room_id)
+        self.client_rooms[client_id] = room_id
         
         # Add participant to room
         room["participants"][client_id] = {
@@ -95,27 +444,29 @@ class WebRTCSignaling:
                 "name": username,
                 "role": role
             }
-        }, exclude=[client_id])
+        }, exclude=[client_id], coalesce_key=("presence", client_id))
         
         # Send room info to client
-        participants = []
-        for pid, participant in room["participants"].items():
-            if pid != client_id:  # Don't include self
-                participants.append({
-                    "id": pid,
-                    "name": participant["name"],
-                    "role": participant["role"]
-                })
-                
         await self.send_to_client(client_id, {
             "type": "roomJoined",
             "data": {
                 "roomId": room_id,
-                "participants": participants,
-                "rtpCapabilities": room["router"].rtp_capabilities
+                "userId": client_id,
+                "participants": self._participant_list(room, client_id),
+                "rtpCapabilities": room["router"].rtp_capabilities,
+                # Presented in a resume message to take this session back after a reconnect
+                "resumeToken": self._issue_token(client_id)
             }
         })
     
+    @staticmethod
+    def _participant_list(room: Dict[str, Any], client_id: str) -> List[Dict[str, Any]]:
+        # Don't include self
+        return [
+            {"id": pid, "name": participant["name"], "role": participant["role"]}
+            for pid, participant in room["participants"].items() if pid != client_id
+        ]
+    
     async def handle_create_transport(self, client_id: str, data: Dict[str, Any]) -> None:
         """Handle creating a WebRTC transport."""
         is_sender = data.get("sender", False)
@@ -128,11 +479,13 @@ class WebRTCSignaling:
         
         try:
             transport = await self.webrtc_manager.create_transport(room["router"])
+            transport.owner = client_id
             transport_info = {
                 "id": transport.id,
                 "iceParameters": transport.ice_parameters,
                 "iceCandidates": transport.ice_candidates,
-                "dtlsParameters": transport.dtls_parameters
+                "dtlsParameters": transport.dtls_parameters,
+                "sdp": transport.pc.localDescription.sdp
             }
             
             # Store transport in participant data
@@ -142,6 +495,7 @@ class WebRTCSignaling:
                 "transport": transport,
                 "sender": is_sender
             }
+            self.transport_owners[transport.id] = client_id
             
             await self.send_to_client(client_id, {
                 "type": "transportCreated",
@@ -154,8 +508,10 @@ class WebRTCSignaling:
         """Connect client's transport."""
         transport_id = data.get("transportId")
         dtls_parameters = data.get("dtlsParameters")
+        # SDP clients answer the transport's offers here, the first and any later ones
+        sdp = data.get("sdp")
         
-        if not transport_id or not dtls_parameters:
+        if not transport_id or not (dtls_parameters or sdp):
             await self.send_error(client_id, "Missing required parameters")
             return
         
@@ -172,7 +528,7 @@ class WebRTCSignaling:
             return
         
         try:
-            await transport_data["transport"].connect(dtls_parameters)
+            await transport_data["transport"].connect(dtls_parameters, sdp)
             await self.send_to_client(client_id, {
                 "type": "transportConnected",
                 "data": {
@@ -180,6 +536,7 @@ class WebRTCSignaling:
                     "connected": True
                 }
             })
+            await self._send_offers(client_id)
         except Exception as e:
             await self.send_error(client_id, f"Error connecting transport: {str(e)}")
     
@@ -213,6 +570,7 @@ class WebRTCSignaling:
             
             # Store producer
             participant["producers"][producer.id] = producer
+            self.producer_index[producer.id] = (client_id, room_id)
             
             # Notify other participants about new producer
             await self.notify_room(room_id, {
@@ -251,14 +609,10 @@ class WebRTCSignaling:
         # Find the producer's owner
         producer_owner_id = None
         producer = None
-        for pid, p in room["participants"].items():
-            for prod_id, prod in p["producers"].items():
-                if prod_id == producer_id:
-                    producer_owner_id = pid
-                    producer = prod
-                    break
-            if producer_owner_id:
-                break
+        owner_id, producer_room_id = self.producer_index.get(producer_id, (None, None))
+        if producer_room_id == room_id and owner_id in room["participants"]:
+            producer_owner_id = owner_id
+            producer = room["participants"][owner_id]["producers"].get(producer_id)
         
         if not producer:
             await self.send_error(client_id, "Producer not found")
@@ -281,11 +635,13 @@ class WebRTCSignaling:
             consumer = await transport_data["transport"].consume(
                 producer_id=producer_id,
                 rtp_capabilities=rtp_capabilities,
-                paused=True
+                paused=True,
+                preferred_layers=data.get("preferredLayers")
             )
             
             # Store consumer
             participant["consumers"][consumer.id] = consumer
+            self.consumer_owners[consumer.id] = client_id
             
             await self.send_to_client(client_id, {
                 "type": "consumerCreated",
@@ -294,9 +650,11 @@ class WebRTCSignaling:
                     "producerId": producer_id,
                     "kind": consumer.kind,
                     "rtpParameters": consumer.rtp_parameters,
-                    "producerUserId": producer_owner_id
+                    "producerUserId": producer_owner_id,
+                    "layers": consumer.layers
                 }
             })
+            await self._send_offers(client_id)
         except Exception as e:
             await self.send_error(client_id, f"Error consuming: {str(e)}")
     
@@ -332,15 +690,249 @@ class WebRTCSignaling:
         except Exception as e:
             await self.send_error(client_id, f"Error resuming consumer: {str(e)}")
     
-    async def send_to_client(self, client_id: str, message: Dict[str, Any]) -> None:
-        """Send message to a specific client."""
-        if client_id in self.connections:
-            websocket = self.connections[client_id]
+    async def handle_set_preferred_layers(self, client_id: str, data: Dict[str, Any]) -> None:
+        """Choose the simulcast/SVC layers a consumer receives."""
+        consumer_id = data.get("consumerId")
+        spatial_layer = data.get("spatialLayer")
+        temporal_layer = data.get("temporalLayer")
+        
+        if not consumer_id or spatial_layer is None:
+            await self.send_error(client_id, "Missing required parameters")
+            return
+        
+        room_id, room = self._get_room_for_client(client_id)
+        if not room:
+            await self.send_error(client_id, "Not in a room")
+            return
+        
+        participant = room["participants"][client_id]
+        consumer = participant["consumers"].get(consumer_id)
+        
+        if not consumer:
+            await self.send_error(client_id, "Consumer not found")
+            return
+        
+        try:
+            await consumer.set_preferred_layers(spatial_layer, temporal_layer)
+            await self.send_to_client(client_id, {
+                "type": "preferredLayersSet",
+                "data": {
+                    "consumerId": consumer_id,
+                    "layers": consumer.layers
+                }
+            })
+        except Exception as e:
+            await self.send_error(client_id, f"Error setting preferred layers: {str(e)}")
+    
+    async def handle_batch(self, client_id: str, data: Dict[str, Any]) -> None:
+        """Run several signaling messages in order and answer with one batchResult.
+        
+        A failing item is reported in its own result and does not stop the rest.
+        joinRoom is not allowed in a batch: a join has to go through admission
+        and move the client to the new room's actor, which enqueue_message does.
+        """
+        messages = data.get("messages")
+        
+        if not isinstance(messages, list) or not messages:
+            await self.send_error(client_id, "Batch messages are required")
+            return
+        if len(messages) > MAX_BATCH_SIZE:
+            await self.send_error(client_id, f"Batch too large (max {MAX_BATCH_SIZE})")
+            return
+        
+        results = []
+        for index, message in enumerate(messages):
+            if not isinstance(message, dict) or message.get("type") in ("batch", "consumeAll", "joinRoom"):
+                results.append({"index": index, "ok": False, "replies": [], "error": "Invalid batch item"})
+                continue
+            
+            replies = await self._run_captured(client_id, message)
+            errors = [r["data"]["message"] for r in replies if r.get("type") == "error"]
+            result = {"index": index, "ok": not errors, "replies": [r for r in replies if r.get("type") != "error"]}
+            if errors:
+                result["error"] = errors[0]
+            results.append(result)
+        
+        await self.send_to_client(client_id, {
+            "type": "batchResult",
+            "data": {
+                "id": data.get("id"),
+                "results": results
+            }
+        })
+        await self._send_offers(client_id)
+    
+    async def handle_consume_all(self, client_id: str, data: Dict[str, Any]) -> None:
+        """Create (and by default resume) consumers for many producers in one round-trip."""
+        transport_id = data.get("transportId")
+        rtp_capabilities = data.get("rtpCapabilities")
+        resume = data.get("resume", True)
+        
+        if not transport_id or not rtp_capabilities:
+            await self.send_error(client_id, "Missing required parameters")
+            return
+        
+        room_id, room = self._get_room_for_client(client_id)
+        if not room:
+            await self.send_error(client_id, "Not in a room")
+            return
+        
+        producer_ids = data.get("producerIds")
+        if producer_ids is None:
+            # Everything currently produced in the room by someone else
+            producer_ids = [
+                producer_id
+                for pid, participant in room["participants"].items() if pid != client_id
+                for producer_id in participant["producers"]
+            ]
+        if len(producer_ids) > MAX_BATCH_SIZE:
+            await self.send_error(client_id, f"Batch too large (max {MAX_BATCH_SIZE})")
+            return
+        
+        consumers = []
+        errors = []
+        for producer_id in producer_ids:
+            replies = await self._run_captured(client_id, {
+                "type": "consume",
+                "data": {
+                    "transportId": transport_id,
+                    "producerId": producer_id,
+                    "rtpCapabilities": rtp_capabilities,
+                    "preferredLayers": data.get("preferredLayers")
+                }
+            })
+            created = next((r["data"] for r in replies if r.get("type") == "consumerCreated"), None)
+            if not created:
+                errors.append({"producerId": producer_id, "message": self._first_error(replies)})
+                continue
+            
+            created["resumed"] = False
+            if resume:
+                replies = await self._run_captured(client_id, {
+                    "type": "resumeConsumer",
+                    "data": {"consumerId": created["id"]}
+                })
+                if any(r.get("type") == "consumerResumed" for r in replies):
+                    created["resumed"] = True
+                else:
+                    errors.append({"producerId": producer_id, "message": self._first_error(replies)})
+            consumers.append(created)
+        
+        await self.send_to_client(client_id, {
+            "type": "consumersCreated",
+            "data": {
+                "consumers": consumers,
+                "errors": errors
+            }
+        })
+        await self._send_offers(client_id)
+    
+    async def _send_offers(self, client_id: str) -> None:
+        """Send a new offer for each of the client's transports that gained consumer tracks."""
+        capture = CAPTURE.get()
+        if capture is not None and capture[0] == client_id:
+            # Inside a batch or consumeAll, which sends the offers once it is done
+            return
+        room_id, room = self._get_room_for_client(client_id)
+        if not room or client_id not in room["participants"]:
+            return
+        for transport_id, transport_data in list(room["participants"][client_id]["transports"].items()):
+            sdp = await transport_data["transport"].renegotiate()
+            if sdp:
+                await self.send_to_client(client_id, {
+                    "type": "transportOffer",
+                    "data": {
+                        "transportId": transport_id,
+                        "sdp": sdp
+                    }
+                })
+    
+    async def handle_save_answers(self, client_id: str, data: Dict[str, Any]) -> None:
+        """Queue autosaved answers; answersSaved follows once they are durable."""
+        answers = data.get("answers")
+        started = await self._queue_answers(client_id, data, lambda exam_id, student_id: self.answers.save_answers(
+            exam_id, student_id, answers
+        ))
+        if started:
+            exam_id, future = started
+            self._acknowledge(client_id, future, "answersSaved", {
+                "examId": exam_id,
+                "id": data.get("id"),
+                "questionIds": [item.get("questionId") for item in answers]
+            })
+    
+    async def handle_submit_exam(self, client_id: str, data: Dict[str, Any]) -> None:
+        """Final submission: flushes the student's answers and confirms with examSubmitted."""
+        started = await self._queue_answers(client_id, data, lambda exam_id, student_id: self.answers.submit_answers(
+            exam_id, student_id, data.get("answers")
+        ))
+        if started:
+            exam_id, future = started
+            self._acknowledge(client_id, future, "examSubmitted", {"examId": exam_id})
+    
+    async def _queue_answers(self, client_id: str, data: Dict[str, Any], queue) -> Optional[Tuple[str, asyncio.Future]]:
+        room_id, room = self._get_room_for_client(client_id)
+        if not room:
+            await self.send_error(client_id, "Not in a room")
+            return None
+        if self.answers is None:
+            await self.send_error(client_id, "Answer saving is not available")
+            return None
+        
+        exam_id = data.get("examId")
+        if not exam_id:
+            exam = self.answers.get_exam_by_room_code(room_id)
+            exam_id = exam["id"] if exam else None
+        student_id = room["participants"][client_id]["name"] or client_id
+        try:
+            return exam_id, queue(exam_id, student_id)
+        except ValueError as e:
+            await self.send_error(client_id, str(e))
+            return None
+    
+    def _acknowledge(self, client_id: str, future: asyncio.Future, msg_type: str, data: Dict[str, Any]) -> None:
+        """Reply once future resolves, without holding up the room's other messages."""
+        async def reply():
+            # Sent on its own even when the message came in a batch, which has long answered
+            CAPTURE.set(None)
             try:
-                await websocket.send_json(message)
+                data["savedAt"] = await future
             except Exception as e:
-                print(f"Error sending to client {client_id}: {e}")
-                await self.handle_disconnect(client_id)
+                await self.send_error(client_id, str(e))
+                return
+            await self.send_to_client(client_id, {"type": msg_type, "data": data})
+        asyncio.create_task(reply())
+    
+    async def _run_captured(self, client_id: str, message: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """Handle one message and return the replies it would have sent to the client."""
+        replies = []
+        token = CAPTURE.set((client_id, replies))
+        try:
+            # Already on the room's actor, so run the message here instead of queueing it
+            await self._process(client_id, message)
+        except Exception as e:
+            replies.append({"type": "error", "data": {"message": str(e)}})
+        finally:
+            CAPTURE.reset(token)
+        return replies
+    
+    @staticmethod
+    def _first_error(replies: List[Dict[str, Any]]) -> str:
+        for reply in replies:
+            if reply.get("type") == "error":
+                return reply["data"]["message"]
+        return "No response"
+    
+    async def send_to_client(self, client_id: str, message: Union[Dict[str, Any], EncodedFrame]) -> None:
+        """Queue message for a specific client; its writer task does the actual send.
+        
+        Accepts either a dict or an EncodedFrame that was serialized ahead of time.
+        """
+        capture = CAPTURE.get()
+        if capture is not None and capture[0] == client_id and isinstance(message, dict):
+            capture[1].append(message)
+            return
+        self.fanout.send(client_id, message)
     
     async def send_error(self, client_id: str, error_message: str) -> None:
         """Send error message to client."""
@@ -351,21 +943,154 @@ class WebRTCSignaling:
             }
         })
     
-    async def notify_room(self, room_id: str, message: Dict[str, Any], exclude: List[str] = None) -> None:
-        """Send message to all clients in a room except those in exclude list."""
+    async def notify_room(self, room_id: str, message: Union[Dict[str, Any], EncodedFrame], exclude: List[str] = None,
+                          coalesce_key: Optional[Any] = None) -> None:
+        """Send message to all clients in a room except those in exclude list.
+        
+        The message is encoded once and the same frame is queued on every
+        recipient's writer without waiting, so a slow socket only ever delays
+        itself.
+        """
         if room_id not in self.rooms:
             return
         
         exclude = exclude or []
         room = self.rooms[room_id]
         
-        for pid in room["participants"]:
-            if pid not in exclude:
-                await self.send_to_client(pid, message)
+        recipients = [pid for pid in room["participants"] if pid not in exclude]
+        if not recipients:
+            return
+        
+        frame = message if isinstance(message, EncodedFrame) else EncodedFrame(message)
+        self.fanout.broadcast(recipients, frame, coalesce_key)
+    
+    async def notify_audio_activity(self, room_id: str, events: List[Dict[str, Any]]) -> None:
+        """Tell the room's teachers who is speaking; only the latest level per student is kept queued."""
+        room = self.rooms.get(room_id)
+        if not room:
+            return
+        teachers = [pid for pid, participant in room["participants"].items() if participant["role"] == "teacher"]
+        if not teachers:
+            return
+        for event in events:
+            frame = EncodedFrame({"type": "audioActivity", "data": event})
+            # A newer level supersedes a queued one whatever the connection's policy
+            self.fanout.broadcast(teachers, frame, ("audio", event["studentId"]), COALESCE)
+    
+    def queue_depths(self) -> Dict[str, int]:
+        """Outbound queue depth per connected client."""
+        return self.fanout.queue_depths()
+    
+    def resource_counts(self) -> Dict[str, int]:
+        """Live WebRTC resources held by this worker."""
+        routers = [room["router"] for room in self.rooms.values()]
+        return {
+            "rooms": len(self.rooms),
+            "participants": len(self.client_rooms),
+            "transports": sum(len(router.transports) for router in routers),
+            "pooledTransports": sum(pool["ready"] for pool in self.webrtc_manager.pool_stats().values()),
+            "producers": sum(len(router.producers) for router in routers),
+            "consumers": sum(len(router.consumers) for router in routers),
+            "reapedTransports": self.reaped_transports,
+            "suspendedSessions": len(self.suspended),
+            "resumedSessions": self.resumed_sessions
+        }
+    
+    async def _close_transport(self, room: Dict[str, Any], participant: Dict[str, Any], transport_id: str) -> None:
+        """Close one of a participant's transports and tell other clients whose consumers ended."""
+        transport_data = participant["transports"].pop(transport_id, None)
+        if not transport_data:
+            return
+        transport = transport_data["transport"]
+        self.transport_owners.pop(transport_id, None)
+        for producer_id in transport.producers:
+            participant["producers"].pop(producer_id, None)
+            self.producer_index.pop(producer_id, None)
+        for consumer_id in transport.consumers:
+            participant["consumers"].pop(consumer_id, None)
+            self.consumer_owners.pop(consumer_id, None)
+        
+        try:
+            dependents = await transport.close()
+        except Exception as e:
+            print(f"Error closing transport {transport_id}: {e}")
+            return
+        
+        for consumer in dependents:
+            owner_id = self.consumer_owners.pop(consumer.id, None)
+            owner = room["participants"].get(owner_id)
+            if not owner:
+                continue
+            owner["consumers"].pop(consumer.id, None)
+            await self.send_to_client(owner_id, {
+                "type": "consumerClosed",
+                "data": {
+                    "consumerId": consumer.id,
+                    "producerId": consumer.producer_id
+                }
+            })
+    
+    async def reap_idle_transports(self) -> int:
+        """Close transports that were handed out but never connected within the timeout."""
+        deadline = time.monotonic() - self.transport_connect_timeout
+        stale: Dict[str, List[str]] = {}
+        for room_id, room in self.rooms.items():
+            for transport in room["router"].transports.values():
+                if not transport.connected and transport.assigned_at < deadline:
+                    stale.setdefault(room_id, []).append(transport.id)
+        # Each room is reaped on its own actor so it never races the room's handlers
+        await asyncio.gather(*(
+            self.scheduler.submit(room_id, lambda room_id=room_id, ids=ids: self._reap_room(room_id, ids), force=True)
+            for room_id, ids in stale.items()
+        ))
+        return sum(len(ids) for ids in stale.values())
+    
+    async def _reap_room(self, room_id: str, transport_ids: List[str]) -> None:
+        room = self.rooms.get(room_id)
+        if not room:
+            return
+        for transport_id in transport_ids:
+            transport = room["router"].transports.get(transport_id)
+            if not transport or transport.connected:
+                continue
+            owner_id = self.transport_owners.get(transport_id)
+            participant = room["participants"].get(owner_id)
+            if participant:
+                await self._close_transport(room, participant, transport_id)
+                await self.send_to_client(owner_id, {
+                    "type": "transportClosed",
+                    "data": {
+                        "transportId": transport_id,
+                        "reason": "timeout"
+                    }
+                })
+            else:
+                await transport.close()
+            self.reaped_transports += 1
+            TRANSPORTS_REAPED.inc()
+    
+    async def _reap_loop(self) -> None:
+        interval = max(1.0, self.transport_connect_timeout / 2)
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.reap_idle_transports()
+            except Exception as e:
+                print(f"Error reaping transports: {e}")
     
     def _get_room_for_client(self, client_id: str) -> tuple:
         """Find which room the client is in."""
-        for room_id, room in self.rooms.items():
-            if client_id in room["participants"]:
-                return room_id, room
-        return None, None
\ No newline at end of file
+        room_id = self.client_rooms.get(client_id)
+        room = self.rooms.get(room_id)
+        if room and client_id in room["participants"]:
+            return room_id, room
+        return None, None
+    
+    def _unindex_participant(self, participant: Dict[str, Any]) -> None:
+        """Drop a participant's transports, producers and consumers from the lookup indexes."""
+        for transport_id in participant["transports"]:
+            self.transport_owners.pop(transport_id, None)
+        for producer_id in participant["producers"]:
+            self.producer_index.pop(producer_id, None)
+        for consumer_id in participant["consumers"]:
+            self.consumer_owners.pop(consumer_id, None)
\ No newline at end of file
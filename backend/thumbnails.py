@@ -0,0 +1,263 @@
+from typing import Dict, Any, List, Optional, Tuple
+from concurrent.futures import ProcessPoolExecutor
+import os
+import time
+import asyncio
+import hashlib
+
+# Optional: without NumPy the thumbnail feed is simply not offered
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+
+def downscale(frames: "np.ndarray", factor: int) -> "np.ndarray":
+    """Box-filter a stack of RGB frames (n, h, w, 3) by an integer factor in one vectorized pass."""
+    n, height, width, channels = frames.shape
+    height, width = (height // factor) * factor, (width // factor) * factor
+    blocks = frames[:, :height, :width].reshape(n, height // factor, factor, width // factor, factor, channels)
+    return blocks.mean(axis=(2, 4), dtype=np.float32).astype(np.uint8)
+
+
+def encode_thumbnails(frames: List["np.ndarray"], max_width: int) -> List[bytes]:
+    """Downscale and JPEG-encode RGB frames; runs in a worker process.
+
+    Frames of the same size are stacked and scaled together, so a room of
+    webcams sending the same resolution costs one NumPy operation.
+    """
+    import av
+
+    by_shape: Dict[Tuple[int, ...], List[int]] = {}
+    for index, frame in enumerate(frames):
+        by_shape.setdefault(frame.shape, []).append(index)
+
+    results: List[bytes] = [b""] * len(frames)
+    for shape, indexes in by_shape.items():
+        factor = max(1, -(-shape[1] // max_width))
+        thumbnails = downscale(np.stack([frames[i] for i in indexes]), factor)
+        # yuvj420p needs even dimensions
+        thumbnails = thumbnails[:, :thumbnails.shape[1] & ~1, :thumbnails.shape[2] & ~1]
+        codec = av.CodecContext.create("mjpeg", "w")
+        codec.width = thumbnails.shape[2]
+        codec.height = thumbnails.shape[1]
+        codec.pix_fmt = "yuvj420p"
+        for index, thumbnail in zip(indexes, thumbnails):
+            frame = av.VideoFrame.from_ndarray(thumbnail, format="rgb24").reformat(format="yuvj420p")
+            results[index] = b"".join(bytes(packet) for packet in codec.encode(frame))
+    return results
+
+
+def _to_rgb(frames: List[Any]) -> List["np.ndarray"]:
+    # Decoded frames cannot cross a process boundary; their pixels can
+    return [frame.to_ndarray(format="rgb24") for frame in frames]
+
+
+class Thumbnail:
+    __slots__ = ("student_id", "jpeg", "captured_at", "seq", "etag")
+
+    def __init__(self, student_id: str, jpeg: bytes, captured_at: float, seq: int):
+        self.student_id = student_id
+        self.jpeg = jpeg
+        self.captured_at = captured_at
+        self.seq = seq
+        self.etag = f'"{hashlib.sha1(jpeg).hexdigest()[:16]}"'
+
+
+class ThumbnailSampler:
+    """Takes one picture of a video producer per sampling interval.
+
+    The producer keeps forwarding encoded frames; each sample asks it for a
+    keyframe and decodes only that frame.
+    """
+
+    def __init__(self, room: "RoomThumbnails", producer: Any, student_id: str):
+        self.room = room
+        self.producer = producer
+        self.student_id = student_id
+        self.closed = False
+
+    def sample(self) -> None:
+        self.producer.snapshot(self._taken)
+
+    def _taken(self, frame: Any) -> None:
+        if not self.closed:
+            self.room.service.submit(self.room, self.student_id, frame)
+
+    def close(self) -> None:
+        self.closed = True
+        if self._taken in self.producer.snapshots:
+            self.producer.snapshots.remove(self._taken)
+
+
+class RoomThumbnails:
+    """Latest snapshot per student of one room, shared by every teacher watching it."""
+
+    def __init__(self, service: "ThumbnailService", room_id: str):
+        self.service = service
+        self.room_id = room_id
+        self.samplers: Dict[str, ThumbnailSampler] = {}  # producer_id -> sampler
+        self.latest: Dict[str, Thumbnail] = {}
+        self.version = 0
+        self.updated_at = time.time()
+        self.changed = asyncio.Event()
+
+    def attach(self, producer, owner: Optional[str] = None) -> None:
+        if producer.kind != "video" or not owner or producer.id in self.samplers:
+            return
+        self.samplers[producer.id] = ThumbnailSampler(self, producer, owner)
+        self.service.wake()
+
+    def release(self, producer) -> None:
+        sampler = self.samplers.pop(producer.id, None)
+        if sampler:
+            sampler.close()
+            if not any(s.student_id == sampler.student_id for s in self.samplers.values()):
+                self.latest.pop(sampler.student_id, None)
+                self._publish()
+
+    def store(self, thumbnails: List[Thumbnail]) -> None:
+        for thumbnail in thumbnails:
+            self.latest[thumbnail.student_id] = thumbnail
+        self._publish()
+
+    def _publish(self) -> None:
+        self.version += 1
+        self.updated_at = time.time()
+        # Wake every feed once, then arm a fresh event for the next change
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+    def index(self) -> List[Dict[str, Any]]:
+        return [
+            {"studentId": t.student_id, "seq": t.seq, "capturedAt": t.captured_at}
+            for t in sorted(self.latest.values(), key=lambda t: t.student_id)
+        ]
+
+
+class ThumbnailService:
+    """Samples video producers from a single task and encodes snapshots in batches on a process pool.
+
+    The sampling interval grows when the host is loaded or encoding takes a
+    noticeable share of the interval, and shrinks back once there is headroom.
+    """
+
+    def __init__(self, interval: float = None, max_interval: float = None, max_width: int = None,
+                 workers: int = None, batch_size: int = 64):
+        self.base_interval = interval if interval is not None else float(os.getenv("THUMBNAIL_INTERVAL", "3"))
+        self.max_interval = max_interval or float(os.getenv("THUMBNAIL_MAX_INTERVAL", "15"))
+        self.max_width = max_width or int(os.getenv("THUMBNAIL_WIDTH", "160"))
+        self.workers = workers or int(os.getenv("THUMBNAIL_WORKERS", "2"))
+        self.batch_size = batch_size
+        self.interval = self.base_interval
+        self.rooms: Dict[str, RoomThumbnails] = {}
+        # Latest unencoded frame per (room, student); newer samples replace older ones
+        self.pending: Dict[Tuple[str, str], Tuple[RoomThumbnails, str, Any, float]] = {}
+        self.executor = None
+        self.task = None
+        self.sampling = None
+        self.seq = 0
+        self.batches = 0
+        self.encoded = 0
+        self.last_batch_seconds = 0.0
+
+    @property
+    def enabled(self) -> bool:
+        return np is not None and self.base_interval > 0
+
+    def for_room(self, room_id: str) -> Optional[RoomThumbnails]:
+        if not self.enabled:
+            return None
+        room = self.rooms.get(room_id)
+        if room is None:
+            room = self.rooms[room_id] = RoomThumbnails(self, room_id)
+        return room
+
+    def close_room(self, room_id: str) -> None:
+        self.rooms.pop(room_id, None)
+        for key in [key for key in self.pending if key[0] == room_id]:
+            del self.pending[key]
+
+    def wake(self) -> None:
+        if self.sampling is None:
+            self.sampling = asyncio.create_task(self._sample())
+
+    async def _sample(self) -> None:
+        try:
+            while any(room.samplers for room in self.rooms.values()):
+                for room in list(self.rooms.values()):
+                    for sampler in list(room.samplers.values()):
+                        sampler.sample()
+                await asyncio.sleep(self.interval)
+        finally:
+            self.sampling = None
+
+    def submit(self, room: RoomThumbnails, student_id: str, frame: Any) -> None:
+        self.pending[(room.room_id, student_id)] = (room, student_id, frame, time.time())
+        if self.task is None:
+            self.task = asyncio.create_task(self._run())
+
+    async def _run(self) -> None:
+        try:
+            while self.pending:
+                keys = list(self.pending)[:self.batch_size]
+                batch = [self.pending.pop(key) for key in keys]
+                started = time.monotonic()
+                try:
+                    await self._encode(batch)
+                except Exception as e:
+                    print(f"Thumbnail batch failed: {e}")
+                self.last_batch_seconds = time.monotonic() - started
+                self._adapt()
+        finally:
+            self.task = None
+
+    async def _encode(self, batch: List[Tuple[RoomThumbnails, str, Any, float]]) -> None:
+        loop = asyncio.get_running_loop()
+        if self.executor is None:
+            self.executor = ProcessPoolExecutor(max_workers=self.workers)
+        pixels = await loop.run_in_executor(None, _to_rgb, [frame for _, _, frame, _ in batch])
+        jpegs = await loop.run_in_executor(self.executor, encode_thumbnails, pixels, self.max_width)
+
+        by_room: Dict[str, List[Thumbnail]] = {}
+        for (room, student_id, _, captured_at), jpeg in zip(batch, jpegs):
+            if not jpeg or self.rooms.get(room.room_id) is not room:
+                continue
+            self.seq += 1
+            by_room.setdefault(room.room_id, []).append(Thumbnail(student_id, jpeg, captured_at, self.seq))
+        for room_id, thumbnails in by_room.items():
+            self.rooms[room_id].store(thumbnails)
+        self.batches += 1
+        self.encoded += len(batch)
+
+    def _adapt(self) -> None:
+        try:
+            load = os.getloadavg()[0] / (os.cpu_count() or 1)
+        except (AttributeError, OSError):
+            load = 0.0
+        busy = self.last_batch_seconds / self.interval
+        if load > 0.8 or busy > 0.5:
+            self.interval = min(self.max_interval, self.interval * 1.5)
+        elif load < 0.5 and busy < 0.1:
+            self.interval = max(self.base_interval, self.interval / 1.25)
+
+    async def close(self) -> None:
+        for task in (self.task, self.sampling):
+            if task:
+                task.cancel()
+        self.task = self.sampling = None
+        self.pending.clear()
+        if self.executor:
+            self.executor.shutdown(wait=False)
+            self.executor = None
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "enabled": self.enabled,
+            "interval": round(self.interval, 2),
+            "rooms": {room_id: len(room.latest) for room_id, room in self.rooms.items()},
+            "pending": len(self.pending),
+            "batches": self.batches,
+            "encoded": self.encoded,
+            "lastBatchSeconds": round(self.last_batch_seconds, 4)
+        }
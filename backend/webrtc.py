@@ -1,26 +1,80 @@
-from typing import Dict, Any, List
+from typing import Dict, Any, Callable, List, Optional, Tuple, TYPE_CHECKING
+from collections import deque
+import os
+import re
+import copy
 import json
+import time
 import uuid
 import asyncio
-import aiortc
-from aiortc import RTCPeerConnection, RTCSessionDescription, MediaStreamTrack
-from aiortc.contrib.media import MediaRelay
+import itertools
+import functools
+import media
+from metrics import TRANSPORT_CREATE_SECONDS, TRANSPORT_SETUP_SECONDS
+from negotiation import NEGOTIATOR, CodecNegotiator
+
+if TYPE_CHECKING:
+    from aiortc import MediaStreamTrack
+
+VIDEO_RTCP_FEEDBACK = [
+    {"type": "nack"},
+    {"type": "nack", "parameter": "pli"},
+    {"type": "ccm", "parameter": "fir"},
+    {"type": "goog-remb"},
+    {"type": "transport-cc"}
+]
+
+SCALABILITY_MODE = re.compile(r"^[LS](\d+)T(\d+)")
+
+# Keyframe requests (PLI) sent to a producer, at most one per layer in this many seconds
+KEYFRAME_REQUEST_INTERVAL = 0.5
+
+
+def parse_layers(rtp_parameters: Dict[str, Any]) -> Tuple[int, int]:
+    """Return (spatial, temporal) layer counts described by rtpParameters.encodings.
+    
+    Several encodings mean simulcast, one spatial layer each. A single encoding
+    may carry an SVC scalabilityMode such as "L3T3".
+    """
+    encodings = rtp_parameters.get("encodings") or [{}]
+    spatial, temporal = len(encodings), 1
+    for encoding in encodings:
+        match = SCALABILITY_MODE.match(encoding.get("scalabilityMode") or "")
+        if match:
+            temporal = max(temporal, int(match.group(2)))
+            if len(encodings) == 1:
+                spatial = int(match.group(1))
+    return spatial, temporal
+
+
+def sdp_value(sdp: str, prefix: str) -> str:
+    """Rest of the first SDP line starting with prefix."""
+    for line in sdp.split("\r\n"):
+        if line.startswith(prefix):
+            return line[len(prefix):]
+    raise ValueError(f"Local description has no {prefix.rstrip(': ')} line")
+
 
 class Router:
-    def __init__(self):
+    def __init__(self, negotiator: CodecNegotiator = None):
         self.id = str(uuid.uuid4())
+        self.negotiator = negotiator or NEGOTIATOR
         self.rtp_capabilities = {
             "codecs": [
                 {
                     "kind": "audio",
                     "mimeType": "audio/opus",
                     "clockRate": 48000,
-                    "channels": 2
+                    "channels": 2,
+                    "rtcpFeedback": [
+                        {"type": "transport-cc"}
+                    ]
                 },
                 {
                     "kind": "video",
                     "mimeType": "video/VP8",
-                    "clockRate": 90000
+                    "clockRate": 90000,
+                    "rtcpFeedback": VIDEO_RTCP_FEEDBACK
                 },
                 {
                     "kind": "video", 
@@ -30,23 +84,75 @@ class Router:
                         "packetizationMode": 1,
                         "profileLevelId": "42e01f",
                         "levelAsymmetryAllowed": 1
-                    }
+                    },
+                    "rtcpFeedback": VIDEO_RTCP_FEEDBACK
                 }
+            ],
+            # RID/MID extensions let clients send simulcast encodings
+            "headerExtensions": [
+                {"kind": "audio", "uri": "urn:ietf:params:rtp-hdrext:sdes:mid", "preferredId": 1},
+                {"kind": "video", "uri": "urn:ietf:params:rtp-hdrext:sdes:mid", "preferredId": 1},
+                {"kind": "video", "uri": "urn:ietf:params:rtp-hdrext:sdes:rtp-stream-id", "preferredId": 2},
+                {"kind": "video", "uri": "urn:ietf:params:rtp-hdrext:sdes:repaired-rtp-stream-id", "preferredId": 3},
+                {"kind": "audio", "uri": "urn:ietf:params:rtp-hdrext:ssrc-audio-level", "preferredId": 10}
             ]
         }
         self.transports = {}
         self.producers = {}
         self.consumers = {}
-        self.media_relay = MediaRelay()
+        # Per-room media taps (recording, thumbnails...): attach(producer, owner) and release(producer)
+        self.taps: List[Any] = []
     
     def can_consume(self, producer_id: str, rtp_capabilities: Dict) -> bool:
         """Check if a client can consume a producer with given capabilities."""
-        if producer_id not in self.producers:
+        producer = self.producers.get(producer_id)
+        if not producer or not rtp_capabilities:
             return False
-            
-        # In a real implementation, we would check codec compatibility
-        # For this example, we'll assume compatibility
-        return True
+        return self.negotiate(producer, rtp_capabilities) is not None
+    
+    def negotiate(self, producer: "Producer", rtp_capabilities: Dict) -> Optional[Dict[str, Any]]:
+        """Codecs and header extensions of producer that the capabilities accept (cached)."""
+        return self.negotiator.negotiate(producer.rtp_key, producer.rtp_parameters, rtp_capabilities)
+    
+    def add_producer(self, producer: "Producer", owner: Optional[str] = None) -> None:
+        self.producers[producer.id] = producer
+        for tap in self.taps:
+            tap.attach(producer, owner)
+    
+    def close_producer(self, producer_id: str) -> List["Consumer"]:
+        """Close a producer and every consumer fed by it. Returns the consumers that ended."""
+        producer = self.producers.pop(producer_id, None)
+        if not producer:
+            return []
+        dependents = list(producer.consumers.values())
+        for tap in self.taps:
+            tap.release(producer)
+        producer.close()
+        for consumer in dependents:
+            self._forget_consumer(consumer)
+        return dependents
+    
+    def close_consumer(self, consumer_id: str) -> Optional["Consumer"]:
+        consumer = self.consumers.get(consumer_id)
+        if not consumer:
+            return None
+        if consumer.producer:
+            consumer.producer.remove_consumer(consumer_id)
+        else:
+            consumer.close()
+        self._forget_consumer(consumer)
+        return consumer
+    
+    def _forget_consumer(self, consumer: "Consumer") -> None:
+        self.consumers.pop(consumer.id, None)
+        transport = self.transports.get(consumer.transport_id)
+        if transport:
+            transport.consumers.pop(consumer.id, None)
+    
+    async def close(self) -> None:
+        """Close every transport still open on this router."""
+        for transport in list(self.transports.values()):
+            await transport.close()
 
 
 class WebRTCTransport:
@@ -54,20 +160,55 @@ class WebRTCTransport:
         self.id = str(uuid.uuid4())
         self.router = router
         self.pc = peer_connection
+        sdp = self.pc.localDescription.sdp
         self.ice_parameters = {
-            "usernameFragment": self.pc.localDescription.sdp.split("a=ice-ufrag:")[1].split("\r\n")[0],
-            "password": self.pc.localDescription.sdp.split("a=ice-pwd:")[1].split("\r\n")[0]
+            "usernameFragment": sdp_value(sdp, "a=ice-ufrag:"),
+            "password": sdp_value(sdp, "a=ice-pwd:")
         }
-        self.ice_candidates = self._extract_ice_candidates(self.pc.localDescription.sdp)
+        # Every m-line has its own ICE agent until the answer bundles them onto the first
+        first_media = "\r\nm=".join(sdp.split("\r\nm=")[:2])
+        self.ice_candidates = self._extract_ice_candidates(first_media)
+        if not self.ice_candidates:
+            raise ValueError("Local description has no ICE candidates")
         self.dtls_parameters = {
             "role": "auto",
             "fingerprints": [
                 {
                     "algorithm": "sha-256",
-                    "value": self.pc.localDescription.sdp.split("a=fingerprint:sha-256 ")[1].split("\r\n")[0]
+                    "value": sdp_value(sdp, "a=fingerprint:sha-256 ")
                 }
             ]
         }
+        
+        # Incoming (track, transceiver) pairs and producers are paired up by kind in arrival order
+        self.pending_tracks: Dict[str, deque] = {"audio": deque(), "video": deque()}
+        self.pending_producers: Dict[str, deque] = {"audio": deque(), "video": deque()}
+        self.pc.on("track", self._on_track)
+        self.pc.on("connectionstatechange", self._on_connection_state_change)
+        
+        self.producers: Dict[str, "Producer"] = {}
+        self.consumers: Dict[str, "Consumer"] = {}
+        # Set when a client takes the transport; pooled transports are not on the clock
+        self.assigned_at = time.monotonic()
+        self.owner: Optional[str] = None
+        self.connected = False
+        self.closed = False
+        # Consumer tracks were added since the last offer
+        self.negotiation_needed = False
+    
+    def _on_connection_state_change(self) -> None:
+        if self.pc.connectionState == "connected":
+            self.connected = True
+    
+    def _on_track(self, track: "MediaStreamTrack") -> None:
+        """Hand a newly received remote track to the producer waiting for it."""
+        transceiver = next((t for t in self.pc.getTransceivers() if t.receiver.track is track), None)
+        waiting = self.pending_producers.get(track.kind)
+        if waiting:
+            if waiting[0].attach_track(track, transceiver):
+                waiting.popleft()
+        elif waiting is not None:
+            self.pending_tracks[track.kind].append((track, transceiver))
     
     def _extract_ice_candidates(self, sdp: str) -> List[Dict[str, Any]]:
         """Extract ICE candidates from SDP."""
@@ -89,85 +230,542 @@ class WebRTCTransport:
         
         return candidates
     
-    async def connect(self, dtls_parameters: Dict[str, Any]) -> None:
-        """Connect the transport."""
-        # In a real implementation, you would handle the DTLS setup
-        # For this simplified example, we assume it's already handled by aiortc
-        pass
+    async def connect(self, dtls_parameters: Optional[Dict[str, Any]], sdp: Optional[str] = None) -> None:
+        """Connect the transport with the client's answer to its latest offer.
+        
+        aiortc runs full ICE, so it needs the remote ICE credentials and
+        candidates of an SDP answer. dtlsParameters alone, as mediasoup-client
+        sends them, are accepted but connect nothing. connected is only set
+        once the peer connection reports it, so such a transport is reaped
+        like one that never connected.
+        """
+        if sdp:
+            description = media.stack().RTCSessionDescription(sdp=sdp, type="answer")
+            await self.pc.setRemoteDescription(description)
+    
+    async def renegotiate(self) -> Optional[str]:
+        """A new offer once consumer tracks were added, or None.
+        
+        Waits until the client has answered the previous offer, so a client
+        that never answers over SDP is never sent one.
+        """
+        if not self.negotiation_needed or self.pc.signalingState != "stable":
+            return None
+        self.negotiation_needed = False
+        offer = await self.pc.createOffer()
+        await self.pc.setLocalDescription(offer)
+        return self.pc.localDescription.sdp
+    
+    def _prefer_codec(self, sender: Any, mime_type: Optional[str]) -> None:
+        """Offer only the producer's codec on sender, since its frames are sent without re-encoding."""
+        transceiver = next((t for t in self.pc.getTransceivers() if t.sender is sender), None)
+        if transceiver is None or not mime_type:
+            return
+        capabilities = media.stack().RTCRtpSender.getCapabilities(transceiver.kind).codecs
+        codecs = [codec for codec in capabilities if codec.mimeType.lower() == mime_type.lower()]
+        if codecs:
+            codecs += [codec for codec in capabilities if codec.mimeType.lower().endswith("/rtx")]
+            transceiver.setCodecPreferences(codecs)
     
     async def produce(self, kind: str, rtp_parameters: Dict[str, Any]) -> Any:
         """Produce media."""
-        producer_id = str(uuid.uuid4())
-        
-        # In a real implementation, this would create a media producer
-        # For now, we'll create a simple placeholder
-        producer = {
-            "id": producer_id,
-            "kind": kind,
-            "rtp_parameters": rtp_parameters
-        }
+        producer = Producer(str(uuid.uuid4()), kind, rtp_parameters)
         
-        self.router.producers[producer_id] = producer
-        return Producer(producer_id, kind)
+        # Start forwarding as soon as the matching remote tracks are available;
+        # a simulcast producer takes one track per encoding
+        pending = self.pending_tracks.get(kind)
+        if pending is None:
+            raise ValueError(f"Unsupported media kind: {kind}")
+        complete = False
+        while pending and not complete:
+            complete = producer.attach_track(*pending.popleft())
+        if not complete:
+            self.pending_producers[kind].append(producer)
+        
+        self.producers[producer.id] = producer
+        self.router.add_producer(producer, self.owner)
+        return producer
     
-    async def consume(self, producer_id: str, rtp_capabilities: Dict[str, Any], paused: bool = False) -> Any:
+    async def consume(self, producer_id: str, rtp_capabilities: Dict[str, Any], paused: bool = False,
+                      preferred_layers: Optional[Dict[str, int]] = None) -> Any:
         """Consume media."""
-        consumer_id = str(uuid.uuid4())
         producer = self.router.producers.get(producer_id)
         
         if not producer:
             raise ValueError("Producer not found")
         
-        # In a real implementation, this would create a media consumer
-        # For now, we'll create a simple placeholder
-        consumer = {
-            "id": consumer_id,
-            "producer_id": producer_id,
-            "kind": producer["kind"],
-            "rtp_parameters": producer["rtp_parameters"],  # In real case, would be adjusted
-            "paused": paused
-        }
+        negotiated = self.router.negotiate(producer, rtp_capabilities or {})
+        if negotiated is None:
+            raise ValueError("Incompatible RTP capabilities")
+        
+        # Usually loaded since the room opened; otherwise wait without blocking the loop on the import
+        await media.load()
+        consumer = Consumer(
+            str(uuid.uuid4()),
+            producer.kind,
+            producer_id=producer_id,
+            rtp_parameters=producer.consumer_rtp_parameters(negotiated),
+            paused=paused
+        )
+        consumer.transport_id = self.id
+        consumer.track.sender = self.pc.addTrack(consumer.track)
+        self._prefer_codec(consumer.track.sender, producer.mime_type)
+        self.negotiation_needed = True
+        producer.add_consumer(consumer)
+        if preferred_layers:
+            await consumer.set_preferred_layers(
+                preferred_layers.get("spatialLayer"),
+                preferred_layers.get("temporalLayer")
+            )
+        
+        self.consumers[consumer.id] = consumer
+        self.router.consumers[consumer.id] = consumer
+        return consumer
+    
+    async def close(self) -> List["Consumer"]:
+        """Close the peer connection along with everything produced or consumed on it.
         
-        self.router.consumers[consumer_id] = consumer
-        return Consumer(consumer_id, producer["kind"])
+        Returns the consumers on other transports that ended because they were
+        fed by one of this transport's producers.
+        """
+        if self.closed:
+            return []
+        self.closed = True
+        self.router.transports.pop(self.id, None)
+        
+        dependents = []
+        for producer_id in list(self.producers):
+            dependents.extend(
+                consumer for consumer in self.router.close_producer(producer_id)
+                if consumer.transport_id != self.id
+            )
+        for consumer_id in list(self.consumers):
+            self.router.close_consumer(consumer_id)
+        self.producers.clear()
+        self.consumers.clear()
+        for queue in list(self.pending_producers.values()) + list(self.pending_tracks.values()):
+            queue.clear()
+        
+        await self.pc.close()
+        return dependents
 
 
 class Producer:
-    def __init__(self, id, kind):
+    def __init__(self, id, kind, rtp_parameters=None):
         self.id = id
         self.kind = kind
+        self.rtp_parameters = rtp_parameters or {}
+        self.rtp_key = CodecNegotiator.producer_key(self.rtp_parameters)
+        self.spatial_layers, self.temporal_layers = parse_layers(self.rtp_parameters)
+        # Simulcast arrives as one track per encoding; SVC and plain streams as one track
+        self.expected_tracks = len(self.rtp_parameters.get("encodings") or [{}])
+        self.tracks: Dict[int, "MediaStreamTrack"] = {}
+        # RTCRtpReceiver per layer, where keyframes are requested
+        self.receivers: Dict[int, Any] = {}
+        codecs = self.rtp_parameters.get("codecs") or [{}]
+        self.mime_type: Optional[str] = codecs[0].get("mimeType")
+        self.consumers: Dict[str, "Consumer"] = {}
+        # Extra receivers of decoded frames of the top layer, such as recorders; each has push(frame)
+        self.sinks: List[Any] = []
+        # Callbacks waiting for a single decoded picture of the top layer; see snapshot()
+        self.snapshots: List[Callable[[Any], None]] = []
+        self.decode_next = False
+        self.packets = 0
+        self.keyframe_requested: Dict[int, float] = {}
+        self.forward_tasks: List[asyncio.Task] = []
+    
+    @property
+    def track(self) -> Optional["MediaStreamTrack"]:
+        """Highest-quality track received so far."""
+        if not self.tracks:
+            return None
+        return self.tracks[max(self.tracks)]
+    
+    def attach_track(self, track: "MediaStreamTrack", transceiver: Any = None) -> bool:
+        """Start forwarding the next remote track. Returns True once all layers are attached."""
+        # Take the lowest free layer, so a layer that ended and came back gets its index again
+        spatial_layer = next(layer for layer in itertools.count() if layer not in self.tracks)
+        self.tracks[spatial_layer] = track
+        tap = None
+        if transceiver is not None:
+            codecs = getattr(transceiver, "_codecs", None) or []
+            if codecs:
+                self.mime_type = codecs[0].mimeType
+            self.receivers[spatial_layer] = transceiver.receiver
+            tap = media.encoded_tap(
+                transceiver.receiver,
+                kind=self.kind,
+                codecs={codec.payloadType: codec.name for codec in codecs},
+                layered=self.temporal_layers > 1,
+                on_frame=functools.partial(self._deliver, spatial_layer),
+                decode=functools.partial(self._wants_decoded, spatial_layer)
+            )
+            if tap is None:
+                print(f"Producer {self.id}: no encoded frame hook in this aiortc, forwarding decoded frames")
+        self.forward_tasks.append(asyncio.create_task(self._forward(spatial_layer, track, tap is not None)))
+        for consumer in self.consumers.values():
+            self.update_layers(consumer)
+        return len(self.tracks) >= self.expected_tracks
+    
+    def consumer_rtp_parameters(self, negotiated: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """RTP parameters seen by a consumer: one outgoing stream whatever the layers.
+        
+        negotiated, when given, supplies the codecs and header extensions the
+        consumer accepted in place of the producer's own.
+        """
+        rtp_parameters = {k: v for k, v in self.rtp_parameters.items() if k not in ("codecs", "headerExtensions")}
+        rtp_parameters = copy.deepcopy(rtp_parameters)
+        source = negotiated if negotiated is not None else self.rtp_parameters
+        rtp_parameters["codecs"] = copy.deepcopy(source.get("codecs") or [])
+        rtp_parameters["headerExtensions"] = copy.deepcopy(source.get("headerExtensions") or [])
+        encodings = rtp_parameters.get("encodings")
+        if encodings and (len(encodings) > 1 or self.temporal_layers > 1):
+            rtp_parameters["encodings"] = [{
+                "scalabilityMode": f"S{self.spatial_layers}T{self.temporal_layers}"
+            }]
+        return rtp_parameters
+    
+    def add_consumer(self, consumer: "Consumer") -> None:
+        consumer.producer = self
+        self.consumers[consumer.id] = consumer
+        self.update_layers(consumer)
+    
+    def remove_consumer(self, consumer_id: str) -> None:
+        consumer = self.consumers.pop(consumer_id, None)
+        if consumer:
+            consumer.close()
+    
+    def add_sink(self, sink: Any) -> None:
+        self.sinks.append(sink)
+        # Decoding of the top layer starts now, and needs a keyframe to start from
+        if self.tracks:
+            self.request_keyframe(max(self.tracks))
+    
+    def remove_sink(self, sink: Any) -> None:
+        if sink in self.sinks:
+            self.sinks.remove(sink)
+    
+    def snapshot(self, callback: Callable[[Any], None]) -> None:
+        """Hand the next decoded picture of the top layer to callback, once.
+        
+        Forwarding stays encoded: a keyframe is requested and only that
+        keyframe goes through the decoder. Asking again while a snapshot is
+        still pending only repeats the keyframe request.
+        """
+        if callback not in self.snapshots:
+            self.snapshots.append(callback)
+        if self.tracks:
+            self.request_keyframe(max(self.tracks))
+    
+    def update_layers(self, consumer: "Consumer") -> None:
+        """Pick the highest layers available that do not exceed the consumer's preference."""
+        spatial = min(consumer.preferred_spatial_layer, self.spatial_layers - 1)
+        available = [layer for layer in self.tracks if layer <= spatial]
+        if available:
+            spatial = max(available)
+        elif self.tracks:
+            spatial = min(self.tracks)
+        if spatial != consumer.current_spatial_layer:
+            # Frames of the new layer do not follow on from the old one's
+            consumer.awaiting_keyframe = True
+            if not consumer.paused:
+                self.request_keyframe(spatial)
+        consumer.current_spatial_layer = spatial
+        consumer.current_temporal_layer = min(consumer.preferred_temporal_layer, self.temporal_layers - 1)
+    
+    def request_keyframe(self, spatial_layer: int) -> None:
+        """Ask the client for a keyframe on one layer, at most once per KEYFRAME_REQUEST_INTERVAL."""
+        receiver = self.receivers.get(spatial_layer)
+        now = time.monotonic()
+        if self.kind != "video" or receiver is None:
+            return
+        if now - self.keyframe_requested.get(spatial_layer, 0.0) < KEYFRAME_REQUEST_INTERVAL:
+            return
+        self.keyframe_requested[spatial_layer] = now
+        for source in receiver.getSynchronizationSources():
+            asyncio.ensure_future(receiver._send_rtcp_pli(source.source))
+    
+    def _wants_decoded(self, spatial_layer: int) -> bool:
+        if spatial_layer != max(self.tracks, default=None):
+            return False
+        if self.sinks:
+            return True
+        # A pending snapshot decodes the one keyframe _deliver just saw
+        decode, self.decode_next = self.decode_next, False
+        return decode
+    
+    def _deliver(self, spatial_layer: int, frame: Any, temporal_layer: int = 0, keyframe: bool = True) -> None:
+        """Hand one frame of a layer to every consumer receiving that layer.
+        
+        Every consumer gets the same object. Frames above a consumer's
+        temporal layer are skipped; nothing in the lower layers refers to them.
+        """
+        self.packets += 1
+        if self.snapshots and keyframe and spatial_layer == max(self.tracks, default=None):
+            self.decode_next = True
+        for consumer in self.consumers.values():
+            if (consumer.paused
+                    or consumer.current_spatial_layer != spatial_layer
+                    or temporal_layer > consumer.current_temporal_layer):
+                continue
+            if consumer.awaiting_keyframe:
+                if not keyframe:
+                    continue
+                consumer.awaiting_keyframe = False
+            if not consumer.track.push(frame):
+                # Later frames depend on the dropped one; start over from a keyframe
+                consumer.track.clear()
+                consumer.awaiting_keyframe = True
+                self.request_keyframe(spatial_layer)
+    
+    async def _forward(self, spatial_layer: int, track: "MediaStreamTrack", encoded: bool) -> None:
+        """Read one remote track until it ends.
+        
+        With encoded forwarding the track only yields decoded frames while a
+        sink or a pending snapshot wants them. Otherwise the decoded frames are what consumers get,
+        and each consumer's sender encodes them again.
+        """
+        # Only reached once a remote track exists, so the media stack is loaded
+        from aiortc.mediastreams import MediaStreamError
+        
+        while True:
+            try:
+                frame = await track.recv()
+            except MediaStreamError:
+                break
+            if not encoded:
+                self._deliver(spatial_layer, frame)
+            if spatial_layer == max(self.tracks):
+                for sink in self.sinks:
+                    sink.push(frame)
+                if self.snapshots:
+                    snapshots, self.snapshots = self.snapshots, []
+                    for callback in snapshots:
+                        callback(frame)
+        
+        # Fall back to the remaining layers, or end consumers once none are left
+        self.tracks.pop(spatial_layer, None)
+        self.receivers.pop(spatial_layer, None)
+        for consumer in list(self.consumers.values()):
+            if self.tracks:
+                self.update_layers(consumer)
+            else:
+                consumer.close()
+    
+    def close(self) -> None:
+        """Stop forwarding and end every dependent consumer."""
+        for task in self.forward_tasks:
+            task.cancel()
+        for consumer in list(self.consumers.values()):
+            consumer.close()
+        self.consumers.clear()
 
 
 class Consumer:
-    def __init__(self, id, kind):
+    def __init__(self, id, kind, producer_id=None, rtp_parameters=None, paused=True):
         self.id = id
         self.kind = kind
-        self.rtp_parameters = {}
-        self.paused = True
+        self.producer_id = producer_id
+        self.producer = None
+        self.transport_id = None
+        self.rtp_parameters = rtp_parameters or {}
+        self.paused = paused
+        self.track = media.forwarding_track(kind)
+        
+        # Highest layers by default; the producer clamps them to what it sends
+        self.preferred_spatial_layer = 255
+        self.preferred_temporal_layer = 255
+        self.current_spatial_layer = 0
+        self.current_temporal_layer = 0
+        # Forwarded frames only decode from a keyframe onwards
+        self.awaiting_keyframe = True
+        self.track.on_keyframe_request = self.request_keyframe
+    
+    def request_keyframe(self) -> None:
+        if self.producer:
+            self.producer.request_keyframe(self.current_spatial_layer)
     
     async def resume(self) -> None:
         """Resume the consumer."""
-        self.paused = False
+        if self.paused:
+            self.paused = False
+            self.awaiting_keyframe = True
+            self.request_keyframe()
+    
+    async def pause(self) -> None:
+        """Pause the consumer; queued packets are discarded."""
+        self.paused = True
+        self.track.clear()
+    
+    async def set_preferred_layers(self, spatial_layer: Optional[int], temporal_layer: Optional[int] = None) -> None:
+        """Choose which simulcast/SVC layers this consumer receives."""
+        if spatial_layer is not None:
+            self.preferred_spatial_layer = max(0, int(spatial_layer))
+        if temporal_layer is not None:
+            self.preferred_temporal_layer = max(0, int(temporal_layer))
+        if self.producer:
+            self.producer.update_layers(self)
+    
+    @property
+    def layers(self) -> Dict[str, int]:
+        return {
+            "spatialLayer": self.current_spatial_layer,
+            "temporalLayer": self.current_temporal_layer
+        }
+    
+    def close(self) -> None:
+        self.paused = True
+        self.track.stop()
+
+
+class TransportPool:
+    """Warm inventory of ready transports for one router, refilled in the background."""
+    
+    # Transports built concurrently per refill round, so a large pre-warm does not stall the loop
+    REFILL_BATCH = 8
+    
+    def __init__(self, manager, router: Router, size: int):
+        self.manager = manager
+        self.router = router
+        self.size = size
+        self.ready = deque()
+        self.refill_task = None
+        self.closed = False
+        self.hits = 0
+        self.misses = 0
+    
+    async def acquire(self) -> WebRTCTransport:
+        """Take a warm transport, or build one if the pool is empty."""
+        if self.ready:
+            self.hits += 1
+            transport = self.ready.popleft()
+        else:
+            self.misses += 1
+            transport = await self.manager.build_transport(self.router)
+        self.refill()
+        return transport
+    
+    def refill(self) -> None:
+        """Top the pool up to its watermark in the background."""
+        if self.closed or self.size <= 0:
+            return
+        if self.refill_task and not self.refill_task.done():
+            return
+        self.refill_task = asyncio.create_task(self._refill())
+    
+    async def _refill(self) -> None:
+        while not self.closed and len(self.ready) < self.size:
+            missing = min(self.size - len(self.ready), self.REFILL_BATCH)
+            results = await asyncio.gather(
+                *(self.manager.build_transport(self.router) for _ in range(missing)),
+                return_exceptions=True
+            )
+            built = [r for r in results if isinstance(r, WebRTCTransport)]
+            for transport in built:
+                if self.closed:
+                    await transport.pc.close()
+                else:
+                    self.ready.append(transport)
+            if not built:
+                print(f"Transport pool refill failed for router {self.router.id}: {results[0]}")
+                return
+    
+    def resize(self, size: int) -> None:
+        """Change the watermark; idle transports above a lower one are closed."""
+        self.size = max(0, size)
+        surplus = [self.ready.pop() for _ in range(max(0, len(self.ready) - self.size))]
+        if surplus:
+            asyncio.create_task(self._close_idle(surplus))
+        self.refill()
+    
+    @staticmethod
+    async def _close_idle(transports: List[WebRTCTransport]) -> None:
+        for transport in transports:
+            await transport.pc.close()
+    
+    async def close(self) -> None:
+        """Stop refilling and close every idle transport."""
+        self.closed = True
+        if self.refill_task and not self.refill_task.done():
+            self.refill_task.cancel()
+        while self.ready:
+            await self.ready.popleft().pc.close()
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "ready": len(self.ready),
+            "size": self.size,
+            "hits": self.hits,
+            "misses": self.misses
+        }
 
 
 class WebRTCManager:
-    def __init__(self):
+    def __init__(self, pool_size: int = None, ice_gathering_timeout: float = None):
         """Initialize WebRTC manager."""
-        pass
+        if pool_size is None:
+            pool_size = int(os.getenv("TRANSPORT_POOL_SIZE", "4"))
+        if ice_gathering_timeout is None:
+            ice_gathering_timeout = float(os.getenv("ICE_GATHERING_TIMEOUT", "5"))
+        self.pool_size = pool_size
+        self.ice_gathering_timeout = ice_gathering_timeout
+        self.pools: Dict[str, TransportPool] = {}
     
     async def create_router(self) -> Router:
-        """Create a new router."""
-        return Router()
+        """Create a new router and start warming its transport pool."""
+        # The first room's transports and consumers should not wait on importing aiortc
+        media.preload()
+        router = Router()
+        pool = TransportPool(self, router, self.pool_size)
+        self.pools[router.id] = pool
+        pool.refill()
+        return router
+    
+    async def close_router(self, router: Router) -> None:
+        """Release the transport pool held for a router and close its remaining transports."""
+        pool = self.pools.pop(router.id, None)
+        if pool:
+            await pool.close()
+        await router.close()
     
     async def create_transport(self, router: Router) -> WebRTCTransport:
-        """Create a WebRTC transport."""
-        pc = RTCPeerConnection()
-        
-        # Create a basic offer to initialize ICE/DTLS
-        offer = await pc.createOffer()
-        await pc.setLocalDescription(offer)
-        
-        # Wait for ICE gathering to complete
-        await asyncio.sleep(0.1)
+        """Create a WebRTC transport, served from the router's warm pool when possible."""
+        pool = self.pools.get(router.id)
+        with TRANSPORT_CREATE_SECONDS.time("pool" if pool and pool.ready else "build"):
+            if pool:
+                transport = await pool.acquire()
+            else:
+                transport = await self.build_transport(router)
+        transport.assigned_at = time.monotonic()
+        router.transports[transport.id] = transport
+        return transport
+    
+    async def build_transport(self, router: Router) -> WebRTCTransport:
+        """Build a transport whose ICE candidates have been fully gathered."""
+        aiortc = await media.load()
+        await media.CERTIFICATES.refresh()
+        with TRANSPORT_SETUP_SECONDS.time("peer_connection"):
+            pc = aiortc.RTCPeerConnection()
+            # aiortc only creates ICE and DTLS transports for m-lines, and refuses
+            # an offer without any; receiving both kinds also lets it carry producers
+            for kind in ("audio", "video"):
+                pc.addTransceiver(kind, direction="recvonly")
         
-        return WebRTCTransport(router, pc)
\ No newline at end of file
+        try:
+            with TRANSPORT_SETUP_SECONDS.time("ice_gathering"):
+                offer = await pc.createOffer()
+                # setLocalDescription returns once ICE gathering has completed
+                await asyncio.wait_for(pc.setLocalDescription(offer), self.ice_gathering_timeout)
+            return WebRTCTransport(router, pc)
+        except Exception:
+            await pc.close()
+            raise
+    
+    def resize_pool(self, router: Router, size: Optional[int] = None) -> None:
+        """Grow a router's warm pool ahead of a known rush, or shrink it back (size None)."""
+        pool = self.pools.get(router.id)
+        if pool:
+            pool.resize(self.pool_size if size is None else size)
+    
+    def pool_stats(self) -> Dict[str, Any]:
+        return {router_id: pool.stats() for router_id, pool in self.pools.items()}
@@ -0,0 +1,76 @@
+from typing import Dict, Any, List, Optional, Union
+import json
+
+# Optional codecs: orjson speeds up the default JSON path, msgpack enables the binary format
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+JSON = "json"
+MSGPACK = "msgpack"
+
+# WebSocket subprotocols clients may offer, mapped to the wire format they select
+SUBPROTOCOLS = {
+    "exam-signaling.msgpack": MSGPACK,
+    "exam-signaling.json": JSON
+}
+
+
+def dumps_text(message: Any) -> str:
+    """Compact JSON text, using orjson when it is installed."""
+    if orjson is not None:
+        return orjson.dumps(message).decode("utf-8")
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def loads_text(data: Union[str, bytes]) -> Any:
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def pack(message: Any) -> bytes:
+    return msgpack.packb(message, use_bin_type=True)
+
+
+def unpack(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+def available_formats() -> List[str]:
+    return [JSON, MSGPACK] if msgpack is not None else [JSON]
+
+
+def choose_subprotocol(offered: List[str]) -> Optional[str]:
+    """Pick the first subprotocol the client offered that we can speak.
+
+    Returns None for clients that offered none, which keeps them on plain JSON
+    without a Sec-WebSocket-Protocol header, exactly as before.
+    """
+    for subprotocol in offered:
+        wire_format = SUBPROTOCOLS.get(subprotocol)
+        if wire_format and wire_format in available_formats():
+            return subprotocol
+    return None
+
+
+def format_for(subprotocol: Optional[str]) -> str:
+    return SUBPROTOCOLS.get(subprotocol, JSON)
+
+
+def decode(message: Dict[str, Any]) -> Any:
+    """Decode an ASGI websocket.receive event: text frames are JSON, binary frames MessagePack."""
+    if message.get("text") is not None:
+        return loads_text(message["text"])
+    data = message.get("bytes")
+    if data is None:
+        raise ValueError("Empty WebSocket frame")
+    if msgpack is None:
+        raise ValueError("Binary frames are not supported")
+    return unpack(data)
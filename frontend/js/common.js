@@ -5,4 +5,28 @@ function showWarning(message) {
     alert('Warning: ' + message);
 }
 
-// Additional helper functions for formatting time, managing local storage etc.
\ No newline at end of file
+// Additional helper functions for formatting time, managing local storage etc.
+
+// Signaling sockets offer MessagePack when the msgpack library is loaded, and JSON otherwise.
+// The server picks one subprotocol; servers that pick none keep speaking JSON.
+const MSGPACK_SUBPROTOCOL = 'exam-signaling.msgpack';
+const JSON_SUBPROTOCOL = 'exam-signaling.json';
+
+function createSignalingSocket(url) {
+    const protocols = window.MessagePack ? [MSGPACK_SUBPROTOCOL, JSON_SUBPROTOCOL] : [JSON_SUBPROTOCOL];
+    const socket = new WebSocket(url, protocols);
+    socket.binaryType = 'arraybuffer';
+    socket.sendMessage = function (message) {
+        if (socket.protocol === MSGPACK_SUBPROTOCOL) {
+            socket.send(MessagePack.encode(message));
+        } else {
+            socket.send(JSON.stringify(message));
+        }
+    };
+    return socket;
+}
+
+function decodeSignalingMessage(event) {
+    if (typeof event.data === 'string') return JSON.parse(event.data);
+    return MessagePack.decode(new Uint8Array(event.data));
+}
@@ -25,6 +25,13 @@ document.addEventListener('DOMContentLoaded', async function () {
     let answersData = {};
     let timerInterval = null;
     let remainingTime = 0; // in seconds
+    let dirtyAnswers = {}; // questionId -> seq of the newest unsaved edit
+    let answerSeq = 0;
+    let autosaveInterval = null;
+    let examSubmitted = false;
+    const sentAnswers = {}; // saveAnswers id -> the dirty entries it carried
+    let resumeToken = null;
+    let reconnectDelay = 1000;
 
     // Initialize webcam preview and request media
     async function initializeWebcam() {
@@ -49,32 +56,73 @@ document.addEventListener('DOMContentLoaded', async function () {
     // Setup WebSocket and WebRTC signaling (simplified)
     async function setupWebRTC() {
         webrtcStatus.textContent = 'Connecting...';
-        socket = new WebSocket(`ws://${window.location.hostname}:8000/ws`);
-
-        socket.onopen = function () {
-            socket.send(JSON.stringify({
-                type: 'joinRoom',
-                data: {
-                    room: sessionStorage.getItem('examCode'),
-                    username: sessionStorage.getItem('studentId'),
-                    role: 'student'
-                }
-            }));
-        };
+        openSignaling(joinRoom);
+    }
+
+    function joinRoom() {
+        socket.sendMessage({
+            type: 'joinRoom',
+            data: {
+                room: sessionStorage.getItem('examCode'),
+                username: sessionStorage.getItem('studentId'),
+                role: 'student'
+            }
+        });
+    }
+
+    // After a dropped connection, take the same participant and media back
+    function resumeSession() {
+        socket.sendMessage({
+            type: 'resume',
+            data: { token: resumeToken, room: sessionStorage.getItem('examCode') }
+        });
+    }
+
+    function openSignaling(onOpen) {
+        const ws = socket = createSignalingSocket(`ws://${window.location.hostname}:8000/ws`);
+        socket.onopen = onOpen;
 
         socket.onmessage = async function (event) {
-            const message = JSON.parse(event.data);
+            const message = decodeSignalingMessage(event);
             switch (message.type) {
+                case 'ping':
+                    // Heartbeat; the server closes sockets that stay silent
+                    socket.sendMessage({ type: 'pong' });
+                    break;
                 case 'roomJoined':
                     webrtcStatus.textContent = 'Connected';
+                    resumeToken = message.data.resumeToken;
+                    reconnectDelay = 1000;
                     // Initialize RTC here using message.data.rtpCapabilities
                     break;
+                case 'roomResumed':
+                    // Transports and producers were kept; only unsaved answers need resending
+                    webrtcStatus.textContent = 'Connected';
+                    resumeToken = message.data.resumeToken;
+                    reconnectDelay = 1000;
+                    break;
+                case 'resumeFailed':
+                    resumeToken = null;
+                    joinRoom();
+                    break;
+                case 'joinQueued':
+                    // Many students are joining at once; the server lets us in shortly
+                    webrtcStatus.textContent = `Waiting to join (position ${message.data.position}, about ${Math.ceil(message.data.estimatedWait)}s)`;
+                    break;
                 case 'transportCreated':
                     // Handle transport creation (exchange DTLS parameters here)
                     break;
                 case 'newProducer':
                     // Handle new producer (if teacher media shows up)
                     break;
+                case 'answersSaved':
+                    markAnswersSaved(message.data);
+                    break;
+                case 'examSubmitted':
+                    examSubmitted = true;
+                    clearInterval(autosaveInterval);
+                    dirtyAnswers = {};
+                    break;
                 case 'error':
                     console.error('Error:', message.data.message);
                     break;
@@ -82,7 +130,13 @@ document.addEventListener('DOMContentLoaded', async function () {
         };
 
         socket.onclose = () => {
+            // A socket already replaced by a newer one closing is not a disconnect
+            if (ws !== socket) return;
             webrtcStatus.textContent = 'Disconnected';
+            if (examSubmitted) return;
+            webrtcStatus.textContent = 'Reconnecting...';
+            setTimeout(() => openSignaling(resumeToken ? resumeSession : joinRoom), reconnectDelay);
+            reconnectDelay = Math.min(reconnectDelay * 2, 10000);
         };
 
         socket.onerror = (err) => {
@@ -130,7 +184,7 @@ document.addEventListener('DOMContentLoaded', async function () {
         timerInterval = setInterval(() => {
             if (remainingTime <= 0) {
                 clearInterval(timerInterval);
-                // Auto submit exam logic here
+                submitExam();
             } else {
                 remainingTime--;
                 const hrs = String(Math.floor(remainingTime / 3600)).padStart(2, '0');
@@ -141,6 +195,51 @@ document.addEventListener('DOMContentLoaded', async function () {
         }, 1000);
     }
 
+    // Record an edit; the autosave loop sends it with the next batch
+    function recordAnswer(questionId, value) {
+        answersData[questionId] = value;
+        dirtyAnswers[questionId] = ++answerSeq;
+    }
+
+    function pendingAnswers() {
+        // A timestamp seq keeps ordering across reconnects and page reloads
+        const seq = Date.now();
+        return Object.keys(dirtyAnswers).map(questionId => ({
+            questionId,
+            answer: answersData[questionId],
+            seq
+        }));
+    }
+
+    // Send edits in batches every few seconds instead of on every keystroke
+    function saveAnswers() {
+        const answers = pendingAnswers();
+        if (!answers.length || examSubmitted || !socket || socket.readyState !== WebSocket.OPEN) return;
+        const sent = { ...dirtyAnswers };
+        socket.sendMessage({
+            type: 'saveAnswers',
+            data: { id: answerSeq, answers }
+        });
+        sentAnswers[answerSeq] = sent;
+    }
+
+    // Forget edits the server has stored, unless they changed again since
+    function markAnswersSaved(data) {
+        const sent = sentAnswers[data.id] || {};
+        delete sentAnswers[data.id];
+        Object.keys(sent).forEach(questionId => {
+            if (dirtyAnswers[questionId] === sent[questionId]) delete dirtyAnswers[questionId];
+        });
+    }
+
+    function submitExam() {
+        if (examSubmitted || !socket || socket.readyState !== WebSocket.OPEN) return;
+        socket.sendMessage({
+            type: 'submitExam',
+            data: { answers: pendingAnswers() }
+        });
+    }
+
     // Generate question navigation buttons
     function generateQuestionButtons() {
         const container = document.getElementById('question-buttons');
@@ -181,6 +280,7 @@ document.addEventListener('DOMContentLoaded', async function () {
                 input.id = `option-${question.id}-${option.id}`;
                 input.value = option.id;
                 if (answersData[question.id] === option.id) input.checked = true;
+                input.addEventListener('change', () => recordAnswer(question.id, option.id));
 
                 const label = document.createElement('label');
                 label.className = 'form-check-label';
@@ -198,6 +298,7 @@ document.addEventListener('DOMContentLoaded', async function () {
             textarea.rows = 5;
             textarea.placeholder = 'Write your answer here...';
             textarea.value = answersData[question.id] || '';
+            textarea.addEventListener('input', () => recordAnswer(question.id, textarea.value));
             questionElem.appendChild(textarea);
         }
 
@@ -218,6 +319,7 @@ document.addEventListener('DOMContentLoaded', async function () {
         examContent.style.display = 'block';
         await setupWebRTC();
         fetchExamDetails();
+        autosaveInterval = setInterval(saveAnswers, 3000);
     });
 
     // Initialize webcam as soon as the page loads
@@ -10,29 +10,39 @@ document.addEventListener('DOMContentLoaded', function () {
 
     // For this demo, assume teacher client tracks active producers from students
     let studentFeeds = {}; // Maps studentId to video element
+    let studentVideoConsumers = {}; // Maps studentId to video consumer ID
+    let focusedStudentId = null;
+
+    // Simulcast layers: grid tiles get the thumbnail, the focused student the full stream
+    const THUMBNAIL_LAYERS = { spatialLayer: 0, temporalLayer: 0 };
+    const FOCUSED_LAYERS = { spatialLayer: 2, temporalLayer: 2 };
 
     // Connect to the WebSocket signaling server
     function setupWebSocket() {
-        socket = new WebSocket(`ws://${window.location.hostname}:8000/ws`);
+        socket = createSignalingSocket(`ws://${window.location.hostname}:8000/ws`);
 
         socket.onopen = function () {
             console.log('Teacher WebSocket connected');
             // Join room as teacher
-            socket.send(JSON.stringify({
+            socket.sendMessage({
                 type: 'joinRoom',
                 data: {
                     room: roomCode,
                     username: sessionStorage.getItem('teacherId') || 'Teacher001',
                     role: 'teacher'
                 }
-            }));
+            });
         };
 
         socket.onmessage = function (event) {
-            const message = JSON.parse(event.data);
+            const message = decodeSignalingMessage(event);
             console.log('Teacher received:', message);
 
             switch (message.type) {
+                case 'ping':
+                    // Heartbeat; the server closes sockets that stay silent
+                    socket.sendMessage({ type: 'pong' });
+                    break;
                 case 'userJoined':
                     // When a student joins, add a placeholder for their video feed
                     addStudentFeed(message.data);
@@ -41,6 +51,22 @@ document.addEventListener('DOMContentLoaded', function () {
                     // When a student starts producing, teacher may display or update status.
                     updateStudentFeed(message.data);
                     break;
+                case 'consumerCreated':
+                    trackStudentConsumer(message.data);
+                    break;
+                case 'audioActivity':
+                    showAudioActivity(message.data);
+                    break;
+                case 'consumerClosed':
+                    forgetStudentConsumer(message.data.consumerId);
+                    break;
+                case 'userSuspended':
+                    // Connection lost; the student may still resume within the grace period
+                    markStudentFeed(message.data.userId, true);
+                    break;
+                case 'userResumed':
+                    markStudentFeed(message.data.userId, false);
+                    break;
                 case 'userLeft':
                     removeStudentFeed(message.data.userId);
                     break;
@@ -90,12 +116,20 @@ document.addEventListener('DOMContentLoaded', function () {
         cardBody.appendChild(video);
         cardBody.appendChild(title);
         card.appendChild(cardBody);
+        card.addEventListener('click', () => focusStudent(studentId));
         col.appendChild(card);
 
         studentsContainer.appendChild(col);
         studentFeeds[studentId] = video;
     }
 
+    // Grey out a student whose connection dropped until they resume or leave
+    function markStudentFeed(studentId, suspended) {
+        const col = document.getElementById(`student-${studentId}`);
+        if (!col) return;
+        col.querySelector('.card').classList.toggle('opacity-50', suspended);
+    }
+
     // Update student's feed status (for example, when a new producer is created)
     function updateStudentFeed(data) {
         const studentId = data.producerUserId;
@@ -103,11 +137,64 @@ document.addEventListener('DOMContentLoaded', function () {
         // In a real implementation, teacher would consume the student's stream.
     }
 
+    // Remember the video consumer for a student and start it on the thumbnail layer
+    function trackStudentConsumer(data) {
+        if (data.kind !== 'video') return;
+        studentVideoConsumers[data.producerUserId] = data.id;
+        const layers = data.producerUserId === focusedStudentId ? FOCUSED_LAYERS : THUMBNAIL_LAYERS;
+        setPreferredLayers(data.id, layers);
+    }
+
+    // Highlight students the server hears speaking; their audio can then be consumed on demand
+    function showAudioActivity(data) {
+        const col = document.getElementById(`student-${data.studentId}`);
+        if (!col) return;
+        const card = col.querySelector('.card');
+        card.classList.toggle('border-warning', data.speaking);
+        card.classList.toggle('border-3', data.speaking);
+        card.title = data.speaking ? `Speaking (${data.level} dBFS)` : '';
+    }
+
+    // The student's producer went away, so the server closed our consumer of it
+    function forgetStudentConsumer(consumerId) {
+        for (const [studentId, id] of Object.entries(studentVideoConsumers)) {
+            if (id === consumerId) delete studentVideoConsumers[studentId];
+        }
+    }
+
+    function setPreferredLayers(consumerId, layers) {
+        if (!socket || socket.readyState !== WebSocket.OPEN) return;
+        socket.sendMessage({
+            type: 'setPreferredLayers',
+            data: { consumerId, ...layers }
+        });
+    }
+
+    // Switch the clicked student to high resolution and drop the previous one back to a thumbnail
+    function focusStudent(studentId) {
+        if (focusedStudentId === studentId) return;
+        const previousId = focusedStudentId;
+        focusedStudentId = studentId;
+
+        if (previousId && studentVideoConsumers[previousId]) {
+            setPreferredLayers(studentVideoConsumers[previousId], THUMBNAIL_LAYERS);
+            const previousCard = document.getElementById(`student-${previousId}`);
+            if (previousCard) previousCard.classList.remove('border', 'border-success');
+        }
+        if (studentVideoConsumers[studentId]) {
+            setPreferredLayers(studentVideoConsumers[studentId], FOCUSED_LAYERS);
+        }
+        const card = document.getElementById(`student-${studentId}`);
+        if (card) card.classList.add('border', 'border-success');
+    }
+
     // Remove student's feed if they leave
     function removeStudentFeed(studentId) {
         const el = document.getElementById(`student-${studentId}`);
         if (el) el.remove();
         delete studentFeeds[studentId];
+        delete studentVideoConsumers[studentId];
+        if (focusedStudentId === studentId) focusedStudentId = null;
     }
 
     // Initialize connection